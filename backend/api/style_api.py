@@ -1,13 +1,70 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 import os
 from pathlib import Path
-from ..models.dataset_handler import MMFashionDataset
+from models.attribute_store import AttributeStore, FIELDS
+from embedding_utils import search_images
 
 # Create a Blueprint for style-related routes
 style_bp = Blueprint('style', __name__)
 
-# Initialize the dataset
-clothing_dataset = MMFashionDataset()
+ATTRIBUTES_FILE = os.environ.get(
+    "CODRESS_ATTRIBUTES_FILE", str(Path(__file__).resolve().parent.parent / "data" / "index" / "attributes.npz"))
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+
+# Attribute store with bitmap indexes on every field, loaded from ATTRIBUTES_FILE
+clothing_dataset = AttributeStore(ATTRIBUTES_FILE).load()
+
+@style_bp.before_request
+def refresh_attributes():
+    # Reload if another process rewrote the file
+    clothing_dataset.refresh()
+
+def parse_filters(data):
+    """Returns ({field: value or [values]}, error) from the request body."""
+    filters = data.get('filters') or {}
+    if not isinstance(filters, dict):
+        return None, "'filters' must be an object"
+    for field, wanted in filters.items():
+        if field not in FIELDS:
+            return None, f"Unknown attribute '{field}', expected one of {', '.join(FIELDS)}"
+        if not isinstance(wanted, (str, list)) or (isinstance(wanted, list) and not all(isinstance(v, str) for v in wanted)):
+            return None, f"Filter '{field}' must be a string or a list of strings"
+    return filters, None
+
+def parse_limit(data):
+    limit = data.get('limit', DEFAULT_LIMIT)
+    if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= MAX_LIMIT:
+        return None, f"'limit' must be an integer between 1 and {MAX_LIMIT}"
+    return limit, None
+
+def caller_partition():
+    """The caller's wardrobe partition, or the shared catalogue (see app.caller_partition)."""
+    return current_app.config['CALLER_PARTITION']()
+
+def hybrid_search(partition, query, filters, limit, style=None, threshold=None):
+    """
+    Items of partition matching filters, ranked by CLIP similarity to query.
+    The filter runs first on the attribute bitmaps; only the matching rows
+    are scored.
+    """
+    store = partition.store
+    with store.lock:
+        image_paths, image_embeddings = store.snapshot()
+        rows = clothing_dataset.embedding_rows(store, filters)
+    if rows.size == 0:
+        return []
+    results = search_images(query, image_embeddings, image_paths, style, k=limit, limit=limit,
+                            threshold=threshold, rows=rows)
+    items = []
+    for result in results:
+        item = clothing_dataset.get_item(result["filename"]) or {"id": result["filename"]}
+        items.append(dict(item, score=result["score"], url=f"{partition.url_prefix}{result['filename']}"))
+    return items
+
+def suggestion(item, style):
+    words = " ".join(item[field] for field in ("color", "pattern", "category") if item.get(field))
+    return f"This {words or 'item'} would look great with your {style} style!"
 
 @style_bp.route('/categories')
 def categories():
@@ -19,31 +76,60 @@ def attributes():
     """Return all clothing attributes and their possible values"""
     return jsonify({"attributes": clothing_dataset.get_attributes()})
 
+@style_bp.route('/search', methods=['POST'])
+def search():
+    """Text search restricted to items with the given attributes"""
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+    data = request.get_json()
+    query = data.get('query', '')
+    if not isinstance(query, str) or not query.strip():
+        return jsonify({"error": "query is required"}), 400
+    filters, error = parse_filters(data)
+    if not error:
+        limit, error = parse_limit(data)
+    threshold = data.get('threshold')
+    if not error and threshold is not None and (not isinstance(threshold, (int, float)) or isinstance(threshold, bool)):
+        error = "'threshold' must be a number"
+    if error:
+        return jsonify({"error": error}), 400
+
+    items = hybrid_search(caller_partition(), query, filters, limit, style=data.get('style'), threshold=threshold)
+    return jsonify({"results": items, "filters": filters})
+
 @style_bp.route('/preferences', methods=['POST'])
 def handle_preferences():
     """Process style preferences and return matching items"""
     if not request.is_json:
         return jsonify({"error": "Request must be JSON"}), 400
-    
+
     data = request.get_json()
     style = data.get('style', 'casual')  # Default to casual
     wardrobe_text = data.get('wardrobe', '')
-    
-    # Get matching items based on style
-    matching_items = clothing_dataset.get_matching_items(style)
-    
+    if not isinstance(wardrobe_text, str):
+        return jsonify({"error": "wardrobe must be a string"}), 400
+    filters, error = parse_filters(data)
+    if not error:
+        limit, error = parse_limit(data)
+    if error:
+        return jsonify({"error": error}), 400
+    filters = dict(filters, style=style)
+
+    # Items with the requested style (and filters); ranked by CLIP when there is wardrobe text
+    partition = caller_partition()
+    if wardrobe_text.strip():
+        matching_items = hybrid_search(partition, wardrobe_text, filters, limit, style=style, threshold=-1.0)
+    elif partition.owner is None:
+        matching_items = clothing_dataset.matching_items(filters, limit)
+    else:
+        # A wardrobe only lists its own items: the filter bitmap is ANDed with the partition's
+        matching_items = clothing_dataset.matching_items(filters, limit, store=partition.store)
+
     # Convert to a format frontend can use
     result = []
     for item in matching_items:
-        result.append({
-            "id": item['id'],
-            "category": item['category'],
-            "color": item['color'],
-            "pattern": item['pattern'],
-            "material": item['material'],
-            "suggestion": f"This {item['color']} {item['pattern']} {item['category']} would look great with your {style} style!"
-        })
-    
+        result.append(dict(item, url=item.get("url") or f"{partition.url_prefix}{item['id']}", suggestion=suggestion(item, style)))
+
     return jsonify({
         "message": "Style preferences processed",
         "style": style,
@@ -51,19 +137,16 @@ def handle_preferences():
         "matching_suggestions": result
     })
 
-@style_bp.route('/item/<item_id>')
+@style_bp.route('/item/<path:item_id>')
 def get_item(item_id):
     """Return details for a specific item"""
-    # In a real implementation, we would fetch the item from the database
-    # For now, we'll create a sample item
-    item = {
-        "id": item_id,
-        "category": "shirt",
-        "color": "blue",
-        "pattern": "solid",
-        "material": "cotton",
-        "style": "formal",
-        "suggestion": "This blue solid shirt would go well with navy pants and brown shoes."
-    }
-    
-    return jsonify({"item": item}) 
\ No newline at end of file
+    partition = caller_partition()
+    item = clothing_dataset.get_item(item_id)
+    # Owners only see the items stored in their own wardrobe partition
+    if partition.owner is not None and partition.store.row_of(item_id) is None:
+        item = None
+    if item is None:
+        return jsonify({"error": "Item not found"}), 404
+    item["suggestion"] = suggestion(item, item.get("style") or "own")
+
+    return jsonify({"item": item})
@@ -1,14 +1,37 @@
 # app.py
-from flask import Flask, request, jsonify, send_from_directory, render_template_string
+from flask import Flask, request, jsonify, send_file, render_template_string, g, Response
 import os
+import time
 import numpy as np
-from embedding_utils import encode_images_from_folder, search_images, encode_single_image
+from embedding_utils import search_images, search_images_batch, search_similar, encode_image_bytes, DEFAULT_SIMILAR_K, warm_text_cache, text_cache, text_scheduler, image_scheduler, use_remote_text_encoder, MODEL_NAME
+from index_manifest import sync_index
+from ingest_queue import IngestionQueue, QueueFullError
+from index_store import index_exists, migrate_npy
+from embedding_store import EmbeddingStore
+from model_server import ModelServer, ModelClient, ModelServerError, RemoteIngestionQueue
+from vector_index import create_index
+from knn_graph import KNNGraph
+from zero_shot import LabelScores, load_label_set
+from clip_model import start_background_warmup, model_status, is_warm
+from metrics import registry, stage, REQUEST_SECONDS, REQUESTS_TOTAL
+from log_utils import get_logger
+import atexit
+import threading
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from thumbnails import get_thumbnail, nearest_width, remove_thumbnails, THUMBNAIL_WIDTHS
+from catalogue import CatalogueView, InvalidCursorError, DEFAULT_PAGE_SIZE
+from query_planner import FUSION_STRATEGIES
+from result_cache import SearchResultCache, search_key
+from partitions import Partition, PartitionManager, partition_id
+from api.style_api import style_bp
 import uuid
 import json
 import shutil
-import traceback
+import secrets
+import contextlib
 
 # Custom JSON encoder to handle numpy types
 class NumpyEncoder(json.JSONEncoder):
@@ -29,10 +52,55 @@ CORS(app)  # Enable CORS for all routes
 # Use custom JSON encoder for Flask
 app.json.encoder = NumpyEncoder
 
+log = get_logger("app")
+
 # Configuration
-IMAGE_FOLDER = os.path.join(os.path.dirname(__file__), 'data')
-EMBEDDINGS_FILE = os.path.join(IMAGE_FOLDER, 'image_embeddings.npy')
+IMAGE_FOLDER = os.environ.get('CODRESS_DATA_DIR', os.path.join(os.path.dirname(__file__), 'data'))
+EMBEDDINGS_FILE = os.path.join(IMAGE_FOLDER, 'image_embeddings.npy')  # legacy pickled format, migrated on startup
 IMAGE_PATHS_FILE = os.path.join(IMAGE_FOLDER, 'image_paths.json')
+INDEX_DIR = os.path.join(IMAGE_FOLDER, 'index')
+INCOMING_FOLDER = os.path.join(IMAGE_FOLDER, 'incoming')
+JOBS_FOLDER = os.path.join(IMAGE_FOLDER, 'jobs')
+USERS_FOLDER = os.path.join(IMAGE_FOLDER, 'users')
+SECRET_KEY_FILE = os.path.join(IMAGE_FOLDER, 'secret.key')
+INDEX_DTYPE = os.environ.get('CODRESS_INDEX_DTYPE', 'float32')
+# Number of appended uploads after which the append log is folded into the base index
+COMPACT_EVERY = int(os.environ.get('CODRESS_COMPACT_EVERY', '256'))
+# Run a dummy forward pass in the background at startup so the first request is fast
+MODEL_WARMUP = os.environ.get('CODRESS_MODEL_WARMUP', '1') != '0'
+# Background ingestion of uploads
+INGEST_WORKERS = int(os.environ.get('CODRESS_INGEST_WORKERS', '1'))
+INGEST_MAX_PENDING = int(os.environ.get('CODRESS_INGEST_MAX_PENDING', '1000'))
+INGEST_MAX_RETRIES = int(os.environ.get('CODRESS_INGEST_MAX_RETRIES', '3'))
+# Uploaded filenames are random and never reused, so images can be cached for a year
+IMAGE_CACHE_SECONDS = int(os.environ.get('CODRESS_IMAGE_CACHE_SECONDS', str(365 * 24 * 3600)))
+THUMBNAILS_AT_INGEST = os.environ.get('CODRESS_THUMBNAILS_AT_INGEST', '1') != '0'
+# Skip uploads already in the index byte for byte; uploads within CODRESS_DEDUP_THRESHOLD cosine
+# similarity of a stored image are indexed and flagged (dropped with CODRESS_DEDUP_DROP_SIMILAR=1)
+DEDUP_AT_INGEST = os.environ.get('CODRESS_DEDUP', '1') != '0'
+# Images listed (as thumbnails) on the / page
+ROOT_PAGE_SIZE = int(os.environ.get('CODRESS_ROOT_PAGE_SIZE', '50'))
+MAX_BATCH_QUERIES = int(os.environ.get('CODRESS_MAX_BATCH_QUERIES', '64'))
+MAX_QUERY_PARTS = int(os.environ.get('CODRESS_MAX_QUERY_PARTS', '16'))
+RESULT_CACHE_ENTRIES = int(os.environ.get('CODRESS_RESULT_CACHE_SIZE', '2048'))
+RESULT_CACHE_BYTES = int(os.environ.get('CODRESS_RESULT_CACHE_MB', '32')) << 20
+MAX_SIMILAR_K = int(os.environ.get('CODRESS_MAX_SIMILAR_K', '100'))
+# Opt-in precomputed neighbour lists for /api/similar (O(n^2) to build once)
+KNN_GRAPH = os.environ.get('CODRESS_KNN_GRAPH', '0') == '1'
+KNN_K = int(os.environ.get('CODRESS_KNN_K', '16'))
+# Zero-shot style/category/color scores computed at ingest, for the "labels" search filter
+ZERO_SHOT_LABELS = os.environ.get('CODRESS_ZERO_SHOT', '1') != '0'
+LABEL_SET = load_label_set() if ZERO_SHOT_LABELS else None
+# Optional file with one common search query per line, encoded into the text cache at startup
+WARM_QUERIES_FILE = os.environ.get('CODRESS_WARM_QUERIES_FILE')
+# Deployment role: standalone (one process does everything), server (owns the model and the
+# index, see model_server.py) or worker (read-only HTTP worker attached to a server)
+ROLE = os.environ.get('CODRESS_ROLE', 'standalone')
+# Per-user wardrobe partitions (see partitions.py); 0 sends every upload to the shared catalogue
+USER_PARTITIONS = os.environ.get('CODRESS_USER_PARTITIONS', '1') != '0'
+PARTITION_MAX_LOADED = int(os.environ.get('CODRESS_PARTITION_MAX_LOADED', '64'))
+PARTITION_IDLE_SECONDS = int(os.environ.get('CODRESS_PARTITION_IDLE_SECONDS', '900'))
+MODEL_SOCKET = os.environ.get('CODRESS_MODEL_SOCKET', os.path.join(IMAGE_FOLDER, 'model.sock'))
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
 
@@ -46,72 +114,333 @@ TEMP_USERS = {
 os.makedirs(IMAGE_FOLDER, exist_ok=True)
 os.makedirs("embeddings", exist_ok=True)
 
-# Clean up old embeddings file if it's corrupted
-if os.path.exists(EMBEDDINGS_FILE):
+def load_secret_key():
+    """Signing key for user tokens: CODRESS_SECRET_KEY, else a random key kept in data/secret.key."""
+    key = os.environ.get('CODRESS_SECRET_KEY')
+    if key:
+        return key
     try:
-        data = np.load(EMBEDDINGS_FILE, allow_pickle=True).item()
-        # Verify data integrity - check if paths are strings and embeddings are arrays
-        valid_data = True
-        if not isinstance(data, dict) or "embeddings" not in data or "paths" not in data:
-            valid_data = False
-        elif len(data["paths"]) > 0:
-            # Check first path to see if it's a string           
-            if not isinstance(data["paths"][0], str):
-                valid_data = False
-        
-        if not valid_data:
-            print("Corrupted embeddings file detected. Removing it...")
-            os.remove(EMBEDDINGS_FILE)
-            print("Embeddings file removed. Will regenerate on startup.")
-    except Exception as e:
-        print(f"Error with embeddings file: {str(e)}. Removing it.")
-        os.remove(EMBEDDINGS_FILE)
-
-# Load or generate embeddings
-if os.path.exists(EMBEDDINGS_FILE):
-    data = np.load(EMBEDDINGS_FILE, allow_pickle=True).item()
-    loaded_image_embeddings = data["embeddings"] 
-    loaded_image_paths = data["paths"]
-    print(f"[app.py] Initially loaded {len(loaded_image_paths)} paths and {loaded_image_embeddings.shape[0] if hasattr(loaded_image_embeddings, 'shape') else 'N/A'} embeddings from {EMBEDDINGS_FILE}")
-
-    # Filter loaded paths and embeddings to ensure they exist on disk
-    image_paths_filtered = []
-    image_embeddings_filtered_list = []
-
-    if hasattr(loaded_image_embeddings, 'shape') and loaded_image_embeddings.shape[0] == len(loaded_image_paths):
-        for i, path in enumerate(loaded_image_paths):
-            full_path = os.path.join(IMAGE_FOLDER, path)
-            if os.path.exists(full_path):
-                image_paths_filtered.append(path)
-                image_embeddings_filtered_list.append(loaded_image_embeddings[i])
-            else:
-                print(f"[app.py] Stale entry: Image file '{path}' not found at '{full_path}'. Discarding this entry.")
-        
-        if image_embeddings_filtered_list:
-            image_embeddings = np.array(image_embeddings_filtered_list)
-            image_paths = image_paths_filtered
-            print(f"[app.py] After validation: {len(image_paths)} paths and {image_embeddings.shape[0]} embeddings are valid and synchronized.")
-        else:
-            print("[app.py] After validation: No valid synchronized embeddings found. Initializing as empty.")
-            image_embeddings = np.array([])
-            image_paths = []
-    else:
-        print(f"[app.py] Mismatch between loaded embeddings count ({loaded_image_embeddings.shape[0] if hasattr(loaded_image_embeddings, 'shape') else 'N/A'}) and paths count ({len(loaded_image_paths)}). Or embeddings not an array. Initializing as empty. Consider regenerating embeddings if images exist.")
-        image_embeddings = np.array([])
-        image_paths = []
+        fd = os.open(SECRET_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(SECRET_KEY_FILE, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    key = secrets.token_hex(32)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(key)
+    return key
+
+app.config['SECRET_KEY'] = load_secret_key()
+# Login hands out a signed, timestamped username; requests carry it as "Authorization: Bearer <token>".
+# Tokens expire after CODRESS_TOKEN_MAX_AGE seconds; rotating the signing key revokes all of them at once.
+user_tokens = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='codress-user')
+TOKEN_MAX_AGE = int(os.environ.get('CODRESS_TOKEN_MAX_AGE', str(7 * 24 * 3600)))
 
+# The store owns the embeddings and paths; routes read consistent snapshots from it.
+# It is filled by the background initializer below, so the server binds its port immediately.
+store = EmbeddingStore(INDEX_DIR, MODEL_NAME, dtype=INDEX_DTYPE, compact_every=COMPACT_EVERY,
+                       vector_index=create_index(), publish=ROLE == 'server', read_only=ROLE == 'worker',
+                       neighbor_graph=KNNGraph(KNN_K) if KNN_GRAPH else None,
+                       label_scores=LabelScores(LABEL_SET) if LABEL_SET else None)
+atexit.register(store.close)
+app.config['EMBEDDING_STORE'] = store
+app.register_blueprint(style_bp, url_prefix='/api/style')
+catalogue = CatalogueView(store)
+# Serialized /api/search responses for the current index generation
+result_cache = SearchResultCache(RESULT_CACHE_ENTRIES, RESULT_CACHE_BYTES)
+# The shared store is the "catalogue" partition; each logged-in user gets their own under data/users
+shared = Partition(None, IMAGE_FOLDER, store, "/data/", result_cache, catalogue)
+partitions = PartitionManager(USERS_FOLDER, MODEL_NAME, dtype=INDEX_DTYPE, compact_every=COMPACT_EVERY,
+                              max_loaded=PARTITION_MAX_LOADED, idle_seconds=PARTITION_IDLE_SECONDS,
+                              publish=ROLE == 'server', read_only=ROLE == 'worker',
+                              label_set=LABEL_SET).start_idle_sweeper()
+atexit.register(partitions.close_all)
+if ROLE == 'worker':
+    # Workers never load CLIP: text encoding, uploads and index changes go to the model server
+    model_client = ModelClient(MODEL_SOCKET)
+    use_remote_text_encoder(model_client.encode_texts)
+    ingestion = RemoteIngestionQueue(model_client, INCOMING_FOLDER)
 else:
-    print(f"[app.py] {EMBEDDINGS_FILE} not found. Generating embeddings from {IMAGE_FOLDER}")
-    image_paths, image_embeddings = encode_images_from_folder(IMAGE_FOLDER)
-    if len(image_paths) > 0:
-        np.save(EMBEDDINGS_FILE, {"embeddings": image_embeddings, "paths": image_paths})
-        print(f"Generated embeddings for {len(image_paths)} images")
+    model_client = None
+    ingestion = IngestionQueue(store, IMAGE_FOLDER, INCOMING_FOLDER, JOBS_FOLDER, workers=INGEST_WORKERS,
+                               max_pending_files=INGEST_MAX_PENDING, max_retries=INGEST_MAX_RETRIES,
+                               thumbnails=THUMBNAILS_AT_INGEST, dedup=DEDUP_AT_INGEST,
+                               partitions=partitions if USER_PARTITIONS else None)
+index_ready = threading.Event()
+index_status = {"state": "loading", "error": None}
+
+def initialize_index():
+    """Loads the index, syncs it with the data folder and warms the text cache."""
+    # Migrate the legacy pickled .npy file once if needed
+    if not index_exists(INDEX_DIR) and os.path.exists(EMBEDDINGS_FILE):
+        try:
+            migrate_npy(EMBEDDINGS_FILE, INDEX_DIR, MODEL_NAME, dtype=INDEX_DTYPE)
+            log.info("%s is no longer used and can be deleted.", EMBEDDINGS_FILE)
+        except Exception as e:
+            log.error("Error with embeddings file: %s. Ignoring it.", e)
+
+    if not index_exists(INDEX_DIR):
+        log.info("%s not found. Generating embeddings from %s", INDEX_DIR, IMAGE_FOLDER)
+    store.load()
+    if store.deleted.size:
+        store.compact()
+
+    # Validate against the data folder with one directory scan and encode only added or changed images
+    synced_paths, synced_embeddings, synced_manifest, sync_stats = sync_index(
+        IMAGE_FOLDER, *store.snapshot(), store.manifest)
+    if sync_stats["added"] or sync_stats["changed"] or sync_stats["removed"] or not index_exists(INDEX_DIR):
+        store.replace(synced_paths, synced_embeddings, synced_manifest)
+    if len(store) > 0:
+        log.info("Index ready with %d images (%d reused, %d encoded, %d removed)", len(store),
+                 sync_stats["reused"], sync_stats["added"] + sync_stats["changed"], sync_stats["removed"])
     else:
-        print("No images found to process.")
-        image_embeddings = np.array([])
-        # image_paths is already defined from encode_images_from_folder, ensure it's an empty list if no images
-        if not image_paths: # If encode_images_from_folder returned empty paths
-            image_paths = []
+        log.info("No images found to process.")
+
+    # Resume uploads that were still pending when the process stopped
+    ingestion.recover()
+    ingestion.start()
+
+    if WARM_QUERIES_FILE and os.path.exists(WARM_QUERIES_FILE):
+        with open(WARM_QUERIES_FILE, 'r', encoding='utf-8') as f:
+            warm_text_cache(f.readlines())
+
+def attach_index():
+    """Worker role: waits until the model server has loaded the index, then maps it read-only."""
+    while True:
+        try:
+            if model_client.call("status")["index"]["state"] == "ready" and store.refresh():
+                break
+        except ModelServerError as e:
+            index_status["error"] = str(e)
+        time.sleep(1)
+    index_status["error"] = None
+    log.info("Attached read-only to the index in %s (%d images)", INDEX_DIR, len(store))
+
+def run_initialize_index():
+    try:
+        attach_index() if ROLE == 'worker' else initialize_index()
+        index_status["state"] = "ready"
+        index_ready.set()
+    except Exception as e:
+        index_status.update(state="error", error=str(e))
+        log.exception("Index initialization failed: %s", e)
+
+def local_status():
+    return {"model": model_status(), "warm": is_warm(), "index": dict(index_status, images=len(store))}
+
+def resync_index(full=False):
+    """
+    Re-syncs the index with the data folder; returns the sync stats. Hashing
+    and encoding run without the store lock, so searches and uploads go on;
+    uploads and deletes made meanwhile are merged in before the swap.
+    """
+    with store.lock:
+        if store.deleted.size:
+            store.compact()
+        generation = store.generation
+        image_paths, image_embeddings = store.snapshot()
+        before = set(image_paths)
+        manifest = dict(store.manifest)
+    image_paths, image_embeddings, index_manifest, stats = sync_index(
+        IMAGE_FOLDER, image_paths, image_embeddings, manifest, full=full)
+    with store.lock:
+        if store.generation != generation:
+            image_paths, image_embeddings, index_manifest = merge_concurrent_changes(
+                before, image_paths, image_embeddings, index_manifest)
+            stats["total"] = len(image_paths)
+        store.replace(image_paths, image_embeddings, index_manifest)
+    return stats
+
+def merge_concurrent_changes(before, image_paths, image_embeddings, index_manifest):
+    """
+    Applies the store changes made since the re-sync's snapshot (whose
+    filenames are before) to its result: images removed meanwhile are
+    dropped, images appended meanwhile are added with their stored vectors.
+    Caller holds store.lock.
+    """
+    live = store.live_paths()
+    live_set, synced = set(live), set(image_paths)
+    keep = [row for row, path in enumerate(image_paths)
+            if path in live_set or (path not in before and os.path.exists(os.path.join(IMAGE_FOLDER, path)))]
+    appended = [path for path in live if path not in before and path not in synced]
+    paths = [image_paths[row] for row in keep] + appended
+    parts = [np.asarray(image_embeddings[keep], dtype=np.float32)] if keep else []
+    if appended:
+        parts.append(store.embeddings[[store.row_of(path) for path in appended]])
+    embeddings = np.vstack(parts) if parts else np.empty((0, store.dim), dtype=np.float32)
+    manifest = {}
+    for row, path in enumerate(paths):
+        entry = index_manifest.get(path) or store.manifest.get(path)
+        if entry is not None:
+            manifest[path] = dict(entry, row=row)
+    return paths, embeddings, manifest
+
+def remove_image(filename, owner=None):
+    """Drops an image from the owner's (or the shared) index, folder and thumbnail cache. Returns False if unknown."""
+    with partitions.pinned(owner) if owner is not None else contextlib.nullcontext(shared) as partition:
+        with partition.store.lock:
+            if partition.store.remove([filename]) == 0:
+                return False
+        path = safe_join(os.path.abspath(partition.folder), filename)
+        if path and os.path.isfile(path):
+            os.remove(path)
+        remove_thumbnails(partition.folder, filename)
+    return True
+
+def model_server_handlers():
+    """Operations the server role answers for its workers."""
+    return {
+        "encode_texts": text_scheduler.map,
+        "encode_image_bytes": encode_image_bytes,
+        "status": local_status,
+        "inference_stats": lambda: {"text": text_scheduler.stats(), "image": image_scheduler.stats()},
+        "reserve": ingestion.reserve,
+        "release": ingestion.release,
+        "submit": ingestion.submit,
+        "job_status": ingestion.status,
+        "ingest_stats": ingestion.stats,
+        "remove": remove_image,
+        "reset": resync_index,
+    }
+
+if MODEL_WARMUP and ROLE != 'worker':
+    start_background_warmup()
+threading.Thread(target=run_initialize_index, name="index-init", daemon=True).start()
+model_server_thread = ModelServer(MODEL_SOCKET, model_server_handlers()).start() if ROLE == 'server' else None
+
+def index_not_ready():
+    """Returns a 503 response while the index is still loading, else None."""
+    if index_ready.is_set():
+        return None
+    response = jsonify({"error": "Index is not ready yet, please retry shortly.", "index": index_status})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+def collect_gauges():
+    """Point-in-time values added to /metrics at scrape time."""
+    cache = text_cache.stats()
+    results = result_cache.stats()
+    loaded = partitions.stats()
+    queues = {(("scheduler", s.name),): s.queue_depth() for s in (text_scheduler, image_scheduler)}
+    return [
+        ("codress_index_images", "Images in the search index", {(): len(store)}),
+        ("codress_index_ready", "1 once the index is loaded", {(): int(index_ready.is_set())}),
+        ("codress_text_cache_entries", "Entries in the text embedding cache", {(): cache["size"]}),
+        ("codress_text_cache_hits", "Text embedding cache hits since start", {(): cache["hits"]}),
+        ("codress_text_cache_misses", "Text embedding cache misses since start", {(): cache["misses"]}),
+        ("codress_result_cache_entries", "Entries in the search result cache", {(): results["size"]}),
+        ("codress_result_cache_bytes", "Bytes of cached search responses", {(): results["bytes"]}),
+        ("codress_result_cache_hits", "Search result cache hits since start", {(): results["hits"]}),
+        ("codress_result_cache_misses", "Search result cache misses since start", {(): results["misses"]}),
+        ("codress_result_cache_hit_ratio", "Search result cache hits / lookups since start", {(): results["hit_rate"]}),
+        ("codress_partitions_loaded", "User partitions open in memory", {(): loaded["loaded"]}),
+        ("codress_partition_images_loaded", "Images in the open user partitions", {(): loaded["images_loaded"]}),
+        ("codress_partition_evictions", "User partitions closed since start", {(): loaded["evictions"]}),
+        ("codress_inference_queue_depth", "Items waiting for an inference batch", queues),
+        ("codress_ingest_pending_files", "Uploaded files waiting to be indexed", {(): ingestion.stats()["pending_files"]}),
+    ]
+
+registry.add_collector(collect_gauges)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if ROLE == 'worker' and index_ready.is_set():
+        # The counter moved: load the generation the server published
+        store.refresh()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        # The route pattern keeps the label set small (/data/<path:filename>, not every file)
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint)
+        REQUESTS_TOTAL.inc(endpoint, str(response.status_code))
+    return response
+
+def query_options_error(options):
+    """Validates the optional per-query 'k' and 'threshold' fields; returns an error message or None."""
+    if options.get("k") is not None and (not isinstance(options["k"], int) or isinstance(options["k"], bool) or options["k"] < 1):
+        return "'k' must be a positive integer"
+    if options.get("threshold") is not None and (not isinstance(options["threshold"], (int, float)) or isinstance(options["threshold"], bool)):
+        return "'threshold' must be a number"
+    return None
+
+def search_options_error(data):
+    """Validates the compound-query options of /api/search."""
+    error = query_options_error(data)
+    if error:
+        return error
+    if data.get("fusion") is not None and data["fusion"] not in FUSION_STRATEGIES:
+        return f"'fusion' must be one of {', '.join(FUSION_STRATEGIES)}"
+    limit = data.get("limit")
+    if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 1):
+        return "'limit' must be a positive integer"
+    parts = data.get("parts")
+    if parts is not None:
+        if not isinstance(parts, list) or not parts or len(parts) > MAX_QUERY_PARTS:
+            return f"'parts' must be a list of 1 to {MAX_QUERY_PARTS} queries"
+        for part in parts:
+            if not isinstance(part, dict) or not isinstance(part.get("query"), str) or not part["query"].strip():
+                return "Each part needs a non-empty 'query' string"
+            error = query_options_error(part)
+            if error:
+                return error
+    labels = data.get("labels")
+    if labels is not None:
+        if store.label_scores is None:
+            return "Label filters are disabled on this server (CODRESS_ZERO_SHOT=0)"
+        return store.label_scores.filter_error(labels)
+    return None
+
+def similar_options():
+    """Parses ?k= and ?threshold= of /api/similar; returns (k, threshold, error)."""
+    k = request.args.get('k', str(DEFAULT_SIMILAR_K))
+    if not k.isdigit() or not 1 <= int(k) <= MAX_SIMILAR_K:
+        return None, None, f"k must be an integer between 1 and {MAX_SIMILAR_K}"
+    threshold = request.args.get('threshold')
+    if threshold is not None:
+        try:
+            threshold = float(threshold)
+        except ValueError:
+            return None, None, "threshold must be a number"
+    return int(k), threshold, None
+
+def current_owner():
+    """
+    Username of the caller's bearer token, None when anonymous. A forged
+    token raises BadSignature, an expired one SignatureExpired (a subclass).
+    """
+    header = request.headers.get('Authorization', '')
+    if not USER_PARTITIONS or not header.startswith('Bearer '):
+        return None
+    return user_tokens.loads(header[len('Bearer '):].strip(), max_age=TOKEN_MAX_AGE)
+
+def caller_partition():
+    """
+    The caller's wardrobe partition, or the shared catalogue for anonymous
+    requests. A wardrobe stays pinned until the request ends, so the idle and
+    LRU eviction cannot close its store while the request still reads it.
+    """
+    partition = g.get("partition")
+    if partition is None:
+        owner = current_owner()
+        if owner is None:
+            partition = shared
+        else:
+            g.partition_pin = contextlib.ExitStack()
+            partition = g.partition_pin.enter_context(partitions.pinned(owner))
+        g.partition = partition
+    return partition
+
+@app.teardown_request
+def unpin_partition(error=None):
+    pin = g.pop("partition_pin", None)
+    if pin is not None:
+        pin.close()
+
+# Blueprints (api/style_api.py) resolve the caller's partition through the app config
+app.config['CALLER_PARTITION'] = caller_partition
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -134,7 +463,7 @@ def register_api():
     
     # Store the new user (IMPORTANT: Hash password in a real app!)
     TEMP_USERS[username] = {"password": password}
-    print(f"New user registered: {username}") # Server log
+    log.info("New user registered: %s", username)
     
     # Optionally, log the user in directly or send to login page
     return jsonify({
@@ -154,25 +483,16 @@ def login_api():
 
     # Check credentials (IMPORTANT: This is insecure, for demo only!)
     if username in TEMP_USERS and TEMP_USERS[username]["password"] == password:
-        # In a real app, generate a session token or JWT here
+        # Signed token; sent back as a bearer token it scopes uploads and searches to the user's wardrobe
         return jsonify({
             "success": True, 
             "message": "Login successful",
-            "user": {"username": username} # You can add more user details
+            "user": {"username": username, "token": user_tokens.dumps(username)}
         })
     else:
         return jsonify({"error": "Invalid username or password"}), 401
 
-@app.route('/')
-def index():
-    """Root route to verify the server is running"""
-    image_list = []
-    for path in image_paths:
-        image_list.append(f"<li>{path}</li>")
-    
-    image_html = "<ul>" + "".join(image_list) + "</ul>" if image_list else "<p>No images found.</p>"
-    
-    html = """
+INDEX_TEMPLATE = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -192,69 +512,330 @@ def index():
         <p>Server is running. Available endpoints:</p>
         
         <div class="endpoint">
-            <h3>GET /api/images</h3>
-            <p>List all available images</p>
+            <h3>POST /api/login</h3>
+            <p>Returns a <code>token</code>; requests sent with <code>Authorization: Bearer &lt;token&gt;</code> upload to, list, search and delete from that user's own wardrobe instead of the shared catalogue</p>
+        </div>
+        
+        <div class="endpoint">
+            <h3>GET /api/images?limit=100&amp;cursor=...</h3>
+            <p>Paginated image list (<code>scope=catalogue</code> for the shared one); send <code>If-None-Match</code> to get 304 when nothing changed</p>
+        </div>
+        
+        <div class="endpoint">
+            <h3>DELETE /api/images/&lt;filename&gt;</h3>
+            <p>Remove an image and its embedding</p>
         </div>
         
         <div class="endpoint">
             <h3>POST /api/search</h3>
-            <p>Search for images with text query</p>
+            <p>Search for images with text query; compound queries accept <code>fusion</code> (max, rrf, quota), <code>limit</code>, <code>k</code>, <code>threshold</code> and per-part <code>parts</code></p>
             <code>{"query": "red dress"}</code>
+            <code>{"query": "white shirt and jeans", "fusion": "quota", "limit": 4}</code>
+            <p>Filter by the zero-shot labels scored at ingest before ranking: <code>{"query": "summer outfit", "labels": {"style": "casual", "category": ["dress", "skirt"]}}</code></p>
+            <p>Logged-in users can add <code>"includeCatalogue": true</code> to rank the shared catalogue with their wardrobe</p>
+            <p>Responses are cached per index generation and carry an ETag for <code>If-None-Match</code></p>
+        </div>
+        
+        <div class="endpoint">
+            <h3>GET /api/labels</h3>
+            <p>Label groups (style, category, color) usable as <code>labels</code> filters, with image counts per label</p>
+        </div>
+        
+        <div class="endpoint">
+            <h3>POST /api/search/batch</h3>
+            <p>Search many queries in one request</p>
+            <code>{"queries": [{"query": "white shirt", "k": 3}, {"query": "jeans", "style": "casual"}]}</code>
+        </div>
+        
+        <div class="endpoint">
+            <h3>POST /api/style/search</h3>
+            <p>Text search over items with the given attributes (category, color, pattern, material, style); the filter runs before scoring</p>
+            <code>{"query": "summer outfit", "filters": {"category": "dress", "color": ["white", "blue"]}, "limit": 10}</code>
+        </div>
+        
+        <div class="endpoint">
+            <h3>GET /api/similar/&lt;filename&gt;?k=12&amp;threshold=0.8</h3>
+            <p>Images most similar to an indexed image, using its stored embedding</p>
+        </div>
+        
+        <div class="endpoint">
+            <h3>POST /api/similar?k=12</h3>
+            <p>Images most similar to an uploaded <code>image</code>; the upload is encoded but not stored</p>
         </div>
         
         <div class="endpoint">
             <h3>POST /api/upload</h3>
-            <p>Upload a new image</p>
+            <p>Upload new images; returns a job ID right away</p>
+        </div>
+        
+        <div class="endpoint">
+            <h3>GET /api/jobs/&lt;id&gt;</h3>
+            <p>Per-file progress of an upload job; files already in the index are reported as <code>duplicate</code> with <code>duplicateOf</code>; indexed files that look like a stored image carry it in <code>similarTo</code></p>
         </div>
         
         <div class="endpoint">
-            <h3>GET /data/&lt;filename&gt;</h3>
-            <p>Retrieve image file</p>
+            <h3>GET /healthz, GET /readyz</h3>
+            <p>Liveness and readiness probes</p>
         </div>
         
-        <h3>Current images ({}):</h3>
-        {}
+        <div class="endpoint">
+            <h3>GET /metrics</h3>
+            <p>Per-stage latency histograms and counters (Prometheus format)</p>
+        </div>
+        
+        <div class="endpoint">
+            <h3>GET /data/&lt;filename&gt;?w=256</h3>
+            <p>Retrieve image file; with <code>w</code> a WebP thumbnail ({{ widths }})</p>
+        </div>
+        
+        <h3>Current images ({{ total }}{% if images|length < total %}, first {{ images|length }} shown{% endif %}):</h3>
+        {% if images %}
+        <ul>{% for image in images %}<li>{{ image.filename }}</li>{% endfor %}</ul>
         <div class="images">
-            {}
+            {% for image in images %}<img src="{{ image.url }}?w={{ thumbnail_width }}" alt="{{ image.filename }}" title="{{ image.filename }}" loading="lazy">{% endfor %}
         </div>
+        {% else %}
+        <p>No images found.</p>
+        {% endif %}
     </body>
     </html>
-    """.format(len(image_paths), image_html, 
-              "".join([f'<img src="/data/{path}" alt="{path}" title="{path}">' for path in image_paths]))
-    return render_template_string(html)
+"""
+
+@app.route('/')
+def index():
+    """Root route to verify the server is running"""
+    _, body = catalogue.page(limit=ROOT_PAGE_SIZE)
+    listing = json.loads(body)
+    return render_template_string(INDEX_TEMPLATE, images=listing["images"], total=listing["total"],
+                                  widths=", ".join(f"{w}px" for w in THUMBNAIL_WIDTHS),
+                                  thumbnail_width=THUMBNAIL_WIDTHS[0])
+
+def search_response(etag, body):
+    """JSON search response with an ETag; If-None-Match on the same results gets a 304."""
+    # make_conditional only handles GET/HEAD, searches are POSTed
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Authorization'
+    return response
 
 @app.route("/api/search", methods=["POST"])
 def search_api():
-    data = request.get_json()
-    query = data.get("query", "")
-    style = data.get("style", "")
-    print(f"[app.py] /api/search received: query='{query}', style='{style}'")
+    with stage("parse"):
+        data = request.get_json()
+        query = data.get("query", "")
+        style = data.get("style", "")
+    log.debug("/api/search received: query='%s', style='%s'", query, style)
 
-    if not query:
-        print("[app.py] /api/search error: query is required")
+    if not query and not data.get("parts"):
         return jsonify({"error": "query is required"}), 400
+    error = search_options_error(data)
+    if error:
+        return jsonify({"error": error}), 400
 
-    if image_embeddings is None or image_embeddings.size == 0 or not image_paths:
-        print("[app.py] /api/search error: No images or embeddings loaded.")
+    not_ready = index_not_ready()
+    if not_ready:
+        return not_ready
+
+    # A logged-in user searches their own wardrobe, optionally together with the shared catalogue
+    partition = caller_partition()
+    sources = [partition]
+    if data.get("includeCatalogue") and partition is not shared:
+        sources.append(shared)
+    labels = data.get("labels")
+    snapshots, generations = [], []
+    for source in sources:
+        with source.store.lock:
+            generations.append(source.store.generation)
+            # Label filters are a mask over the precomputed scores; only matching rows are scored
+            rows = source.store.label_scores.rows(labels) if labels else None
+            snapshots.append((source, rows, *source.store.snapshot()))
+    snapshots = [s for s in snapshots if s[3] is not None and s[3].size > 0 and s[2]]
+    if not snapshots:
+        log.debug("/api/search: no images or embeddings loaded")
         return jsonify([]), 200  # Return empty array if no images/embeddings
 
+    # Same query, options and index generation: replay the serialized response
+    key = search_key(query, style, data.get("k"), data.get("threshold"), data.get("fusion"),
+                     data.get("limit"), data.get("parts"), labels)
+    if len(sources) > 1:
+        key += f"|catalogue@{generations[1]}"
+    generation = generations[0]
+    cached = partition.result_cache.get(generation, key)
+    if cached is not None:
+        log.debug("/api/search served from the result cache")
+        return search_response(*cached)
+
     try:
-        results = search_images(query, image_embeddings, image_paths, style)
-        print(f"[app.py] /api/search results from search_images: {results}")
-        
-        # Add full URLs to the results (this part should be fine but double-check path generation)
-        for result in results:
-            result["url"] = f"/data/{result['filename']}"
-        
-        print(f"[app.py] /api/search returning with URLs: {results}")
-        return jsonify(results)
+        results = []
+        for source, rows, image_paths, image_embeddings in snapshots:
+            found = search_images(query, image_embeddings, image_paths, style, index=source.store.vector_index,
+                                  fusion=data.get("fusion") or "max", limit=data.get("limit"),
+                                  k=data.get("k"), threshold=data.get("threshold"), parts=data.get("parts"),
+                                  rows=rows)
+            for result in found:
+                result["url"] = f"{source.url_prefix}{result['filename']}"
+                if len(sources) > 1:
+                    result["partition"] = "wardrobe" if source is partition else "catalogue"
+            results.append(found)
+        if len(results) == 1:
+            results = results[0]
+        else:
+            # Each list already holds the requested number of hits; keep the best of both
+            size = max(len(found) for found in results)
+            results = sorted((r for found in results for r in found), key=lambda r: r["score"], reverse=True)[:size]
+
+        log.debug("/api/search returning: %s", results)
+        with stage("serialize"):
+            body = json.dumps(results, cls=NumpyEncoder)
+        return search_response(*partition.result_cache.put(generation, key, body))
+    except Exception as e:
+        log.exception("/api/search failed during search_images call or processing: %s", e)
+        return jsonify({"error": "An error occurred during search processing.", "details": str(e)}), 500
+
+@app.route("/api/search/batch", methods=["POST"])
+def search_batch_api():
+    with stage("parse"):
+        data = request.get_json(silent=True) or {}
+    queries = data.get("queries")
+
+    if not isinstance(queries, list) or not queries:
+        return jsonify({"error": "queries must be a non-empty list"}), 400
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({"error": f"At most {MAX_BATCH_QUERIES} queries per batch"}), 400
+    for q in queries:
+        if not isinstance(q, dict) or not isinstance(q.get("query"), str) or not q["query"].strip():
+            return jsonify({"error": "Each query needs a non-empty 'query' string"}), 400
+        error = query_options_error(q)
+        if error:
+            return jsonify({"error": error}), 400
+
+    not_ready = index_not_ready()
+    if not_ready:
+        return not_ready
+
+    partition = caller_partition()
+    image_paths, image_embeddings = partition.store.snapshot()
+    try:
+        all_results = search_images_batch(queries, image_embeddings, image_paths, index=partition.store.vector_index)
+        for results in all_results:
+            for result in results:
+                result["url"] = f"{partition.url_prefix}{result['filename']}"
+        with stage("serialize"):
+            return jsonify({"results": all_results})
     except Exception as e:
-        print(f"[app.py] /api/search EXCEPTION during search_images call or processing: {str(e)}")
-        # Consider logging the full traceback for debugging
-        import traceback
-        traceback.print_exc()
+        log.exception("/api/search/batch failed: %s", e)
         return jsonify({"error": "An error occurred during search processing.", "details": str(e)}), 500
 
+@app.route("/api/labels", methods=["GET"])
+def labels_api():
+    """The zero-shot label set and how many of the caller's images carry each label"""
+    not_ready = index_not_ready()
+    if not_ready:
+        return not_ready
+    partition = caller_partition()
+    scores = partition.store.label_scores
+    if scores is None:
+        return jsonify({"error": "Label scores are disabled on this server (CODRESS_ZERO_SHOT=0)"}), 404
+    with partition.store.lock:
+        counts = scores.counts(exclude=partition.store.deleted)
+    return jsonify({"labels": scores.label_set, "counts": counts})
+
+@app.route("/api/cache/stats", methods=["GET"])
+def cache_stats_api():
+    return jsonify({"text_embeddings": text_cache.stats(), "search_results": result_cache.stats(),
+                    "partitions": partitions.stats()})
+
+@app.route("/api/inference/stats", methods=["GET"])
+def inference_stats_api():
+    stats = model_client.call("inference_stats") if model_client else {"text": text_scheduler.stats(), "image": image_scheduler.stats()}
+    return jsonify(dict(stats, ingestion=ingestion.stats()))
+
+@app.route("/metrics", methods=["GET"])
+def metrics_api():
+    """Per-stage latency histograms, request counters and gauges in Prometheus text format"""
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/similar/<path:filename>", methods=["GET"])
+def similar_api(filename):
+    """
+    "More like this" for an indexed image. The query is the image's stored
+    row, so nothing is re-encoded; with CODRESS_KNN_GRAPH=1 the neighbours
+    come straight from the precomputed graph.
+    """
+    k, threshold, error = similar_options()
+    if error:
+        return jsonify({"error": error}), 400
+    not_ready = index_not_ready()
+    if not_ready:
+        return not_ready
+
+    partition = caller_partition()
+    graph = partition.store.neighbor_graph
+    with partition.store.lock:
+        image_paths, image_embeddings = partition.store.snapshot()
+        row = partition.store.row_of(filename)
+        neighbors = graph.lookup(row, k) if graph is not None and row is not None else None
+        deleted = partition.store.deleted
+        if neighbors is not None and deleted.size and np.isin(neighbors[0], deleted).any():
+            # The graph points at a deleted neighbour: fall back to a scan until the next compaction
+            neighbors = None
+    if row is None:
+        return jsonify({"error": "Image not found"}), 404
+
+    with stage("similarity"):
+        if neighbors is not None:
+            results = [{"filename": image_paths[i], "score": score}
+                       for i, score in zip(neighbors[0].tolist(), neighbors[1].tolist())
+                       if threshold is None or score >= threshold]
+        else:
+            results = search_similar(image_embeddings[row], image_embeddings, image_paths, k,
+                                     index=partition.store.vector_index, exclude_row=row, threshold=threshold)
+    for result in results:
+        result["url"] = f"{partition.url_prefix}{result['filename']}"
+    with stage("serialize"):
+        return jsonify(results)
+
+@app.route("/api/similar", methods=["POST"])
+def similar_upload_api():
+    """Query by example: the uploaded image is encoded in memory and never saved or indexed."""
+    k, threshold, error = similar_options()
+    if error:
+        return jsonify({"error": error}), 400
+    file = request.files.get('image')
+    if file is None or not allowed_file(file.filename or ''):
+        return jsonify({"error": "An 'image' file (png, jpg, jpeg, webp) is required"}), 400
+    not_ready = index_not_ready()
+    if not_ready:
+        return not_ready
+
+    data = file.read()
+    try:
+        if model_client:
+            query_embedding = model_client.call("encode_image_bytes", data)
+        else:
+            query_embedding = encode_image_bytes(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except ModelServerError as e:
+        if str(e).startswith("ValueError"):
+            return jsonify({"error": str(e)}), 400
+        log.error("/api/similar encoding failed: %s", e)
+        return jsonify({"error": "Image encoding is unavailable", "details": str(e)}), 503
+
+    partition = caller_partition()
+    image_paths, image_embeddings = partition.store.snapshot()
+    with stage("similarity"):
+        results = search_similar(query_embedding, image_embeddings, image_paths, k,
+                                 index=partition.store.vector_index, threshold=threshold)
+    for result in results:
+        result["url"] = f"{partition.url_prefix}{result['filename']}"
+    with stage("serialize"):
+        return jsonify(results)
+
 # Keep the old route for backward compatibility
 @app.route("/search", methods=["POST"])
 def search():
@@ -262,69 +843,62 @@ def search():
 
 @app.route("/api/upload", methods=["POST"])
 def upload_file_api():
-    global image_embeddings, image_paths
-    
+    not_ready = index_not_ready()
+    if not_ready:
+        return not_ready
+
     if 'images' not in request.files:
         return jsonify({"error": "No file part"}), 400
         
     files = request.files.getlist('images')
     if not files or files[0].filename == '':
         return jsonify({"error": "No selected file"}), 400
-    
-    uploaded_files = []
-    for file in files:
-        if file and allowed_file(file.filename):
-            # Generate unique filename to avoid overwriting
-            filename = secure_filename(file.filename)
-            ext = filename.rsplit('.', 1)[1].lower()
-            unique_filename = f"{uuid.uuid4().hex}.{ext}"
-            
-            filepath = os.path.join(IMAGE_FOLDER, unique_filename)
-            file.save(filepath)
-            
-            # Generate embedding for new image
-            try:
-                embedding = encode_single_image(filepath)
-                
-                # Add to existing embeddings
-                if image_embeddings.size > 0:
-                    image_embeddings = np.vstack([image_embeddings, embedding])
-                else:
-                    image_embeddings = embedding.reshape(1, -1)
-                    
-                image_paths.append(unique_filename)
-                uploaded_files.append({
-                    "filename": unique_filename,
-                    "url": f"/data/{unique_filename}"
-                })
-                print(f"Successfully processed and embedded image: {unique_filename}")
-                
-            except Exception as e:
-                os.remove(filepath)  # Clean up file if embedding fails
-                print(f"Failed to process image {filename}: {str(e)}")
-                continue
-    
-    if uploaded_files:
-        # Save updated embeddings
-        np.save(EMBEDDINGS_FILE, {"embeddings": image_embeddings, "paths": image_paths})
-        print(f"Saved updated embeddings for {len(image_paths)} images")
-        
-        # Return the complete updated list of images
-        images = []
-        for i, path in enumerate(image_paths):
-            images.append({
-                "id": i,
-                "filename": path,
-                "url": f"/data/{path}"
-            })
-        
-        return jsonify({
-            "success": True,
-            "uploaded": uploaded_files,
-            "allImages": images
-        })
-    
-    return jsonify({"error": "No files were successfully processed"}), 400
+
+    files = [file for file in files if file and allowed_file(file.filename)]
+    if not files:
+        return jsonify({"error": "No files were successfully processed"}), 400
+
+    # Backpressure: refuse the whole upload while too many files are waiting
+    try:
+        ingestion.reserve(len(files))
+    except QueueFullError as e:
+        response = jsonify({"error": "Too many uploads are being processed, please retry later.", "details": str(e)})
+        response.headers['Retry-After'] = '10'
+        return response, 429
+
+    # Save to the incoming folder; CLIP encoding happens on the ingestion workers
+    saved = []
+    try:
+        with stage("upload_save", items=len(files)):
+            for file in files:
+                # Generate unique filename to avoid overwriting
+                filename = secure_filename(file.filename)
+                ext = filename.rsplit('.', 1)[1].lower()
+                unique_filename = f"{uuid.uuid4().hex}.{ext}"
+                file.save(ingestion.incoming_path(unique_filename))
+                saved.append((unique_filename, filename))
+    except Exception as e:
+        ingestion.release(len(files))
+        for unique_filename, _ in saved:
+            os.remove(ingestion.incoming_path(unique_filename))
+        log.error("Failed to save upload: %s", e)
+        return jsonify({"error": "Failed to save uploaded files", "details": str(e)}), 500
+
+    job = ingestion.submit(saved, current_owner())
+    log.info("Queued ingestion job %s with %d files", job["id"], len(saved))
+    return jsonify({
+        "success": True,
+        "jobId": job["id"],
+        "statusUrl": f"/api/jobs/{job['id']}",
+        "job": job
+    }), 202
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def job_status_api(job_id):
+    job = ingestion.status(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
 
 # Keep the old route for backward compatibility
 @app.route("/upload", methods=["POST"])
@@ -333,66 +907,141 @@ def upload_file():
 
 @app.route('/data/<path:filename>')
 def serve_image(filename):
-    response = send_from_directory(os.path.abspath(IMAGE_FOLDER), filename)
-    # Add cache control headers to prevent caching
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
+    """
+    Serves an original image, or with ?w=<width> a WebP thumbnail at the nearest
+    configured width. The ETag is the content hash from the index manifest and
+    responses honour If-None-Match, If-Modified-Since and Range. Images in a
+    user's partition are only served to that user's bearer token, as private.
+    """
+    path = safe_join(os.path.abspath(IMAGE_FOLDER), filename)
+    folder = os.path.dirname(path) if path else None
+    shared_image = folder == os.path.abspath(IMAGE_FOLDER)
+    # Only images in the data folder or directly in a user's partition folder: data also
+    # holds the model server socket and key, partitions keep their index in a subfolder
+    if path is None or not allowed_file(filename) or not os.path.isfile(path) \
+            or not (shared_image or os.path.dirname(folder) == os.path.abspath(USERS_FOLDER)):
+        return jsonify({"error": "Image not found"}), 404
+    if not shared_image:
+        # Another user's wardrobe: don't reveal that it exists either
+        owner = current_owner()
+        if owner is None or partition_id(owner) != os.path.basename(folder):
+            return jsonify({"error": "Image not found"}), 404
+
+    # Partition images are served without opening their store, so they get the mtime/size ETag
+    sha256 = store.manifest.get(filename, {}).get("sha256") if shared_image else None
+    width = request.args.get('w')
+    if width is not None:
+        if not width.isdigit() or int(width) < 1:
+            return jsonify({"error": "w must be a positive integer"}), 400
+        width = nearest_width(int(width))
+        try:
+            path = get_thumbnail(folder, os.path.basename(path), width)
+        except Exception as e:
+            log.warning("Thumbnail for %s failed, serving the original: %s", filename, e)
+        else:
+            sha256 = f"{sha256}-w{width}" if sha256 else None
+
+    # Without a manifest entry (not indexed yet) Flask falls back to an mtime/size based ETag
+    response = send_file(path, etag=sha256 or True, conditional=True, max_age=IMAGE_CACHE_SECONDS)
+    visibility = 'public' if shared_image else 'private'
+    response.headers['Cache-Control'] = f'{visibility}, max-age={IMAGE_CACHE_SECONDS}, immutable'
+    if not shared_image:
+        response.headers['Vary'] = 'Authorization'
     return response
 
 @app.route('/api/images', methods=['GET'])
 def list_images():
-    # Return list of all images with their URLs
-    images = []
+    """
+    One page of the image list in index order: the caller's wardrobe, or the
+    shared catalogue for anonymous requests and ?scope=catalogue. Responses
+    carry an ETag tied to the index generation, so a client revalidating with
+    If-None-Match gets 304 until an upload, delete or re-sync changes the index.
+    """
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE)
+    if not str(limit).isdigit() or int(limit) < 1:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    partition = shared if request.args.get('scope') == 'catalogue' else caller_partition()
     try:
-        # Get fresh list of files from the directory
-        current_files = set(os.listdir(IMAGE_FOLDER))
-        # Update image_paths to match current files
-        global image_paths
-        image_paths = [f for f in image_paths if f in current_files]
-        
-        for i, path in enumerate(image_paths):
-            images.append({
-                "id": int(i),
-                "filename": str(path),
-                "url": f"/data/{path}"
-            })
-        
-        response = jsonify(images)
-        # Add cache control headers
-        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
-        return response
-    except Exception as e:
-        print(f"Error in list_images: {str(e)}")
-        # Return simple version in case of error
-        safe_images = [{"id": i, "filename": str(p), "url": f"/data/{p}"} 
-                      for i, p in enumerate(image_paths)]
-        response = jsonify(safe_images)
-        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
-        return response
+        etag, body = partition.catalogue.page(request.args.get('cursor'), int(limit))
+    except InvalidCursorError as e:
+        return jsonify({"error": str(e)}), 400
+
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Revalidate with the ETag every time; unchanged pages return 304
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Authorization'
+    return response.make_conditional(request)
+
+@app.route('/api/images/<path:filename>', methods=['DELETE'])
+def delete_image(filename):
+    """Removes an image from the caller's index, folder and thumbnail cache"""
+    not_ready = index_not_ready()
+    if not_ready:
+        return not_ready
+
+    owner = current_owner()
+    removed = model_client.call("remove", filename, owner) if model_client else remove_image(filename, owner)
+    if not removed:
+        return jsonify({"error": "Image not found"}), 404
+    # Workers reload the generation the server just published
+    partition = caller_partition()
+    if model_client:
+        partition.store.refresh()
+    return jsonify({"success": True, "filename": filename, "generation": partition.store.generation})
 
 @app.route('/api/reset', methods=['POST'])
 def reset_embeddings():
-    """Reset the embeddings and regenerate them"""
-    global image_embeddings, image_paths
-    
-    if os.path.exists(EMBEDDINGS_FILE):
-        os.remove(EMBEDDINGS_FILE)
-    
-    image_paths, image_embeddings = encode_images_from_folder(IMAGE_FOLDER)
-    
-    if len(image_paths) > 0:
-        np.save(EMBEDDINGS_FILE, {"embeddings": image_embeddings, "paths": image_paths})
-    
+    """Re-sync the embeddings with the data folder, encoding only new or changed images"""
+    not_ready = index_not_ready()
+    if not_ready:
+        return not_ready
+
+    data = request.get_json(silent=True) or {}
+    full = bool(data.get("full", False))
+
+    stats = model_client.call("reset", full) if model_client else resync_index(full)
+
     return jsonify({
         "success": True,
-        "message": f"Reset complete. Processed {len(image_paths)} images."
+        "message": f"Reset complete. Processed {stats['total']} images.",
+        "reused": stats["reused"],
+        "added": stats["added"],
+        "changed": stats["changed"],
+        "removed": stats["removed"],
+        "total": stats["total"]
     })
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: the model is loaded and warm and the index is loaded"""
+    if model_client:
+        try:
+            server = model_client.call("status")
+        except ModelServerError as e:
+            return jsonify({"ready": False, "error": str(e), "index": dict(index_status, images=len(store))}), 503
+        model, warm = server["model"], server["warm"]
+    else:
+        model, warm = model_status(), is_warm()
+    ready = index_ready.is_set() and (warm or not MODEL_WARMUP)
+    body = {
+        "ready": ready,
+        "model": model,
+        "index": dict(index_status, images=len(store)),
+        "role": ROLE,
+    }
+    return jsonify(body), (200 if ready else 503)
+
+# Bearer tokens that were not signed by this server
+@app.errorhandler(BadSignature)
+def invalid_token(e):
+    return jsonify({"error": "Invalid or expired login token, please log in again."}), 401
+
 # Error handler for 404 errors
 @app.errorhandler(404)
 def not_found(e):
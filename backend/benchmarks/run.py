@@ -0,0 +1,410 @@
+# benchmarks/run.py
+"""
+Offline benchmark suite for search, ingestion, index persistence, app
+startup and /api/reset.
+
+Uses the deterministic stub encoder and synthetic embedding corpora, so it
+needs no CLIP weights or network. Every benchmark runs in its own
+subprocess, so its peak RSS (and the growth over the corpus it was given)
+is its own and not the high-water mark of everything measured before it.
+Run from the backend folder:
+
+    python -m benchmarks.run --sizes 1000,10000,100000 --output bench.json
+    python -m benchmarks.run --compare bench.json      # flag regressions
+"""
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import argparse
+import tempfile
+import contextlib
+import subprocess
+import numpy as np
+from PIL import Image
+
+from benchmarks.stub_model import install_stub_model
+
+QUERIES = [
+    "black dress", "casual style jeans", "white shirt", "red skirt", "leather jacket",
+    "blue denim jacket", "summer floral dress", "grey hoodie", "formal suit", "running shoes",
+    "striped t-shirt", "wool coat", "green cargo pants", "silk blouse", "knit sweater",
+]
+COMPOUND_QUERIES = [
+    "white shirt and blue jeans", "black dress ve red heels", "grey hoodie and running shoes",
+    "wool coat and knit sweater", "silk blouse and leather skirt",
+]
+# p50/p99 ratios above this are reported as regressions by --compare
+REGRESSION_RATIO = 1.2
+
+def percentiles(samples_ms):
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "count": int(samples.size),
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p90_ms": float(np.percentile(samples, 90)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "max_ms": float(samples.max()),
+    }
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def resident_mb():
+    """(resident, anonymous) MB of this process right now; (None, None) where /proc is missing."""
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return None, None
+    # Anonymous memory excludes mmapped file pages, so a copy of the matrix shows up here
+    return int(fields["VmRSS"].split()[0]) / 1024, int(fields["RssAnon"].split()[0]) / 1024
+
+def synthetic_corpus(n, dim, rng):
+    """Clustered, L2-normalized vectors that roughly mimic CLIP image embeddings."""
+    centers = rng.standard_normal((max(1, n // 200), dim)).astype(np.float32)
+    embeddings = centers[rng.integers(0, centers.shape[0], n)]
+    embeddings += 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return [f"{i:032x}.jpg" for i in range(n)], embeddings
+
+def timed(fn, iterations, warmup=2):
+    for _ in range(warmup):
+        fn(0)
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    return percentiles(samples)
+
+def bench_search(n, paths, embeddings, kind, iterations, batch_size, warm_cache):
+    from embedding_utils import search_images, search_images_batch, text_cache
+    from vector_index import create_index
+
+    index = create_index(kind)
+    start = time.perf_counter()
+    index.build(embeddings)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    def run(fn):
+        def wrapped(i):
+            if not warm_cache:
+                text_cache.clear()
+            fn(i)
+        return timed(wrapped, iterations)
+
+    single = run(lambda i: search_images(QUERIES[i % len(QUERIES)], embeddings, paths, index=index))
+    compound = run(lambda i: search_images(COMPOUND_QUERIES[i % len(COMPOUND_QUERIES)], embeddings, paths, index=index))
+    batch_queries = [{"query": QUERIES[j % len(QUERIES)], "k": 3} for j in range(batch_size)]
+    batch = run(lambda i: search_images_batch(batch_queries, embeddings, paths, index=index))
+    batch["queries_per_second"] = batch_size * 1000.0 / batch["mean_ms"]
+
+    return [dict(stats, benchmark=name, n=n, index=kind, build_ms=build_ms)
+            for name, stats in (("search.single", single), ("search.compound", compound), ("search.batch", batch))]
+
+def bench_index_io(n, paths, embeddings, workdir):
+    from index_store import save_index, load_index
+    from embedding_store import EmbeddingStore
+
+    index_dir = os.path.join(workdir, f"index-{n}")
+    start = time.perf_counter()
+    save_index(index_dir, paths, embeddings, "stub")
+    save_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    _, mapped, _ = load_index(index_dir)
+    float(mapped[-1, 0])
+    load_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    load_index(index_dir, verify=True)
+    verify_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    store = EmbeddingStore(index_dir, "stub", compact_every=10 ** 9).load()
+    startup_ms = (time.perf_counter() - start) * 1000
+
+    # Store-level upload cost: one append (and fsync) per uploaded image
+    appends = min(200, max(20, n // 100))
+    rng = np.random.default_rng(1)
+    rows = rng.standard_normal((appends, embeddings.shape[1])).astype(np.float32)
+    start = time.perf_counter()
+    for i in range(appends):
+        store.append(f"upload-{i}.jpg", rows[i])
+    append_s = time.perf_counter() - start
+    start = time.perf_counter()
+    store.compact()
+    compact_ms = (time.perf_counter() - start) * 1000
+    shutil.rmtree(index_dir, ignore_errors=True)
+
+    return [
+        {"benchmark": "index.save", "n": n, "index": None, "mean_ms": save_ms},
+        {"benchmark": "index.load_mmap", "n": n, "index": None, "mean_ms": load_ms},
+        {"benchmark": "index.load_verify", "n": n, "index": None, "mean_ms": verify_ms},
+        {"benchmark": "startup.store_load", "n": n, "index": None, "mean_ms": startup_ms},
+        {"benchmark": "upload.append", "n": n, "index": None, "mean_ms": append_s * 1000 / appends,
+         "uploads_per_second": appends / append_s},
+        {"benchmark": "index.compact", "n": n, "index": None, "mean_ms": compact_ms},
+    ]
+
+def bench_memory(n, dim, kind, workdir):
+    """
+    Resident memory of a store with the given vector index after loading a
+    saved corpus and after appending uploads to it. The base stays mapped, so
+    anonymous memory should track the index structures (e.g. sq8/pq codes)
+    and the appended rows, not the corpus size.
+    """
+    import gc
+    from index_store import save_index
+    from embedding_store import EmbeddingStore
+    from vector_index import create_index
+
+    index_dir = os.path.join(workdir, f"memory-{n}-{kind}")
+    paths, embeddings = synthetic_corpus(n, dim, np.random.default_rng(n))
+    save_index(index_dir, paths, embeddings, "stub")
+    del paths, embeddings
+    gc.collect()
+
+    _, anon_before = resident_mb()
+    start = time.perf_counter()
+    store = EmbeddingStore(index_dir, "stub", vector_index=create_index(kind), compact_every=10 ** 9).load()
+    load_ms = (time.perf_counter() - start) * 1000
+    rss_loaded, anon_loaded = resident_mb()
+
+    appends = min(1000, max(20, n // 100))
+    rows = np.random.default_rng(1).standard_normal((appends, dim)).astype(np.float32)
+    start = time.perf_counter()
+    store.append_many([(f"upload-{i}.jpg", rows[i], None) for i in range(appends)])
+    append_ms = (time.perf_counter() - start) * 1000
+    rss_appended, anon_appended = resident_mb()
+    shutil.rmtree(index_dir, ignore_errors=True)
+
+    growth = lambda anon: anon - anon_before if anon is not None else None
+    return [
+        {"benchmark": "memory.store_load", "n": n, "index": kind, "mean_ms": load_ms,
+         "rss_mb": rss_loaded, "anon_mb": anon_loaded, "anon_growth_mb": growth(anon_loaded)},
+        {"benchmark": "memory.after_append", "n": n, "index": kind, "mean_ms": append_ms, "appended": appends,
+         "rss_mb": rss_appended, "anon_mb": anon_appended, "anon_growth_mb": growth(anon_appended)},
+    ]
+
+def bench_ingest(image_count, workdir):
+    """End-to-end ingestion: decode, preprocess, encode, move and commit synthetic JPEGs."""
+    from embedding_store import EmbeddingStore
+    from ingest_queue import IngestionQueue
+
+    image_folder = os.path.join(workdir, "ingest")
+    os.makedirs(image_folder)
+    store = EmbeddingStore(os.path.join(image_folder, "index"), "stub").load()
+    ingestion = IngestionQueue(store, image_folder, os.path.join(image_folder, "incoming"),
+                               os.path.join(image_folder, "jobs"), max_pending_files=image_count)
+    rng = np.random.default_rng(2)
+    files = []
+    for i in range(image_count):
+        filename = f"{i:032x}.jpg"
+        pixels = rng.integers(0, 256, (480, 360, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(ingestion.incoming_path(filename), quality=85)
+        files.append((filename, filename))
+
+    ingestion.reserve(image_count)
+    start = time.perf_counter()
+    ingestion.start()
+    job = ingestion.submit(files)
+    while ingestion.status(job["id"])["state"] not in ("done", "failed"):
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(image_folder, ignore_errors=True)
+    return [{"benchmark": "upload.ingest", "n": image_count, "index": None,
+             "mean_ms": elapsed * 1000 / image_count, "images_per_second": image_count / elapsed}]
+
+def bench_app(image_count, data_dir, iterations):
+    """
+    Imports app.py against data_dir and waits for its index: a cold start
+    encodes every image, a warm one reuses the index left by the cold run.
+    The warm run also times incremental /api/reset calls.
+    """
+    from index_store import index_exists
+
+    os.environ.update(CODRESS_DATA_DIR=data_dir, CODRESS_MODEL_WARMUP="0", CODRESS_ROLE="standalone")
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+        rng = np.random.default_rng(3)
+        for i in range(image_count):
+            pixels = rng.integers(0, 256, (96, 96, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(os.path.join(data_dir, f"{i:032x}.jpg"), quality=85)
+    mode = "warm" if index_exists(os.path.join(data_dir, "index")) else "cold"
+
+    start = time.perf_counter()
+    import app
+    import_ms = (time.perf_counter() - start) * 1000
+    while not app.index_ready.is_set():
+        if app.index_status["state"] == "error":
+            raise RuntimeError(f"Index initialization failed: {app.index_status['error']}")
+        time.sleep(0.005)
+    ready_ms = (time.perf_counter() - start) * 1000
+
+    results = [
+        {"benchmark": "startup.app_import", "n": image_count, "index": mode, "mean_ms": import_ms},
+        {"benchmark": "startup.app_ready", "n": image_count, "index": mode, "mean_ms": ready_ms},
+    ]
+    if mode == "warm":
+        client = app.app.test_client()
+
+        def reset(i):
+            response = client.post("/api/reset", json={})
+            if response.status_code != 200:
+                raise RuntimeError(f"/api/reset returned {response.status_code}: {response.get_data(as_text=True)}")
+        results.append(dict(timed(reset, iterations, warmup=1), benchmark="api.reset", n=image_count, index=None))
+    return results
+
+def run_unit(unit):
+    """Runs one benchmark in this process; returns its rows with this process's RSS."""
+    install_stub_model(dim=unit["dim"])
+    n = unit["n"]
+    if unit["kind"] in ("search", "index_io"):
+        paths, embeddings = synthetic_corpus(n, unit["dim"], np.random.default_rng(n))
+    baseline = peak_rss_mb()
+    if unit["kind"] == "search":
+        rows = bench_search(n, paths, embeddings, unit["index"], unit["iterations"], unit["batch_size"], unit["warm_cache"])
+    elif unit["kind"] == "index_io":
+        rows = bench_index_io(n, paths, embeddings, unit["workdir"])
+    elif unit["kind"] == "memory":
+        rows = bench_memory(n, unit["dim"], unit["index"], unit["workdir"])
+    elif unit["kind"] == "ingest":
+        rows = bench_ingest(n, unit["workdir"])
+    else:
+        rows = bench_app(n, os.path.join(unit["workdir"], "app"), unit["iterations"])
+    peak = peak_rss_mb()
+    for row in rows:
+        row.update(peak_rss_mb=peak, rss_delta_mb=peak - baseline)
+    return rows
+
+def run_in_subprocess(unit):
+    """Runs run_unit(unit) in a fresh interpreter so every benchmark gets its own peak RSS."""
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [backend_dir, os.environ.get("PYTHONPATH")])))
+    child = subprocess.run([sys.executable, "-m", "benchmarks.run", "--unit", json.dumps(unit)],
+                           cwd=unit["workdir"], env=env, capture_output=True, text=True)
+    if child.returncode != 0:
+        raise RuntimeError(f"Benchmark {unit['kind']} n={unit['n']} failed:\n{child.stderr}")
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def compare(current, baseline_file):
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    key = lambda r: (r["benchmark"], r["n"], r["index"])
+    previous = {key(r): r for r in baseline["results"]}
+    regressions = 0
+    print(f"\nComparison against {baseline_file} (commit {baseline['meta'].get('commit')}):")
+    for row in current:
+        old = previous.get(key(row))
+        if not old:
+            continue
+        for metric in ("p50_ms", "p99_ms", "mean_ms"):
+            if metric in row and metric in old and old[metric] > 0:
+                ratio = row[metric] / old[metric]
+                flag = "REGRESSION" if ratio > REGRESSION_RATIO else ""
+                regressions += bool(flag)
+                print(f"  {row['benchmark']:<20} n={row['n']:<8} {str(row['index'] or '-'):<6} "
+                      f"{metric:<8} {old[metric]:>10.3f} -> {row[metric]:>10.3f} ({ratio:5.2f}x) {flag}")
+                break
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="CoDress offline benchmarks")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma-separated corpus sizes, e.g. 1000,10000,100000,1000000")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--indexes", default="exact,ivf", help="vector index kinds to benchmark")
+    parser.add_argument("--memory-indexes", default="exact,sq8,pq",
+                        help="vector index kinds whose resident memory is measured after load and appends")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--ingest-images", type=int, default=64)
+    parser.add_argument("--app-images", type=int, default=200,
+                        help="images in the app startup and /api/reset benchmarks (0 skips them)")
+    parser.add_argument("--warm-cache", action="store_true", help="keep the text-embedding cache between queries")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--unit", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    torch_threads = os.environ.get("CODRESS_BENCH_THREADS")
+    if torch_threads:
+        import torch
+        torch.set_num_threads(int(torch_threads))
+
+    if args.unit:
+        # Child process: run a single measurement and print its rows as JSON on the last stdout line
+        with contextlib.redirect_stdout(io.StringIO()):
+            rows = run_unit(json.loads(args.unit))
+        print(json.dumps(rows))
+        return
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    kinds = [k for k in args.indexes.split(",") if k]
+    memory_kinds = [k for k in args.memory_indexes.split(",") if k]
+    results = []
+    workdir = tempfile.mkdtemp(prefix="codress-bench-")
+    common = {"dim": args.dim, "iterations": args.iterations, "batch_size": args.batch_size,
+              "warm_cache": args.warm_cache, "workdir": workdir}
+    units = []
+    for n in sizes:
+        units += [dict(common, kind="search", n=n, index=kind) for kind in kinds]
+        units.append(dict(common, kind="index_io", n=n))
+        units += [dict(common, kind="memory", n=n, index=kind) for kind in memory_kinds]
+    if args.ingest_images:
+        units.append(dict(common, kind="ingest", n=args.ingest_images))
+    if args.app_images:
+        # The warm start reuses the index the cold start wrote
+        units += [dict(common, kind="app", n=args.app_images, mode=mode) for mode in ("cold", "warm")]
+    try:
+        for unit in units:
+            results += run_in_subprocess(unit)
+            print(f"{unit['kind']} n={unit['n']} {unit.get('index') or unit.get('mode') or ''} done", file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'benchmark':<20}{'n':>9}{'index':>7}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}{'RSS MB':>9}{'+RSS MB':>9}{'anon MB':>9}")
+    for row in results:
+        p50 = f"{row['p50_ms']:.3f}" if "p50_ms" in row else "-"
+        p99 = f"{row['p99_ms']:.3f}" if "p99_ms" in row else "-"
+        anon = f"{row['anon_mb']:.0f}" if row.get("anon_mb") is not None else "-"
+        print(f"{row['benchmark']:<20}{row['n']:>9}{str(row['index'] or '-'):>7}{p50:>10}{p99:>10}"
+              f"{row['mean_ms']:>10.3f}{row['peak_rss_mb']:>9.0f}{row['rss_delta_mb']:>9.0f}{anon:>9}")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        regressions = compare(results, args.compare)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# benchmarks/stub_model.py
+"""
+Deterministic stand-in for CLIP ViT-B/32 so the benchmarks run offline.
+
+Text embeddings are the mean of fixed random token vectors and image
+embeddings are a fixed random projection of a 16x16 average-pooled image.
+Same input, same vector, with no weights to download.
+"""
+import types
+import torch
+import torch.nn.functional as F
+from clip.clip import _transform
+
+TOKEN_BUCKETS = 4096
+
+class StubCLIP(torch.nn.Module):
+    def __init__(self, dim=512, seed=0):
+        super().__init__()
+        generator = torch.Generator().manual_seed(seed)
+        self.token_table = torch.randn(TOKEN_BUCKETS, dim, generator=generator)
+        self.image_projection = torch.randn(3 * 16 * 16, dim, generator=generator)
+        self.text_projection = torch.empty(dim, dim)
+        self.visual = types.SimpleNamespace(output_dim=dim)
+
+    def encode_text(self, tokens):
+        mask = (tokens != 0).unsqueeze(-1).float()
+        vectors = self.token_table[tokens % TOKEN_BUCKETS] * mask
+        return vectors.sum(dim=1) / mask.sum(dim=1).clamp(min=1.0)
+
+    def encode_image(self, images):
+        pooled = F.adaptive_avg_pool2d(images.float(), 16).flatten(1)
+        return pooled @ self.image_projection
+
+def install_stub_model(dim=512, seed=0):
+    """Registers the stub as the shared model so embedding_utils never loads CLIP weights."""
+    from clip_model import set_model
+    model = StubCLIP(dim=dim, seed=seed).eval()
+    set_model(model, _transform(224), "cpu")
+    return model
@@ -0,0 +1,108 @@
+# catalogue.py
+"""
+Paginated image listing backed by the embedding store.
+
+The listing follows the store's row order and is rebuilt only when the
+store generation changes (uploads, deletes, re-syncs all bump it), so a
+request never scans the data folder. Pages are addressed by an opaque
+cursor holding the last filename and its offset: if that file was removed
+in the meantime the page resumes at the row it used to occupy. Serialized
+pages are cached per generation and carry an ETag clients can revalidate
+with If-None-Match.
+"""
+import json
+import uuid
+import base64
+import threading
+from collections import OrderedDict
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+class InvalidCursorError(ValueError):
+    """Raised for a cursor that was not produced by this API."""
+
+def encode_cursor(filename, offset):
+    raw = json.dumps([filename, offset], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        filename, offset = json.loads(raw)
+        if not isinstance(filename, str) or not isinstance(offset, int) or offset < 0:
+            raise ValueError(cursor)
+        return filename, offset
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+
+class CatalogueView:
+    def __init__(self, store, url_prefix="/data/", max_cached_pages=256):
+        self.store = store
+        self.url_prefix = url_prefix
+        self.max_cached_pages = max_cached_pages
+        # So ETags don't collide with pages from before a restart
+        self.instance = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._generation = None
+        self._paths = []
+        self._rows = {}
+        self._pages = OrderedDict()  # (start, limit) -> (etag, body)
+
+    def etag(self, generation, start, limit):
+        return f"{self.instance}-{generation}-{start}-{limit}"
+
+    def page(self, cursor=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        Returns (etag, body) for one page; body is the serialized JSON
+        {"images", "nextCursor", "generation", "total"}.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        with self._lock:
+            generation = self._refresh()
+            start = self._resolve(cursor)
+            key = (start, limit)
+            cached = self._pages.get(key)
+            if cached is not None:
+                self._pages.move_to_end(key)
+                return cached
+            paths = self._paths
+
+        end = min(start + limit, len(paths))
+        images = [{"id": row, "filename": paths[row], "url": f"{self.url_prefix}{paths[row]}"}
+                  for row in range(start, end)]
+        body = json.dumps({
+            "images": images,
+            "nextCursor": encode_cursor(paths[end - 1], end) if end < len(paths) else None,
+            "generation": generation,
+            "total": len(paths),
+        })
+        entry = (self.etag(generation, start, limit), body)
+        with self._lock:
+            if self._generation == generation:
+                self._pages[key] = entry
+                while len(self._pages) > self.max_cached_pages:
+                    self._pages.popitem(last=False)
+        return entry
+
+    def _refresh(self):
+        """Re-reads the store's paths if its generation moved. Caller holds the lock."""
+        generation = self.store.generation
+        if generation != self._generation:
+            with self.store.lock:
+                generation = self.store.generation
+                self._paths = self.store.live_paths()
+            self._rows = {path: row for row, path in enumerate(self._paths)}
+            self._pages.clear()
+            self._generation = generation
+        return generation
+
+    def _resolve(self, cursor):
+        if not cursor:
+            return 0
+        filename, offset = decode_cursor(cursor)
+        row = self._rows.get(filename)
+        if row is not None:
+            return row + 1
+        # The file was deleted: the rows after it moved up by one
+        return min(max(0, offset - 1), len(self._paths))
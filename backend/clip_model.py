@@ -1,8 +1,89 @@
 # clip_model.py
+"""
+Shared, lazily initialized CLIP model registry.
+
+The model is loaded once per process on first use (or by the background
+warm-up), never at import time, so importing the backend modules is cheap
+and the HTTP server can bind its port before the weights are in memory.
+"""
+import os
+import time
+import threading
 import clip
 import torch
+from PIL import Image
+
+import inference_backend
+from log_utils import get_logger
+
+log = get_logger("clip_model")
+
+MODEL_NAME = os.environ.get("CODRESS_MODEL_NAME", "ViT-B/32")
+
+_lock = threading.Lock()
+_loaded = None
+_warm = threading.Event()
+_status = {"state": "not_loaded", "error": None, "load_seconds": None, "warmup_seconds": None, "inference": None}
 
 def load_model():
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model, preprocess = clip.load("ViT-B/32", device=device)
-    return model, preprocess, device
+    """Returns (model, preprocess, device), loading the model on the first call."""
+    global _loaded
+    if _loaded is not None:
+        return _loaded
+    with _lock:
+        if _loaded is None:
+            _status["state"] = "loading"
+            started = time.perf_counter()
+            try:
+                device = "cuda" if torch.cuda.is_available() else "cpu"
+                model, preprocess = clip.load(MODEL_NAME, device=device)
+                model.eval()
+                # CODRESS_INFER_BACKEND: eager, int8, torchscript or onnx, checked against eager
+                model, _status["inference"] = inference_backend.select(model, preprocess, MODEL_NAME, device)
+            except Exception as e:
+                _status.update(state="error", error=str(e))
+                raise
+            _status.update(state="loaded", error=None, load_seconds=time.perf_counter() - started)
+            log.info("Loaded CLIP %s on %s in %.2fs", MODEL_NAME, device, _status["load_seconds"])
+            _loaded = (model, preprocess, device)
+    return _loaded
+
+def set_model(model, preprocess, device="cpu"):
+    """Installs an already constructed model, e.g. the deterministic stub used by the benchmarks."""
+    global _loaded
+    with _lock:
+        _loaded = (model, preprocess, device)
+        _status.update(state="loaded", error=None)
+
+def is_loaded():
+    return _loaded is not None
+
+def is_warm():
+    return _warm.is_set()
+
+def warm_up():
+    """Loads the model and runs one dummy text and image forward pass."""
+    model, preprocess, device = load_model()
+    started = time.perf_counter()
+    with torch.no_grad():
+        model.encode_text(clip.tokenize(["warm up"]).to(device))
+        image = preprocess(Image.new("RGB", (224, 224))).unsqueeze(0).to(device)
+        model.encode_image(image)
+    _status["warmup_seconds"] = time.perf_counter() - started
+    _warm.set()
+    log.info("Warm-up forward pass took %.2fs", _status["warmup_seconds"])
+
+def start_background_warmup():
+    """Loads and warms the model on a daemon thread; returns the thread."""
+    def run():
+        try:
+            warm_up()
+        except Exception as e:
+            log.error("Model warm-up failed: %s", e)
+
+    thread = threading.Thread(target=run, name="clip-warmup", daemon=True)
+    thread.start()
+    return thread
+
+def model_status():
+    return dict(_status, model=MODEL_NAME, warm=is_warm())
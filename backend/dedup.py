@@ -0,0 +1,130 @@
+# dedup.py
+"""
+Duplicate detection for uploads and for the stored corpus.
+
+Ingest runs two checks (see IngestionQueue): an upload whose sha256 is
+already in the manifest is skipped before CLIP sees it, and an encoded
+upload whose best cosine similarity against the index reaches
+NEAR_DUPLICATE_THRESHOLD is flagged with the stored image it resembles.
+Similar is not the same: the same shirt in two colours or a product photo
+set can score that high, so such uploads are only dropped with
+CODRESS_DEDUP_DROP_SIMILAR=1.
+
+Offline, find_duplicate_clusters() groups near-duplicates of the whole
+corpus. Rows are scored block by block against the rows after them only,
+so memory stays at block x n floats instead of n x n:
+
+    python dedup.py --threshold 0.97 --output duplicates.json
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+def parse_threshold(value):
+    """Cosine threshold from a setting; empty, "off" or a value <= 0 turns the check off (None)."""
+    if value is None or value.strip().lower() in ("", "off"):
+        return None
+    threshold = float(value)
+    return threshold if threshold > 0 else None
+
+# Cosine similarity at which two images count as the same photo (resized,
+# re-encoded or lightly cropped copies score above 0.95 with ViT-B/32)
+NEAR_DUPLICATE_THRESHOLD = parse_threshold(os.environ.get("CODRESS_DEDUP_THRESHOLD", "0.97"))
+# Near-duplicates are flagged by default; only this drops them at upload
+DROP_NEAR_DUPLICATES = os.environ.get("CODRESS_DEDUP_DROP_SIMILAR", "0") == "1"
+DEDUP_BLOCK = 1024
+
+def near_duplicates(store, embeddings, threshold):
+    """
+    For each row of embeddings returns the stored filename it duplicates,
+    or None. Rows are also compared with the earlier rows of the same
+    batch, which then map to that row's index (an int) instead of a name.
+    Caller holds store.lock.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    matches = [None] * embeddings.shape[0]
+    if threshold is None or embeddings.shape[0] == 0:
+        return matches
+    if len(store):
+        scores, ids = store.vector_index.search(store.embeddings, embeddings, 1)
+        for i, (score, row) in enumerate(zip(scores[:, 0].tolist(), ids[:, 0].tolist())):
+            if row >= 0 and score >= threshold:
+                matches[i] = store.paths[row]
+    # Photos sent twice in the same upload
+    within = np.triu(embeddings @ embeddings.T >= threshold, k=1)
+    for i, j in zip(*np.nonzero(within)):
+        if matches[j] is None and matches[i] is None:
+            matches[j] = int(i)
+    return matches
+
+def find_duplicate_clusters(embeddings, threshold=0.97, block=DEDUP_BLOCK):
+    """
+    Groups rows whose cosine similarity reaches threshold, transitively.
+    Returns clusters of two or more rows, each sorted, largest first.
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    n = matrix.shape[0]
+    parent = np.arange(n)
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        # Only pairs (i, j) with i < j: the block against itself and the rows after it
+        scores = matrix[start:stop] @ matrix[start:].T
+        pairs = np.nonzero(np.triu(scores >= threshold, k=1))
+        for i, j in zip((pairs[0] + start).tolist(), (pairs[1] + start).tolist()):
+            ri, rj = root(i), root(j)
+            if ri != rj:
+                parent[max(ri, rj)] = min(ri, rj)
+
+    roots = np.array([root(i) for i in range(n)], dtype=np.int64)
+    clusters = {}
+    for row, r in enumerate(roots.tolist()):
+        clusters.setdefault(r, []).append(row)
+    return sorted((rows for rows in clusters.values() if len(rows) > 1), key=lambda rows: (-len(rows), rows[0]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report near-duplicate image clusters in the index.")
+    parser.add_argument("--index-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "index"))
+    parser.add_argument("--threshold", type=float, default=NEAR_DUPLICATE_THRESHOLD or 0.97)
+    parser.add_argument("--block", type=int, default=DEDUP_BLOCK, help="rows scored per matrix product")
+    parser.add_argument("--output", help="write the clusters as JSON to this file")
+    args = parser.parse_args(argv)
+
+    from embedding_store import EmbeddingStore
+    from clip_model import MODEL_NAME
+    # Read-only: leaves the running server's files alone
+    store = EmbeddingStore(args.index_dir, MODEL_NAME, read_only=True).load()
+    paths, embeddings = store.snapshot()
+    if store.deleted.size:
+        rows = store.live_rows()
+        paths, embeddings = [paths[row] for row in rows.tolist()], embeddings[rows]
+    clusters = find_duplicate_clusters(embeddings, args.threshold, args.block)
+    report = {
+        "threshold": args.threshold,
+        "images": len(paths),
+        "clusters": [{
+            "keep": paths[rows[0]],
+            "duplicates": [{"filename": paths[row], "score": float(embeddings[rows[0]] @ embeddings[row])} for row in rows[1:]],
+        } for rows in clusters],
+    }
+    report["redundant"] = sum(len(c["duplicates"]) for c in report["clusters"])
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    print(f"[dedup.py] {report['redundant']} redundant images in {len(clusters)} clusters out of {len(paths)}",
+          file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
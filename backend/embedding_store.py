@@ -0,0 +1,552 @@
+# embedding_store.py
+"""
+In-memory embedding store with an append-only on-disk log.
+
+The base index lives in the versioned format from index_store and stays
+memory-mapped. Uploads go to a small capacity-doubling tail buffer and to
+append.log, so adding a row never copies the base matrix and only the new
+record is fsync'ed; readers see both through an EmbeddingView. The log is
+folded back into the base index by compact(), which runs once the log
+grows past compact_every records and on shutdown; after that the whole
+matrix is memory-mapped from the new base file again.
+
+Deletes are tombstones: remove() appends a delete record and marks the row
+dead instead of rewriting the index. Dead rows keep their place, so the
+vector index, neighbour graph and label scores stay valid; searches and
+lookups skip them, and compact() drops them and renumbers those structures
+without a rebuild.
+
+In multi-process deployments one store owns the index (publish=True) and
+bumps a shared generation counter after every change; read-only stores in
+other processes map the same files and reload in refresh() when the
+counter moves.
+"""
+import os
+import json
+import mmap
+import time
+import struct
+import zlib
+import threading
+import numpy as np
+
+from index_store import save_index, load_index, index_exists, read_header, IndexFormatError
+from index_manifest import load_manifest, save_manifest
+from vector_index import ExactIndex
+from log_utils import get_logger
+
+log = get_logger("embedding_store")
+
+LOG_FILE = "append.log"
+MANIFEST_FILE = "manifest.json"
+LOG_MAGIC = b"CDE1"
+LOG_DELETE_MAGIC = b"CDD1"
+# magic, name length, meta length, dim (a delete record has no meta and dim 0)
+LOG_RECORD_HEADER = struct.Struct("<4sHIH")
+LOG_RECORD_CRC = struct.Struct("<I")
+MIN_CAPACITY = 16
+GENERATION_FILE = "generation"
+GENERATION = struct.Struct("<Q")
+
+class ReadOnlyStoreError(Exception):
+    """Raised when a read-only (attached) store is asked to modify the index."""
+
+class GenerationCounter:
+    """
+    Seqlock-style counter in an 8-byte memory-mapped file. The owner makes it
+    odd while it rewrites the base files and even again when they are
+    consistent; readers only reload at an even value that is unchanged after
+    the reload.
+    """
+
+    def __init__(self, path, writable=False):
+        if writable and (not os.path.exists(path) or os.path.getsize(path) != GENERATION.size):
+            with open(path, "wb") as f:
+                f.write(GENERATION.pack(0))
+        self._file = open(path, "r+b" if writable else "rb")
+        self._map = mmap.mmap(self._file.fileno(), GENERATION.size,
+                              access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        if writable and self.value % 2:
+            # The owner crashed during a compaction
+            self.bump()
+
+    @property
+    def value(self):
+        return GENERATION.unpack_from(self._map, 0)[0]
+
+    def bump(self, step=1):
+        GENERATION.pack_into(self._map, 0, self.value + step)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+class EmbeddingView:
+    """
+    Read-only (rows, dim) matrix made of the memory-mapped base index and the
+    rows appended since the last compaction. The base is never copied: rows,
+    slices and row lists are gathered from the two parts on access, and
+    blocks() lets scorers multiply each part separately. deleted holds the
+    sorted tombstoned rows, which vector indexes must not return.
+    """
+    ndim = 2
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, base, tail, deleted=None):
+        self.base = base
+        self.tail = tail
+        self.deleted = deleted
+        self.shape = (base.shape[0] + tail.shape[0], max(base.shape[1], tail.shape[1]))
+
+    @property
+    def size(self):
+        return self.shape[0] * self.shape[1]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def blocks(self):
+        """(first row, array) of each non-empty part, in row order."""
+        return [(start, part) for start, part in ((0, self.base), (self.base.shape[0], self.tail)) if part.shape[0]]
+
+    def __getitem__(self, key):
+        split = self.base.shape[0]
+        if isinstance(key, (int, np.integer)):
+            row = int(key) + self.shape[0] if key < 0 else int(key)
+            if not 0 <= row < self.shape[0]:
+                raise IndexError(f"row {key} out of range for {self.shape[0]} rows")
+            return self.base[row] if row < split else self.tail[row - split]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.shape[0])
+            if step == 1 and stop <= split:
+                return self.base[start:stop]
+            if step == 1 and start >= split:
+                return self.tail[start - split:stop - split]
+            key = np.arange(start, stop, step)
+        rows = np.asarray(key)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        rows = np.where(rows < 0, rows + self.shape[0], rows).astype(np.int64)
+        out = np.empty((rows.shape[0], self.shape[1]), dtype=np.float32)
+        in_base = rows < split
+        if in_base.any():
+            out[in_base] = self.base[rows[in_base]]
+        if not in_base.all():
+            out[~in_base] = self.tail[rows[~in_base] - split]
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        """Materializes the whole matrix; hot paths use blocks() or row access instead."""
+        parts = [np.asarray(part, dtype=np.float32) for _, part in self.blocks()]
+        matrix = np.concatenate(parts) if parts else np.empty(self.shape, dtype=np.float32)
+        return matrix if dtype is None else matrix.astype(dtype, copy=False)
+
+class EmbeddingStore:
+    def __init__(self, index_dir, model_name, dtype="float32", compact_every=256, vector_index=None,
+                 publish=False, read_only=False, neighbor_graph=None, label_scores=None):
+        self.index_dir = index_dir
+        self.vector_index = vector_index or ExactIndex()
+        self.neighbor_graph = neighbor_graph
+        self.label_scores = label_scores
+        self.model_name = model_name
+        self.dtype = dtype
+        self.compact_every = compact_every
+        self.lock = threading.RLock()
+        self.manifest = {}
+        self.generation = 0
+        self._paths = []
+        # Memory-mapped base rows and the float32 tail appended after them
+        self._base = np.empty((0, 0), dtype=np.float32)
+        self._tail = np.empty((0, 0), dtype=np.float32)
+        self._tail_count = 0
+        self._count = 0
+        # Sorted rows removed since the last compaction (tombstones)
+        self._deleted = np.empty(0, dtype=np.int64)
+        self._log_records = 0
+        self.publish = publish
+        self.read_only = read_only
+        self._counter = None
+        self._seen_generation = None
+        self._rows = None
+
+    @property
+    def log_file(self):
+        return os.path.join(self.index_dir, LOG_FILE)
+
+    @property
+    def manifest_file(self):
+        return os.path.join(self.index_dir, MANIFEST_FILE)
+
+    def __len__(self):
+        return self._count - self._deleted.size
+
+    @property
+    def dim(self):
+        return self._base.shape[1] or self._tail.shape[1]
+
+    @property
+    def paths(self):
+        return self._paths
+
+    @property
+    def deleted(self):
+        """Sorted tombstoned rows; they stay in paths and embeddings until compact()."""
+        return self._deleted
+
+    def live_rows(self):
+        """Rows that are not tombstoned."""
+        return np.setdiff1d(np.arange(self._count), self._deleted) if self._deleted.size else np.arange(self._count)
+
+    def live_paths(self):
+        """Filenames of the rows that are not tombstoned, in row order."""
+        if not self._deleted.size:
+            return list(self._paths)
+        return [self._paths[row] for row in self.live_rows().tolist()]
+
+    @property
+    def embeddings(self):
+        """The base matrix, the tail, or an EmbeddingView over both (always one when rows are tombstoned)."""
+        tail = self._tail[:self._tail_count]
+        if self._deleted.size:
+            return EmbeddingView(self._base, tail, self._deleted)
+        if self._tail_count == 0:
+            return self._base
+        if self._base.shape[0] == 0:
+            return tail
+        return EmbeddingView(self._base, tail)
+
+    def row_of(self, path):
+        """Row of a stored filename, or None."""
+        return self._lookups()[0].get(path)
+
+    def find_by_hash(self, sha256):
+        """Stored filename whose content has this sha256, or None."""
+        return self._lookups()[1].get(sha256)
+
+    def _lookups(self):
+        """(filename -> row, sha256 -> filename) maps, rebuilt when the generation moves."""
+        with self.lock:
+            if self._rows is None or self._rows[0] != self.generation:
+                dead = set(self._deleted.tolist())
+                rows = {p: row for row, p in enumerate(self._paths) if row not in dead}
+                hashes = {}
+                for path in rows:
+                    sha256 = self.manifest.get(path, {}).get("sha256")
+                    if sha256:
+                        hashes.setdefault(sha256, path)
+                self._rows = (self.generation, rows, hashes)
+            return self._rows[1], self._rows[2]
+
+    def snapshot(self):
+        """
+        Returns a consistent (paths, embeddings) pair for readers.
+        Appends only write past the snapshot's rows or into a new tail
+        buffer, so the returned view stays valid without holding the lock.
+        """
+        with self.lock:
+            return list(self._paths), self.embeddings
+
+    def load(self):
+        """Maps the base index and replays any records left in the append log."""
+        with self.lock:
+            self._paths, self._base, self._count = [], np.empty((0, 0), dtype=np.float32), 0
+            self._deleted = np.empty(0, dtype=np.int64)
+            self._reset_tail()
+            # A damaged index raises IndexFormatError: starting empty would
+            # overwrite it at the next compaction
+            if index_exists(self.index_dir) and read_header(self.index_dir).get("model") != self.model_name:
+                log.warning("Index in %s was built with another model, starting empty to re-encode with %s",
+                            self.index_dir, self.model_name)
+            elif index_exists(self.index_dir):
+                paths, embeddings, header = load_index(self.index_dir, model_name=self.model_name)
+                self._paths, self._base, self._count = list(paths), embeddings, len(paths)
+                log.info("Mapped %d x %d %s embeddings from %s", header["count"], header["dim"], header["dtype"], self.index_dir)
+            self.manifest = load_manifest(self.manifest_file)
+            base_count = self._count
+            replayed = self._replay_log()
+            if replayed:
+                log.info("Replayed %d log records (%d deleted rows) from %s", replayed, self._deleted.size, self.log_file)
+            if self.vector_index.load(self.index_dir, base_count):
+                self.vector_index.add(self.embeddings, base_count)
+            else:
+                self.vector_index.build(self.embeddings)
+            if self.neighbor_graph is not None:
+                if self.neighbor_graph.load(self.index_dir, base_count):
+                    self.neighbor_graph.add(self.embeddings, base_count)
+                else:
+                    self.neighbor_graph.build(self.embeddings)
+            if self.label_scores is not None:
+                if self.label_scores.load(self.index_dir, base_count):
+                    self.label_scores.add(self.embeddings, base_count)
+                else:
+                    self.label_scores.build(self.embeddings)
+            self.generation += 1
+            if self.publish:
+                os.makedirs(self.index_dir, exist_ok=True)
+                self._counter = self._counter or GenerationCounter(os.path.join(self.index_dir, GENERATION_FILE), writable=True)
+                self._counter.bump(2)
+            return self
+
+    def refresh(self, attempts=50, retry_delay=0.02):
+        """
+        Read-only stores: reloads the index if the owner published a new
+        generation since the last call. Returns True if it reloaded.
+        """
+        if self._counter is None:
+            path = os.path.join(self.index_dir, GENERATION_FILE)
+            if not os.path.exists(path):
+                return False
+            self._counter = GenerationCounter(path)
+        if self._counter.value == self._seen_generation:
+            return False
+        with self.lock:
+            for _ in range(attempts):
+                seen = self._counter.value
+                if seen == self._seen_generation:
+                    return False
+                if seen % 2 == 0:
+                    try:
+                        self.load()
+                    except (OSError, ValueError, IndexFormatError) as e:
+                        log.warning("Reload of generation %d failed (%s), retrying", seen, e)
+                    else:
+                        if self._counter.value == seen:
+                            self._seen_generation = seen
+                            return True
+                # The owner is rewriting the files, retry once it is done
+                time.sleep(retry_delay)
+            return False
+
+    def append(self, path, embedding, manifest_entry=None):
+        """Adds one row in amortized O(1) and durably records it in the append log."""
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        with self.lock:
+            self._check_writable()
+            start_row = self._count
+            self._append_row(path, embedding, manifest_entry)
+            self._write_log_record(path, embedding, manifest_entry)
+            self._index_rows(start_row)
+            self.generation += 1
+            if self._log_records >= self.compact_every:
+                self.compact()
+            self._published()
+
+    def append_many(self, items):
+        """Adds (path, embedding, manifest_entry) tuples with a single fsync."""
+        with self.lock:
+            self._check_writable()
+            start_row = self._count
+            records = []
+            for path, embedding, manifest_entry in items:
+                embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+                self._append_row(path, embedding, manifest_entry)
+                records.append(self._encode_log_record(path, embedding, manifest_entry))
+            if not records:
+                return
+            self._write_log_bytes(b"".join(records), len(records))
+            self._index_rows(start_row)
+            self.generation += 1
+            if self._log_records >= self.compact_every:
+                self.compact()
+            self._published()
+
+    def replace(self, paths, embeddings, manifest):
+        """Swaps in a whole new index (e.g. after a re-sync) and compacts it to disk."""
+        with self.lock:
+            self._check_writable()
+            embeddings = np.asarray(embeddings)
+            if embeddings.size == 0:
+                embeddings = np.empty((0, self.dim), dtype=np.float32)
+            self._paths, self._base, self._count = list(paths), embeddings, len(paths)
+            self._deleted = np.empty(0, dtype=np.int64)
+            self._reset_tail()
+            self.manifest = manifest
+            self.vector_index.build(self.embeddings)
+            if self.neighbor_graph is not None:
+                self.neighbor_graph.build(self.embeddings)
+            if self.label_scores is not None:
+                self.label_scores.build(self.embeddings)
+            self.generation += 1
+            self.compact()
+
+    def remove(self, names):
+        """
+        Tombstones the rows of the given filenames: one fsync'ed delete record
+        each, no index rebuild. Returns how many were removed.
+        """
+        with self.lock:
+            self._check_writable()
+            rows = self._lookups()[0]
+            dead = sorted(rows[name] for name in set(names) if name in rows)
+            if not dead:
+                return 0
+            self._write_log_bytes(b"".join(self._encode_delete_record(self._paths[row]) for row in dead), len(dead))
+            for row in dead:
+                self.manifest.pop(self._paths[row], None)
+            self._deleted = np.union1d(self._deleted, dead).astype(np.int64)
+            self.generation += 1
+            if self._log_records >= self.compact_every:
+                self.compact()
+            self._published()
+            return len(dead)
+
+    def compact(self):
+        """Rewrites the base index from memory and truncates the append log."""
+        with self.lock:
+            self._check_writable()
+            if self._counter is not None:
+                self._counter.bump()  # odd: readers don't reload meanwhile
+            if self._deleted.size:
+                self._drop_deleted()
+            save_index(self.index_dir, self._paths, self.embeddings, self.model_name, dtype=self.dtype)
+            save_manifest(self.manifest, self.manifest_file)
+            self.vector_index.save(self.index_dir)
+            if self.neighbor_graph is not None:
+                self.neighbor_graph.save(self.index_dir)
+            if self.label_scores is not None:
+                self.label_scores.save(self.index_dir)
+            with open(self.log_file, "wb") as f:
+                os.fsync(f.fileno())
+            self._log_records = 0
+            # Serve everything from the freshly written file again: the tail is
+            # released and the pages are shared with every process mapping it
+            _, self._base, _ = load_index(self.index_dir)
+            self._reset_tail()
+            if self._counter is not None:
+                self._counter.bump()
+
+    def close(self):
+        """Compacts pending log records and releases the shared counter, called on shutdown."""
+        with self.lock:
+            if self._log_records and not self.read_only:
+                log.info("Compacting %d appended embeddings on shutdown", self._log_records)
+                self.compact()
+            if self._counter is not None:
+                self._counter.close()
+                self._counter = None
+
+    def _drop_deleted(self):
+        """Removes the tombstoned rows and renumbers the manifest, index, graph and label scores."""
+        keep = self.live_rows()
+        embeddings = self.embeddings[keep] if keep.size else np.empty((0, self.dim), dtype=np.float32)
+        self._paths = [self._paths[row] for row in keep.tolist()]
+        for row, path in enumerate(self._paths):
+            if path in self.manifest:
+                self.manifest[path]["row"] = row
+        self._base, self._count = embeddings, keep.size
+        self._deleted = np.empty(0, dtype=np.int64)
+        self._reset_tail()
+        self.vector_index.drop(embeddings, keep)
+        if self.neighbor_graph is not None:
+            self.neighbor_graph.drop(embeddings, keep)
+        if self.label_scores is not None:
+            self.label_scores.drop(embeddings, keep)
+        self.generation += 1
+
+    def _index_rows(self, start_row):
+        """Links rows start_row.. into the vector index, the neighbour graph and the label scores."""
+        self.vector_index.add(self.embeddings, start_row)
+        if self.neighbor_graph is not None:
+            self.neighbor_graph.add(self.embeddings, start_row)
+        if self.label_scores is not None:
+            self.label_scores.add(self.embeddings, start_row)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ReadOnlyStoreError(f"Index in {self.index_dir} is attached read-only")
+
+    def _published(self):
+        """Moves the shared counter on by one even step after an append."""
+        if self._counter is not None:
+            self._counter.bump(2)
+
+    def _reset_tail(self):
+        self._tail = np.empty((0, self._base.shape[1]), dtype=np.float32)
+        self._tail_count = 0
+
+    def _ensure_capacity(self, needed, dim):
+        """Room for needed tail rows; the memory-mapped base is never copied."""
+        if self._count and self.dim != dim:
+            raise ValueError(f"Embedding dimension {dim} does not match store dimension {self.dim}")
+        capacity = self._tail.shape[0]
+        if needed <= capacity and self._tail.shape[1] == dim:
+            return
+        # Double the tail capacity; only the tail rows are copied
+        new_capacity = max(MIN_CAPACITY, needed, capacity * 2)
+        tail = np.empty((new_capacity, dim), dtype=np.float32)
+        if self._tail_count:
+            tail[:self._tail_count] = self._tail[:self._tail_count]
+        self._tail = tail
+
+    def _append_row(self, path, embedding, manifest_entry):
+        self._ensure_capacity(self._tail_count + 1, embedding.shape[0])
+        self._tail[self._tail_count] = embedding
+        self._tail_count += 1
+        self._paths.append(path)
+        self._count += 1
+        if manifest_entry is not None:
+            self.manifest[path] = dict(manifest_entry, row=self._count - 1)
+
+    def _encode_log_record(self, path, embedding, manifest_entry):
+        name = path.encode("utf-8")
+        meta = json.dumps(manifest_entry or {}).encode("utf-8")
+        body = LOG_RECORD_HEADER.pack(LOG_MAGIC, len(name), len(meta), embedding.shape[0]) \
+            + name + meta + embedding.astype("<f4").tobytes()
+        return body + LOG_RECORD_CRC.pack(zlib.crc32(body))
+
+    def _encode_delete_record(self, path):
+        name = path.encode("utf-8")
+        body = LOG_RECORD_HEADER.pack(LOG_DELETE_MAGIC, len(name), 0, 0) + name
+        return body + LOG_RECORD_CRC.pack(zlib.crc32(body))
+
+    def _write_log_record(self, path, embedding, manifest_entry):
+        self._write_log_bytes(self._encode_log_record(path, embedding, manifest_entry), 1)
+
+    def _write_log_bytes(self, data, records):
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(self.log_file, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._log_records += records
+
+    def _replay_log(self):
+        if not os.path.exists(self.log_file):
+            return 0
+        with open(self.log_file, "rb") as f:
+            data = f.read()
+        offset, replayed, dead = 0, 0, []
+        rows = {path: row for row, path in enumerate(self._paths)}
+        while offset + LOG_RECORD_HEADER.size <= len(data):
+            magic, name_len, meta_len, dim = LOG_RECORD_HEADER.unpack_from(data, offset)
+            end = offset + LOG_RECORD_HEADER.size + name_len + meta_len + dim * 4
+            if magic not in (LOG_MAGIC, LOG_DELETE_MAGIC) or end + LOG_RECORD_CRC.size > len(data):
+                break
+            (crc,) = LOG_RECORD_CRC.unpack_from(data, end)
+            if crc != zlib.crc32(data[offset:end]):
+                break
+            start = offset + LOG_RECORD_HEADER.size
+            path = data[start:start + name_len].decode("utf-8")
+            if magic == LOG_DELETE_MAGIC:
+                # Deleting a file that is not in the base (crash after a compaction) is ignored
+                row = rows.pop(path, None)
+                if row is not None:
+                    dead.append(row)
+                    self.manifest.pop(path, None)
+            else:
+                meta = json.loads(data[start + name_len:start + name_len + meta_len] or b"{}")
+                embedding = np.frombuffer(data, dtype="<f4", count=dim, offset=start + name_len + meta_len)
+                # Records of a process that crashed during a compaction may already be in the base
+                if path not in rows:
+                    self._append_row(path, embedding, meta or None)
+                    rows[path] = self._count - 1
+            replayed += 1
+            offset = end + LOG_RECORD_CRC.size
+        if dead:
+            self._deleted = np.union1d(self._deleted, dead).astype(np.int64)
+        if offset < len(data) and not self.read_only:
+            log.warning("Truncating torn record at byte %d of %s", offset, self.log_file)
+            with open(self.log_file, "r+b") as f:
+                f.truncate(offset)
+        self._log_records = replayed
+        return replayed
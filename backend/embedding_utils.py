@@ -1,162 +1,352 @@
+import io
 import os
 import torch
 import clip
 from PIL import Image
 import numpy as np
-import re
-
-# CLIP modelini yükle
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model, preprocess = clip.load("ViT-B/32", device=device)
-
-def generate_image_embeddings(image_folder):
-    image_paths = []
-    embeddings = []
-
-    # List all files in the directory
-    for filename in os.listdir(image_folder):
-        # Filter for image files only
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
-            image_path = os.path.join(image_folder, filename)
-            try:
-                # Load and preprocess the image for CLIP
-                image = preprocess(Image.open(image_path)).unsqueeze(0).to(device)
-                
-                # Generate embedding using CLIP
-                with torch.no_grad():
-                    image_embedding = model.encode_image(image)
-                    image_embedding /= image_embedding.norm(dim=-1, keepdim=True)
-                
-                # Store embedding and filename separately
-                embeddings.append(image_embedding.cpu().numpy())
-                image_paths.append(filename)  # Just store the filename, not the full path
-                print(f"Processed image: {filename}")
-            except Exception as e:
-                print(f"Error processing {image_path}: {e}")
-    
-    # Stack all embeddings into a single numpy array if we have any
-    if embeddings:
-        print(f"Successfully processed {len(embeddings)} images")
-        return image_paths, np.vstack(embeddings)
-    
-    print("No valid images found or processed.")
+import time
+from concurrent.futures import ThreadPoolExecutor
+from text_cache import TextEmbeddingCache, normalize_query
+from vector_index import ExactIndex
+from inference_scheduler import InferenceScheduler
+from query_planner import plan_query, split_query, fuse
+from clip_model import load_model, MODEL_NAME
+from metrics import stage
+from log_utils import get_logger
+from index_manifest import IMAGE_EXTENSIONS
+
+log = get_logger("embedding_utils")
+
+# Batched encoder settings (overridable through environment variables)
+DEFAULT_BATCH_SIZE = int(os.environ.get("CODRESS_ENCODE_BATCH_SIZE", "32"))
+DEFAULT_NUM_WORKERS = int(os.environ.get("CODRESS_ENCODE_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+# Micro-batching: every encode call goes through one inference worker per encoder
+INFER_MAX_BATCH = int(os.environ.get("CODRESS_INFER_MAX_BATCH", "64"))
+INFER_MAX_WAIT_MS = float(os.environ.get("CODRESS_INFER_MAX_WAIT_MS", "5"))
+INFER_SCHEDULER_ENABLED = os.environ.get("CODRESS_INFER_SCHEDULER", "1") != "0"
+
+def _encode_image_tensors(tensors):
+    model, _, device = load_model()
+    with stage("image_encode", items=len(tensors)):
+        batch = torch.stack(tensors).to(device)
+        with torch.no_grad():
+            image_embeddings = model.encode_image(batch).float()
+            image_embeddings /= image_embeddings.norm(dim=-1, keepdim=True)
+        return image_embeddings.cpu().numpy()
+
+def _encode_texts(texts):
+    model, _, device = load_model()
+    with stage("tokenize", items=len(texts)):
+        # Long queries are cut at the 77-token context instead of failing the whole batch
+        text_tokens = clip.tokenize(texts, truncate=True).to(device)
+    with stage("text_encode", items=len(texts)):
+        with torch.no_grad():
+            text_embeddings = model.encode_text(text_tokens).float()
+            text_embeddings /= text_embeddings.norm(dim=-1, keepdim=True)
+        return text_embeddings.cpu().numpy()
+
+image_scheduler = InferenceScheduler("image", _encode_image_tensors, max_batch_size=INFER_MAX_BATCH,
+                                     max_wait_ms=INFER_MAX_WAIT_MS, enabled=INFER_SCHEDULER_ENABLED)
+text_scheduler = InferenceScheduler("text", _encode_texts, max_batch_size=INFER_MAX_BATCH,
+                                    max_wait_ms=INFER_MAX_WAIT_MS, enabled=INFER_SCHEDULER_ENABLED)
+
+def use_remote_text_encoder(encode_fn):
+    """Sends text batches to encode_fn (e.g. the model server) instead of the local model."""
+    def encode(texts):
+        with stage("remote_text_encode", items=len(texts)):
+            return encode_fn(texts)
+    text_scheduler.batch_fn = encode
+
+def _load_and_preprocess(image_path):
+    """Decodes and preprocesses one image. Runs on the worker pool."""
+    try:
+        _, preprocess, _ = load_model()
+        with Image.open(image_path) as image:
+            with stage("image_decode", items=1):
+                image.load()
+            with stage("image_preprocess", items=1):
+                return preprocess(image)
+    except Exception as e:
+        log.warning("Error processing %s: %s", image_path, e)
+        return None
+
+def encode_images(image_files, batch_size=None, num_workers=None):
+    """
+    Encodes a list of image files with CLIP in fixed-size batches.
+    A thread pool decodes and preprocesses the next batch while the
+    current one runs through the image encoder (via the image inference
+    scheduler), and the normalized embeddings are written into a
+    preallocated output array.
+    Returns a boolean mask of the images that were encoded and the
+    (n_encoded, dim) float32 embedding matrix.
+    """
+    batch_size = max(1, batch_size or DEFAULT_BATCH_SIZE)
+    num_workers = max(1, num_workers or DEFAULT_NUM_WORKERS)
+    n = len(image_files)
+    dim = load_model()[0].visual.output_dim
+    output = np.empty((n, dim), dtype=np.float32)
+    ok = np.zeros(n, dtype=bool)
+    if n == 0:
+        return ok, output
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        def submit(start):
+            return [pool.submit(_load_and_preprocess, path) for path in image_files[start:start + batch_size]]
+
+        def collect(encoding):
+            for row, future in encoding:
+                output[row] = future.result()
+                ok[row] = True
+
+        pending = submit(0)
+        encoding = []
+        for start in range(0, n, batch_size):
+            tensors = [future.result() for future in pending]
+            # Start decoding the next batch already
+            pending = submit(start + batch_size) if start + batch_size < n else []
+
+            valid = [i for i, tensor in enumerate(tensors) if tensor is not None]
+            futures = image_scheduler.submit_many([tensors[i] for i in valid])
+            # Collect the previous batch's results while this one is queued
+            collect(encoding)
+            encoding = [(start + i, future) for i, future in zip(valid, futures)]
+        collect(encoding)
+
+    elapsed = time.perf_counter() - start_time
+    encoded = int(ok.sum())
+    log.info("Encoded %d/%d images in %.2fs (%.1f images/sec, batch_size=%d, workers=%d)",
+             encoded, n, elapsed, encoded / elapsed if elapsed > 0 else 0.0, batch_size, num_workers)
+    return ok, output[ok]
+
+def generate_image_embeddings(image_folder, batch_size=None, num_workers=None):
+    # List all image files in the directory
+    filenames = [f for f in os.listdir(image_folder) if f.lower().endswith(IMAGE_EXTENSIONS)]
+    image_files = [os.path.join(image_folder, f) for f in filenames]
+
+    ok, embeddings = encode_images(image_files, batch_size=batch_size, num_workers=num_workers)
+    # Just store the filename, not the full path
+    image_paths = [f for f, encoded in zip(filenames, ok) if encoded]
+
+    if image_paths:
+        log.info("Successfully processed %d images", len(image_paths))
+        return image_paths, embeddings
+
+    log.info("No valid images found or processed.")
     return [], np.array([])
 
 # Adding the function that app.py is looking for
-def encode_images_from_folder(image_folder):
+def encode_images_from_folder(image_folder, batch_size=None, num_workers=None):
     """
     Encodes all images in a folder using CLIP model.
     Returns image paths and their embeddings.
     """
-    return generate_image_embeddings(image_folder)
+    return generate_image_embeddings(image_folder, batch_size=batch_size, num_workers=num_workers)
 
 def encode_single_image(image_path):
     """
     Encodes a single image file using CLIP model.
     Returns the embedding as a numpy array.
     """
+    ok, embeddings = encode_images([image_path], batch_size=1, num_workers=1)
+    if not ok[0]:
+        raise ValueError(f"Error encoding single image {image_path}")
+    return embeddings[0]
+
+def encode_image_bytes(data):
+    """
+    Encodes an uploaded image held in memory, without saving it.
+    Raises ValueError if the bytes are not a readable image.
+    """
+    _, preprocess, _ = load_model()
     try:
-        image = preprocess(Image.open(image_path)).unsqueeze(0).to(device)
-        with torch.no_grad():
-            image_embedding = model.encode_image(image)
-            image_embedding /= image_embedding.norm(dim=-1, keepdim=True)
-        return image_embedding.cpu().numpy().squeeze()
+        with Image.open(io.BytesIO(data)) as image:
+            with stage("image_decode", items=1):
+                image.load()
+            with stage("image_preprocess", items=1):
+                tensor = preprocess(image)
     except Exception as e:
-        print(f"Error encoding single image {image_path}: {e}")
-        raise
+        raise ValueError(f"Unreadable image: {e}") from e
+    return image_scheduler.submit(tensor).result()
+
+# Text embedding cache; CLIP's tokenizer lower-cases and collapses whitespace itself,
+# so queries that normalize to the same key always produce the same embedding
+text_cache = TextEmbeddingCache(
+    max_size=int(os.environ.get("CODRESS_TEXT_CACHE_SIZE", "1024")),
+    ttl=float(os.environ["CODRESS_TEXT_CACHE_TTL"]) if os.environ.get("CODRESS_TEXT_CACHE_TTL") else None,
+)
+
+_exact_index = ExactIndex()
+
+MIN_SIMILARITY_THRESHOLD = 0.2
+DEFAULT_TOP_K = 2
+# Candidates taken from each part of a compound query before fusion
+COMPOUND_PART_TOP_K = 3
+# Neighbours returned by "more like this" searches
+DEFAULT_SIMILAR_K = 12
+
+STYLE_PREFIXES = {
+    "formal": "formal style",
+    "casual": "casual style",
+}
+
+def augment_query(text_query, style=None):
+    """Prepends the style prompt used by search_images, if the style is known."""
+    prefix = STYLE_PREFIXES.get(style.lower()) if style else None
+    return f"{prefix} {text_query}" if prefix else text_query
+
+def generate_text_embeddings(texts):
+    """
+    Encodes a list of texts, running the text transformer once for all
+    cache misses. Returns a (len(texts), dim) array.
+    """
+    cached = [text_cache.get(text) for text in texts]
+    misses = list(dict.fromkeys(normalize_query(t) for t, e in zip(texts, cached) if e is None))
+    if misses:
+        fresh = dict(zip(misses, text_scheduler.map(misses)))
+        for text, embedding in fresh.items():
+            text_cache.put(text, embedding)
+        cached = [e if e is not None else fresh[normalize_query(t)] for t, e in zip(texts, cached)]
+    return np.vstack(cached) if cached else np.empty((0, load_model()[0].text_projection.shape[1]), dtype=np.float32)
 
 def generate_text_embedding(text):
-    print(f"[embedding_utils.py] generate_text_embedding for: '{text[:100]}...'")
-    text_tokens = clip.tokenize([text]).to(device)
-    with torch.no_grad():
-        text_embedding = model.encode_text(text_tokens)
-        text_embedding /= text_embedding.norm(dim=-1, keepdim=True)
-    print(f"[embedding_utils.py] Generated text_embedding shape: {text_embedding.shape}")
-    return text_embedding.cpu().numpy()
-
-def search_images(text_query, image_embeddings, image_paths, style=None):
-    print(f"[embedding_utils.py] search_images called with text_query: '{text_query}', style: '{style}'")
-    MIN_SIMILARITY_THRESHOLD = 0.2 
+    text_embedding = text_cache.get(text)
+    if text_embedding is None:
+        text_embedding = text_scheduler.submit(text).result()
+        text_cache.put(text, text_embedding)
+        log.debug("Encoded text embedding for '%.100s'", text)
+    else:
+        log.debug("Text embedding for '%.100s' served from cache", text)
+    return text_embedding.reshape(1, -1)
+
+def warm_text_cache(queries, styles=tuple(STYLE_PREFIXES)):
+    """
+    Pre-encodes common queries, together with their style-augmented prompts,
+    so the first requests for them skip the transformer.
+    """
+    texts = []
+    for query in queries:
+        query = query.strip()
+        if query:
+            texts.append(query)
+            texts.extend(augment_query(query, style) for style in styles)
+    for start in range(0, len(texts), DEFAULT_BATCH_SIZE):
+        generate_text_embeddings(texts[start:start + DEFAULT_BATCH_SIZE])
+    log.info("Warmed text cache with %d prompts", len(texts))
+    return len(texts)
+
+def search_images(text_query, image_embeddings, image_paths, style=None, index=None,
+                  fusion="max", limit=None, k=None, threshold=None, parts=None, rows=None):
+    """
+    Text search over the image embeddings. Compound queries ("shirt and jeans")
+    are planned by query_planner: all parts are encoded in one batch, scored
+    with one index search and merged with the given fusion strategy.
+    k and threshold apply to every part unless parts gives per-part values;
+    limit caps the fused result list (k for a plain query, DEFAULT_TOP_K
+    for a compound one). rows, if given, restricts the search to those rows
+    (e.g. an attribute filter): only they are scored, exactly.
+    """
+    log.debug("search_images called with text_query: '%s', style: '%s'", text_query, style)
+    # Top-k goes through the configured vector index (exact argpartition by default)
+    index = index or _exact_index
+    if rows is not None and image_embeddings is not None:
+        # The ANN index covers all rows; a filtered subset is scanned exactly
+        rows = np.asarray(rows, dtype=np.int64)
+        deleted = getattr(image_embeddings, "deleted", None)
+        if deleted is not None:
+            rows = rows[~np.isin(rows, deleted)]
+        image_embeddings = image_embeddings[rows]
+        image_paths = [image_paths[row] for row in rows.tolist()]
+        index = _exact_index
     
     if not image_paths or image_embeddings is None or image_embeddings.size == 0:
-        print("[embedding_utils.py] No image_paths or image_embeddings available.")
+        log.debug("No image_paths or image_embeddings available.")
         return []
     
     # CRUCIAL CHECK: Ensure consistency between embeddings and paths
     if image_embeddings.shape[0] != len(image_paths):
-        print(f"[embedding_utils.py] FATAL ERROR: Mismatch between image_embeddings count ({image_embeddings.shape[0]}) and image_paths count ({len(image_paths)}).")
+        log.error("Mismatch between image_embeddings count (%d) and image_paths count (%d).",
+                  image_embeddings.shape[0], len(image_paths))
         # This is a critical state. Consider how to handle - perhaps re-generate embeddings or return an error.
         # For now, returning empty to prevent further errors.
         return [] 
 
-    print(f"[embedding_utils.py] Number of image_paths: {len(image_paths)}, image_embeddings shape: {image_embeddings.shape}. Counts match.")
-
-    augmented_query = text_query
-    if style:
-        if style.lower() == 'formal':
-            augmented_query = f"formal style {text_query}" 
-        elif style.lower() == 'casual':
-            augmented_query = f"casual style {text_query}"
-    print(f"[embedding_utils.py] Augmented query: '{augmented_query}'")
-
-    query_parts = re.split(r'\s+(?:and|ve)\s+', augmented_query.lower())
-    final_results_to_return = []
-
-    if len(query_parts) > 1:
-        print(f"[embedding_utils.py] Compound query detected: {query_parts}")
-        all_results_compound = []
-        for query_part in query_parts:
-            query_part = query_part.strip()
-            if not query_part: continue
-            print(f"[embedding_utils.py] Processing compound part: '{query_part}'")
-            text_embedding = generate_text_embedding(query_part)
-            if text_embedding is None or text_embedding.size == 0: 
-                print(f"[embedding_utils.py] Failed to generate embedding for query part: '{query_part}'")
-                continue
-            
-            similarities = (image_embeddings @ text_embedding.T).squeeze()
-            print(f"[embedding_utils.py] Similarities for '{query_part}' (shape {similarities.shape}): min={np.min(similarities):.4f}, max={np.max(similarities):.4f}, mean={np.mean(similarities):.4f}")
-
-            top_k_compound = min(3, len(image_paths)) # Use len(image_paths) for safety
-            best_indices_compound = similarities.argsort()[-top_k_compound:][::-1]
-            
-            for i in best_indices_compound:
-                if i < len(image_paths): # Explicit boundary check
-                    similarity = float(similarities[i])
-                    if similarity >= MIN_SIMILARITY_THRESHOLD:
-                        all_results_compound.append({"filename": image_paths[i], "score": similarity, "query": query_part})
-                else:
-                    print(f"[embedding_utils.py] WARNING: Stale index {i} for image_paths of length {len(image_paths)} in compound query.")
-        
-        all_results_compound.sort(key=lambda x: x["score"], reverse=True)
-        unique_results_compound = {}
-        for result in all_results_compound:
-            filename = result["filename"]
-            if filename not in unique_results_compound or result["score"] > unique_results_compound[filename]["score"]:
-                unique_results_compound[filename] = result
-        final_results_to_return = list(unique_results_compound.values())[:2]
-    else:
-        print(f"[embedding_utils.py] Processing single query: '{augmented_query}'")
-        text_embedding = generate_text_embedding(augmented_query)
-        if text_embedding is None or text_embedding.size == 0:
-            print(f"[embedding_utils.py] Failed to generate embedding for query: '{augmented_query}'")
-            return []
-
-        similarities = (image_embeddings @ text_embedding.T).squeeze()
-        if similarities.size == 1: 
-            similarities = np.array([similarities.item()])
-        print(f"[embedding_utils.py] Similarities for '{augmented_query}' (shape {similarities.shape}): min={np.min(similarities):.4f}, max={np.max(similarities):.4f}, mean={np.mean(similarities):.4f}")
-
-        top_k_single = min(2, len(image_paths)) # Use len(image_paths) for safety
-        best_indices_single = similarities.argsort()[-top_k_single:][::-1]
-        
-        for i in best_indices_single:
-            if i < len(image_paths): # Explicit boundary check
-                similarity = float(similarities[i])
-                if similarity >= MIN_SIMILARITY_THRESHOLD:
-                    final_results_to_return.append({"filename": image_paths[i], "score": similarity})
-            else:
-                print(f"[embedding_utils.py] WARNING: Stale index {i} for image_paths of length {len(image_paths)} in single query.")
-    
-    print(f"[embedding_utils.py] search_images returning: {final_results_to_return}")
-    return final_results_to_return
+    threshold = MIN_SIMILARITY_THRESHOLD if threshold is None else float(threshold)
+    # Each part of a compound query contributes a few more candidates than a plain query
+    compound = len(parts or split_query(text_query)) > 1
+    plan = plan_query(text_query, k or (COMPOUND_PART_TOP_K if compound else DEFAULT_TOP_K), threshold, parts)
+    if not plan:
+        return []
+    log.debug("Query plan: %s", plan)
+
+    text_embeddings = generate_text_embeddings([augment_query(part["query"], style) for part in plan])
+    ks = np.array([min(part["k"], len(image_paths)) for part in plan])
+    scores, ids = index.search(image_embeddings, text_embeddings, int(ks.max()))
+
+    with stage("fusion"):
+        rows, similarities, part_ids, fused = fuse(
+            scores, ids, ks, [part["threshold"] for part in plan], fusion,
+            limit or (DEFAULT_TOP_K if len(plan) > 1 else int(ks[0])))
+        results = []
+        for row, similarity, part, fused_score in zip(rows.tolist(), similarities.tolist(), part_ids.tolist(), fused.tolist()):
+            result = {"filename": image_paths[row], "score": similarity}
+            if len(plan) > 1:
+                result["query"] = plan[part]["query"]
+            if fusion == "rrf":
+                result["fusedScore"] = fused_score
+            results.append(result)
+
+    log.debug("search_images returning: %s", results)
+    return results
+
+def search_images_batch(queries, image_embeddings, image_paths, index=None):
+    """
+    Runs many single queries at once. Each query is a dict with "query" and
+    optional "style", "k" and "threshold". All prompts are tokenized and
+    encoded in one batch and scored with a single matrix-matrix product.
+    Returns one ranked result list per query.
+    """
+    index = index or _exact_index
+    if not queries:
+        return []
+    if not image_paths or image_embeddings is None or image_embeddings.size == 0 \
+            or image_embeddings.shape[0] != len(image_paths):
+        return [[] for _ in queries]
+
+    prompts = [augment_query(q["query"], q.get("style")) for q in queries]
+    text_embeddings = generate_text_embeddings(prompts)
+    ks = [max(1, int(q.get("k") or DEFAULT_TOP_K)) for q in queries]
+    scores, ids = index.search(image_embeddings, text_embeddings, min(max(ks), len(image_paths)))
+
+    all_results = []
+    for qi, q in enumerate(queries):
+        threshold = q.get("threshold")
+        threshold = MIN_SIMILARITY_THRESHOLD if threshold is None else float(threshold)
+        results = []
+        for i, similarity in zip(ids[qi, :ks[qi]], scores[qi, :ks[qi]]):
+            if 0 <= i < len(image_paths) and similarity >= threshold:
+                results.append({"filename": image_paths[i], "score": float(similarity)})
+        all_results.append(results)
+    log.debug("search_images_batch answered %d queries", len(queries))
+    return all_results
+
+def search_similar(query_embedding, image_embeddings, image_paths, k=DEFAULT_SIMILAR_K, index=None,
+                   exclude_row=None, threshold=None):
+    """
+    Image-to-image search with an already encoded query (a stored row or a
+    transient upload). exclude_row drops the query image itself from its
+    own results; threshold, if given, is a minimum cosine similarity.
+    """
+    index = index or _exact_index
+    if not image_paths or image_embeddings is None or image_embeddings.size == 0 \
+            or image_embeddings.shape[0] != len(image_paths):
+        return []
+    depth = min(k + (exclude_row is not None), len(image_paths))
+    scores, ids = index.search(image_embeddings, np.asarray(query_embedding, dtype=np.float32).reshape(1, -1), depth)
+    results = []
+    for i, similarity in zip(ids[0].tolist(), scores[0].tolist()):
+        if i < 0 or i == exclude_row or (threshold is not None and similarity < threshold):
+            continue
+        results.append({"filename": image_paths[i], "score": similarity})
+    return results[:k]
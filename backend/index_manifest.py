@@ -0,0 +1,135 @@
+# index_manifest.py
+import os
+import json
+import hashlib
+import numpy as np
+
+from log_utils import get_logger
+
+log = get_logger("index_manifest")
+
+MANIFEST_VERSION = 1
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+def file_hash(path, chunk_size=1 << 20):
+    """Returns the sha256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def make_entry(path, row=None, sha256=None):
+    """Builds the manifest entry for one image file on disk."""
+    stat = os.stat(path)
+    entry = {
+        "sha256": sha256 or file_hash(path),
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+    }
+    if row is not None:
+        entry["row"] = int(row)
+    return entry
+
+def load_manifest(manifest_file):
+    """Loads the filename -> {sha256, mtime, size, row} manifest, or an empty one."""
+    if not os.path.exists(manifest_file):
+        return {}
+    try:
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != MANIFEST_VERSION or not isinstance(data.get("files"), dict):
+            log.warning("Unsupported manifest format in %s. Ignoring it.", manifest_file)
+            return {}
+        return data["files"]
+    except Exception as e:
+        log.warning("Error reading manifest %s: %s. Ignoring it.", manifest_file, e)
+        return {}
+
+def save_manifest(manifest, manifest_file):
+    """Atomically writes the manifest next to the embeddings file."""
+    tmp_file = manifest_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "files": manifest}, f)
+    os.replace(tmp_file, manifest_file)
+
+def sync_index(image_folder, image_paths, image_embeddings, manifest, full=False, encode_images=None):
+    """
+    Brings an existing index up to date with the files in image_folder.
+    Unchanged images keep their stored vectors, added or changed images are
+    encoded, and vectors of deleted images are dropped. A file whose mtime and
+    size match the manifest is trusted without re-hashing it. encode_images
+    defaults to the CLIP encoder, imported here so the storage modules load
+    without torch.
+    Returns (image_paths, image_embeddings, manifest, stats).
+    """
+    current_files = set(f for f in os.listdir(image_folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+    has_embeddings = (
+        not full
+        and image_embeddings is not None
+        and image_embeddings.ndim == 2
+        and image_embeddings.shape[0] == len(image_paths)
+    )
+    old_rows = {path: i for i, path in enumerate(image_paths)} if has_embeddings else {}
+
+    reuse_rows = []     # (filename, old_row, sha256), in the existing row order
+    to_encode = []      # (filename, sha256)
+    for filename, row in old_rows.items():
+        if filename not in current_files:
+            continue
+        full_path = os.path.join(image_folder, filename)
+        entry = manifest.get(filename)
+        stat = os.stat(full_path)
+        if entry and entry.get("mtime") == stat.st_mtime and entry.get("size") == stat.st_size:
+            reuse_rows.append((filename, row, entry["sha256"]))
+            continue
+        sha256 = file_hash(full_path)
+        # Trust the vectors of files left over from the old index (without a manifest entry)
+        if entry is None or entry.get("sha256") == sha256:
+            reuse_rows.append((filename, row, sha256))
+        else:
+            to_encode.append((filename, sha256))
+    to_encode.extend((filename, None) for filename in sorted(current_files) if filename not in old_rows)
+
+    removed = len(set(old_rows) - set(current_files))
+    added = changed = 0
+
+    new_paths = [filename for filename, _, _ in reuse_rows]
+    if len(reuse_rows) == len(image_paths) and has_embeddings:
+        # No row was removed: use the existing matrix (possibly a memmap) without copying it
+        parts = [image_embeddings] if reuse_rows else []
+    else:
+        parts = [image_embeddings[[row for _, row, _ in reuse_rows]]] if reuse_rows else []
+    new_manifest = {}
+    for i, (filename, _, sha256) in enumerate(reuse_rows):
+        new_manifest[filename] = make_entry(os.path.join(image_folder, filename), i, sha256)
+
+    if to_encode:
+        if encode_images is None:
+            from embedding_utils import encode_images
+        image_files = [os.path.join(image_folder, filename) for filename, _ in to_encode]
+        ok, encoded = encode_images(image_files)
+        for (filename, sha256), image_file, encoded_ok in zip(to_encode, image_files, ok):
+            if encoded_ok:
+                new_manifest[filename] = make_entry(image_file, len(new_paths), sha256)
+                new_paths.append(filename)
+                if filename in old_rows:
+                    changed += 1
+                else:
+                    added += 1
+        if encoded.shape[0] > 0:
+            parts.append(encoded)
+
+    if len(parts) == 1:
+        new_embeddings = parts[0]
+    else:
+        new_embeddings = np.vstack(parts).astype(np.float32, copy=False) if parts else np.array([])
+    stats = {
+        "reused": len(reuse_rows),
+        "added": added,
+        "changed": changed,
+        "removed": removed,
+        "total": len(new_paths),
+    }
+    log.info("Index sync: %s", stats)
+    return new_paths, new_embeddings, new_manifest, stats
@@ -0,0 +1,250 @@
+# index_store.py
+"""
+Versioned, pickle-free on-disk format for the embedding index.
+
+An index is a directory with a header and one matrix and paths file per
+saved version:
+  header.json                 format version, dim, count, dtype, model name,
+                              checksum and the names of the two files below
+  embeddings.<checksum>.bin   raw contiguous (count, dim) matrix, C order,
+                              little endian
+  paths.<checksum>.txt        one image filename per line, in row order
+
+A save writes the new version's files under their own names and then
+atomically replaces header.json, the only pointer to them; files of older
+versions are deleted afterwards. A crash at any point leaves either the
+old or the new index, never a mix. Version 1 indexes (fixed embeddings.bin
+and paths.txt names) are still read.
+
+The matrix is opened with np.memmap, so loading is O(1) and the pages are
+shared between every process that maps the same file.
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import numpy as np
+
+from log_utils import get_logger
+
+log = get_logger("index_store")
+
+INDEX_FORMAT = "codress-index"
+INDEX_VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+HEADER_FILE = "header.json"
+# Version 1 file names; version 2 puts the checksum between name and extension
+MATRIX_FILE = "embeddings.bin"
+PATHS_FILE = "paths.txt"
+VERSION_FILE = re.compile(r"^(embeddings\.[0-9a-f]+\.bin|paths\.[0-9a-f]+\.txt)(\.tmp)?$")
+SUPPORTED_DTYPES = ("float32", "float16")
+# Rows are converted, hashed and written in chunks of about this many bytes
+WRITE_CHUNK_BYTES = 64 << 20
+
+class IndexFormatError(Exception):
+    """Raised when an index directory is missing, truncated or inconsistent."""
+
+def _checksum(matrix, paths):
+    digest = hashlib.sha256()
+    matrix = np.ascontiguousarray(matrix)
+    # Hash in 64 MB chunks instead of copying large memmaps at once
+    flat = matrix.reshape(-1).view(np.uint8) if matrix.size else np.empty(0, dtype=np.uint8)
+    step = 64 << 20
+    for start in range(0, flat.shape[0], step):
+        digest.update(flat[start:start + step].tobytes())
+    digest.update("\n".join(paths).encode("utf-8"))
+    return digest.hexdigest()
+
+def index_exists(index_dir):
+    return os.path.exists(os.path.join(index_dir, HEADER_FILE))
+
+def save_index(index_dir, paths, embeddings, model_name, dtype="float32"):
+    """
+    Writes paths and embeddings as a new index version and switches
+    header.json to it last, so readers never see a half-written or mixed
+    index. embeddings may be any (count, dim) array-like that supports row
+    slices (e.g. a memmap or an EmbeddingView); it is converted, hashed and
+    written in chunks, never copied whole.
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported index dtype '{dtype}', expected one of {SUPPORTED_DTYPES}")
+    if not hasattr(embeddings, "shape"):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+    count = embeddings.shape[0] if len(embeddings.shape) else 0
+    dim = int(embeddings.shape[1]) if count and len(embeddings.shape) == 2 else 0
+    if (count and len(embeddings.shape) != 2) or count != len(paths):
+        raise IndexFormatError(f"Expected a ({len(paths)}, dim) matrix, got shape {embeddings.shape}")
+    if any("\n" in p for p in paths):
+        raise IndexFormatError("Image filenames must not contain newlines")
+    os.makedirs(index_dir, exist_ok=True)
+
+    # The new version's files are written under temporary names, checksummed while writing
+    file_dtype = np.dtype(dtype).newbyteorder("<")
+    digest = hashlib.sha256()
+    matrix_tmp = os.path.join(index_dir, "embeddings.bin.tmp")
+    with open(matrix_tmp, "wb") as f:
+        step = max(1, WRITE_CHUNK_BYTES // max(1, dim * file_dtype.itemsize))
+        for start in range(0, count, step):
+            chunk = np.ascontiguousarray(np.asarray(embeddings[start:start + step]), dtype=file_dtype).tobytes()
+            digest.update(chunk)
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    names = "\n".join(paths)
+    digest.update(names.encode("utf-8"))
+    checksum = digest.hexdigest()
+
+    header = {
+        "format": INDEX_FORMAT,
+        "version": INDEX_VERSION,
+        "dim": dim,
+        "count": int(count),
+        "dtype": dtype,
+        "model": model_name,
+        "checksum": checksum,
+        "matrix_file": f"embeddings.{checksum[:16]}.bin",
+        "paths_file": f"paths.{checksum[:16]}.txt",
+        "created": time.time(),
+    }
+    paths_tmp = os.path.join(index_dir, header["paths_file"] + ".tmp")
+    with open(paths_tmp, "w", encoding="utf-8") as f:
+        f.write(names)
+        f.flush()
+        os.fsync(f.fileno())
+    header_tmp = os.path.join(index_dir, HEADER_FILE + ".tmp")
+    with open(header_tmp, "w", encoding="utf-8") as f:
+        json.dump(header, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(matrix_tmp, os.path.join(index_dir, header["matrix_file"]))
+    os.replace(paths_tmp, os.path.join(index_dir, header["paths_file"]))
+    _fsync_dir(index_dir)
+    # The single atomic switch: header.json points at the new version
+    os.replace(header_tmp, os.path.join(index_dir, HEADER_FILE))
+    _fsync_dir(index_dir)
+    _remove_old_versions(index_dir, header)
+    return header
+
+def _fsync_dir(path):
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _remove_old_versions(index_dir, header):
+    """Deletes matrix and paths files the header no longer points at; mapped copies stay valid."""
+    current = {header["matrix_file"], header["paths_file"]}
+    for name in os.listdir(index_dir):
+        if name not in current and (VERSION_FILE.match(name) or name in (MATRIX_FILE, PATHS_FILE, MATRIX_FILE + ".tmp")):
+            try:
+                os.remove(os.path.join(index_dir, name))
+            except OSError:
+                pass
+
+def read_header(index_dir):
+    header_file = os.path.join(index_dir, HEADER_FILE)
+    try:
+        with open(header_file, "r", encoding="utf-8") as f:
+            header = json.load(f)
+    except (OSError, ValueError) as e:
+        raise IndexFormatError(f"Cannot read index header {header_file}: {e}")
+    if header.get("format") != INDEX_FORMAT:
+        raise IndexFormatError(f"{header_file} is not a {INDEX_FORMAT} header")
+    if header.get("version") not in SUPPORTED_VERSIONS:
+        raise IndexFormatError(f"Unsupported index version {header.get('version')} in {header_file}")
+    if header.get("dtype") not in SUPPORTED_DTYPES:
+        raise IndexFormatError(f"Unsupported index dtype {header.get('dtype')} in {header_file}")
+    return header
+
+def load_index(index_dir, mmap=True, verify=False, model_name=None):
+    """
+    Opens an index directory. Returns (paths, embeddings, header) where
+    embeddings is a read-only np.memmap unless mmap=False.
+    The file sizes are always checked against the header; the full checksum
+    is only recomputed with verify=True because it touches every page.
+    """
+    header = read_header(index_dir)
+    if model_name is not None and header.get("model") != model_name:
+        raise IndexFormatError(f"Index was built with model '{header.get('model')}', expected '{model_name}'")
+
+    count, dim = header["count"], header["dim"]
+    dtype = np.dtype(header["dtype"]).newbyteorder("<")
+    paths_name = header.get("paths_file", PATHS_FILE)
+    with open(os.path.join(index_dir, paths_name), "r", encoding="utf-8") as f:
+        content = f.read()
+    paths = content.split("\n") if content else []
+    if len(paths) != count:
+        raise IndexFormatError(f"Index header says {count} rows but {paths_name} has {len(paths)}")
+
+    matrix_file = os.path.join(index_dir, header.get("matrix_file", MATRIX_FILE))
+    expected_size = count * dim * dtype.itemsize
+    actual_size = os.path.getsize(matrix_file)
+    if actual_size != expected_size:
+        raise IndexFormatError(f"{matrix_file} is {actual_size} bytes, expected {expected_size}")
+
+    if count == 0:
+        embeddings = np.empty((0, dim), dtype=dtype)
+    elif mmap:
+        embeddings = np.memmap(matrix_file, dtype=dtype, mode="r", shape=(count, dim))
+    else:
+        embeddings = np.fromfile(matrix_file, dtype=dtype).reshape(count, dim)
+
+    if verify and _checksum(embeddings, paths) != header["checksum"]:
+        raise IndexFormatError(f"Checksum mismatch for index in {index_dir}")
+    return paths, embeddings, header
+
+def load_legacy_npy(npy_file):
+    """Reads the old np.save({"embeddings", "paths"}) pickle format."""
+    data = np.load(npy_file, allow_pickle=True).item()
+    if not isinstance(data, dict) or "embeddings" not in data or "paths" not in data:
+        raise IndexFormatError(f"{npy_file} does not contain an embeddings/paths dict")
+    paths = [str(p) for p in data["paths"]]
+    embeddings = np.asarray(data["embeddings"], dtype=np.float32)
+    if embeddings.size == 0:
+        embeddings = embeddings.reshape(0, 0)
+    if embeddings.ndim != 2 or embeddings.shape[0] != len(paths):
+        raise IndexFormatError(f"{npy_file} has {len(paths)} paths but embeddings of shape {embeddings.shape}")
+    return paths, embeddings
+
+def migrate_npy(npy_file, index_dir, model_name, dtype="float32", remove_source=False):
+    """One-shot migration of a legacy .npy index into the versioned format."""
+    paths, embeddings = load_legacy_npy(npy_file)
+    header = save_index(index_dir, paths, embeddings, model_name, dtype=dtype)
+    load_index(index_dir, verify=True)
+    log.info("Migrated %d embeddings from %s to %s", len(paths), npy_file, index_dir)
+    if remove_source:
+        os.remove(npy_file)
+    return header
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="CoDress embedding index tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser("migrate", help="convert a legacy image_embeddings.npy")
+    migrate_parser.add_argument("npy_file")
+    migrate_parser.add_argument("index_dir")
+    migrate_parser.add_argument("--model", default="ViT-B/32")
+    migrate_parser.add_argument("--dtype", default="float32", choices=SUPPORTED_DTYPES)
+    migrate_parser.add_argument("--remove-source", action="store_true")
+
+    verify_parser = subparsers.add_parser("verify", help="check sizes and checksum of an index")
+    verify_parser.add_argument("index_dir")
+
+    args = parser.parse_args()
+    try:
+        if args.command == "migrate":
+            migrate_npy(args.npy_file, args.index_dir, args.model, dtype=args.dtype,
+                        remove_source=args.remove_source)
+        else:
+            paths, embeddings, header = load_index(args.index_dir, verify=True)
+            print(f"OK: {header['count']} x {header['dim']} {header['dtype']} ({header['model']})")
+    except IndexFormatError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
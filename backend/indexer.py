@@ -0,0 +1,287 @@
+# indexer.py
+"""
+Resumable, sharded bulk indexer for large catalogues.
+
+    python indexer.py /path/to/catalogue            # a folder, or
+    python indexer.py catalogue.tar.gz --processes 4 --shard-size 2000
+    python indexer.py catalogue.zip --mode replace
+
+The source images are split into shards of --shard-size files. Shards are
+encoded by --processes worker processes, each with its own CLIP copy. A
+finished shard is checkpointed to <work-dir>/shard-NNNNN.npz. If the run
+dies, the same command picks up at the first shard without a checkpoint.
+The shards are then merged into the serving index: appended to it by
+default, or replacing it with --mode replace. The merge writes the
+manifest too, and the kNN graph and label scores when the server's
+CODRESS_KNN_GRAPH / CODRESS_ZERO_SHOT settings enable them, so the server
+loads the result on its next start without re-encoding anything. Stop
+the server (or the model server) before merging; it owns the index files
+while it runs.
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tarfile
+import zipfile
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from werkzeug.utils import secure_filename
+
+from log_utils import get_logger
+
+log = get_logger("indexer")
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_FOLDER = os.environ.get("CODRESS_DATA_DIR", os.path.join(BACKEND_DIR, "data"))
+INDEX_DIR = os.path.join(IMAGE_FOLDER, "index")
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+PLAN_FILE = "plan.json"
+DEFAULT_SHARD_SIZE = 1000
+# Folders the server keeps inside the image folder; never catalogue images
+MANAGED_FOLDERS = {"index", "thumbs", "incoming", "jobs", "users", "onnx"}
+
+def source_kind(source):
+    if os.path.isdir(source):
+        return "dir"
+    if tarfile.is_tarfile(source):
+        return "tar"
+    if zipfile.is_zipfile(source):
+        return "zip"
+    raise ValueError(f"{source} is neither a folder nor a tar/zip archive")
+
+def list_members(source, kind, skip=()):
+    """
+    Image members of the source in a stable order: relative paths or archive
+    names. skip names top-level folders of a dir source that are not walked.
+    """
+    if kind == "dir":
+        members = []
+        for root, dirs, files in os.walk(source):
+            if root == source:
+                dirs[:] = [d for d in dirs if d not in skip]
+            for name in files:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    members.append(os.path.relpath(os.path.join(root, name), source))
+    elif kind == "tar":
+        with tarfile.open(source) as archive:
+            members = [m.name for m in archive.getmembers() if m.isfile() and m.name.lower().endswith(IMAGE_EXTENSIONS)]
+    else:
+        with zipfile.ZipFile(source) as archive:
+            members = [name for name in archive.namelist() if not name.endswith("/") and name.lower().endswith(IMAGE_EXTENSIONS)]
+    return sorted(members)
+
+def target_names(members, image_folder, in_place=False):
+    """
+    Flat, unique filenames in the image folder; clashing names get a short
+    hash of the member path. With in_place (the source is the image folder)
+    files at its top level keep their names.
+    """
+    taken = set(os.listdir(image_folder)) if os.path.isdir(image_folder) else set()
+    names = []
+    for member in members:
+        if in_place and os.path.dirname(member) == "":
+            names.append(member)
+            continue
+        name = secure_filename(os.path.basename(member)) or "image.jpg"
+        if name in taken:
+            stem, ext = os.path.splitext(name)
+            name = f"{stem}-{hashlib.sha1(member.encode('utf-8')).hexdigest()[:10]}{ext}"
+        taken.add(name)
+        names.append(name)
+    return names
+
+def load_or_create_plan(source, work_dir, image_folder, shard_size):
+    """Returns the run's plan, reusing the one in work_dir when it was made for the same source."""
+    plan_file = os.path.join(work_dir, PLAN_FILE)
+    source = os.path.abspath(source)
+    if os.path.exists(plan_file):
+        with open(plan_file, "r", encoding="utf-8") as f:
+            plan = json.load(f)
+        if plan["source"] != source:
+            raise ValueError(f"{work_dir} holds a run for {plan['source']}; use another --work-dir or delete it")
+        log.info("Resuming run for %s (%d files, %d shards)", source, len(plan["members"]), len(plan["shards"]))
+        return plan
+
+    kind = source_kind(source)
+    in_place = kind == "dir" and source == os.path.abspath(image_folder)
+    skip = set()
+    if in_place:
+        # Thumbnails, the index, its checkpoints and the wardrobes are not catalogue images
+        skip = MANAGED_FOLDERS | {d for d in os.listdir(source) if d.endswith(".build")}
+        if os.path.dirname(os.path.abspath(work_dir)) == source:
+            skip.add(os.path.basename(os.path.abspath(work_dir)))
+    members = list_members(source, kind, skip)
+    names = target_names(members, image_folder, in_place)
+    plan = {
+        "source": source,
+        "kind": kind,
+        "members": members,
+        "names": names,
+        "shards": [[start, min(start + shard_size, len(members))] for start in range(0, len(members), shard_size)],
+    }
+    os.makedirs(work_dir, exist_ok=True)
+    tmp_file = plan_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(plan, f)
+    os.replace(tmp_file, plan_file)
+    log.info("Planned %d files from %s in %d shards", len(members), source, len(plan["shards"]))
+    return plan
+
+def shard_file(work_dir, shard_id):
+    return os.path.join(work_dir, f"shard-{shard_id:05d}.npz")
+
+def shard_job(plan, shard_id):
+    """The part of the plan one worker needs, so the full file list is not pickled per shard."""
+    start, stop = plan["shards"][shard_id]
+    return {"id": shard_id, "source": plan["source"], "kind": plan["kind"],
+            "members": plan["members"][start:stop], "names": plan["names"][start:stop]}
+
+def materialize(job, image_folder):
+    """Copies or extracts the shard's files into the image folder; returns (path, copied) pairs."""
+    archive = None
+    if job["kind"] == "tar":
+        archive = tarfile.open(job["source"])
+    elif job["kind"] == "zip":
+        archive = zipfile.ZipFile(job["source"])
+    paths = []
+    try:
+        for member, name in zip(job["members"], job["names"]):
+            target = os.path.join(image_folder, name)
+            tmp_target = target + ".part"
+            if archive is None:
+                source_path = os.path.join(job["source"], member)
+                if os.path.abspath(source_path) == os.path.abspath(target):
+                    paths.append((target, False))  # already in the data folder
+                    continue
+                shutil.copyfile(source_path, tmp_target)
+            else:
+                src = archive.extractfile(member) if job["kind"] == "tar" else archive.open(member)
+                with src, open(tmp_target, "wb") as out:
+                    shutil.copyfileobj(src, out)
+            os.replace(tmp_target, target)
+            paths.append((target, True))
+    finally:
+        if archive is not None:
+            archive.close()
+    return paths
+
+def init_worker(threads):
+    import torch
+    torch.set_num_threads(max(1, threads))
+
+def encode_shard(job, work_dir, image_folder, batch_size=None):
+    """Worker process: encodes one shard and checkpoints it. Returns (shard_id, encoded, failed)."""
+    from embedding_utils import encode_images
+    from index_manifest import file_hash
+    from clip_model import MODEL_NAME
+
+    shard_id = job["id"]
+    files = materialize(job, image_folder)
+    ok, embeddings = encode_images([path for path, _ in files], batch_size=batch_size)
+    names = [name for name, encoded in zip(job["names"], ok) if encoded]
+    failed = [(path, copied) for (path, copied), encoded in zip(files, ok) if not encoded]
+    for path, copied in failed:
+        # A broken copy left behind would be re-encoded by the server at startup
+        if copied:
+            os.remove(path)
+    sha256 = [file_hash(os.path.join(image_folder, name)) for name in names]
+
+    tmp_file = shard_file(work_dir, shard_id) + ".tmp.npz"
+    np.savez(tmp_file, names=np.array(names, dtype=str), embeddings=embeddings,
+             sha256=np.array(sha256, dtype=str), model=np.array(MODEL_NAME))
+    os.replace(tmp_file, shard_file(work_dir, shard_id))
+    return shard_id, len(names), len(failed)
+
+def run_shards(plan, work_dir, image_folder, processes=1, threads=None, batch_size=None):
+    """Encodes every shard without a checkpoint. Returns the number of shards encoded now."""
+    pending = [i for i in range(len(plan["shards"])) if not os.path.exists(shard_file(work_dir, i))]
+    done = len(plan["shards"]) - len(pending)
+    if done:
+        log.info("%d of %d shards already checkpointed", done, len(plan["shards"]))
+    if not pending:
+        return 0
+    os.makedirs(image_folder, exist_ok=True)
+    threads = threads or max(1, (os.cpu_count() or 1) // max(1, processes))
+    context = multiprocessing.get_context("spawn")  # each process loads its own copy of CLIP
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                             initializer=init_worker, initargs=(threads,)) as pool:
+        futures = [pool.submit(encode_shard, shard_job(plan, i), work_dir, image_folder, batch_size) for i in pending]
+        for future in as_completed(futures):
+            shard_id, encoded, failed = future.result()
+            done += 1
+            log.info("Shard %d done: %d encoded, %d failed (%d/%d shards)",
+                     shard_id, encoded, failed, done, len(plan["shards"]))
+    return len(pending)
+
+def merge_shards(plan, work_dir, index_dir, image_folder, mode="append", dtype="float32"):
+    """Merges the checkpointed shards into the serving index. Returns the index size."""
+    from embedding_store import EmbeddingStore
+    from index_manifest import make_entry
+    from vector_index import create_index
+    from knn_graph import KNNGraph
+    from zero_shot import LabelScores, load_label_set
+    from clip_model import MODEL_NAME
+
+    names, embeddings, hashes = [], [], []
+    for shard_id in range(len(plan["shards"])):
+        with np.load(shard_file(work_dir, shard_id)) as shard:
+            if str(shard["model"]) != MODEL_NAME:
+                raise ValueError(f"Shard {shard_id} was encoded with {shard['model']}, the server uses {MODEL_NAME}")
+            if shard["names"].size:
+                names.extend(shard["names"].tolist())
+                embeddings.append(shard["embeddings"])
+                hashes.extend(shard["sha256"].tolist())
+
+    # Same components as app.py, so the kNN graph and label scores are updated with the index
+    label_set = load_label_set() if os.environ.get("CODRESS_ZERO_SHOT", "1") != "0" else None
+    store = EmbeddingStore(index_dir, MODEL_NAME, dtype=dtype, vector_index=create_index(),
+                           neighbor_graph=KNNGraph(int(os.environ.get("CODRESS_KNN_K", "16")))
+                           if os.environ.get("CODRESS_KNN_GRAPH", "0") == "1" else None,
+                           label_scores=LabelScores(label_set) if label_set else None).load()
+    if mode == "replace":
+        matrix = np.vstack(embeddings) if embeddings else np.empty((0, store.dim), dtype=np.float32)
+        manifest = {name: make_entry(os.path.join(image_folder, name), row, sha256)
+                    for row, (name, sha256) in enumerate(zip(names, hashes))}
+        store.replace(names, matrix, manifest)
+    else:
+        rows = iter(np.vstack(embeddings)) if embeddings else iter(())
+        # Rerunning the same command doesn't duplicate rows it already added
+        items = [(name, embedding, make_entry(os.path.join(image_folder, name), sha256=sha256))
+                 for name, embedding, sha256 in zip(names, rows, hashes) if name not in store.manifest]
+        store.append_many(items)
+        store.compact()
+    log.info("Merged %d images into %s (%s); the index now holds %d", len(names), index_dir, mode, len(store))
+    return len(store)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Encode a folder or tar/zip archive of images into the index.")
+    parser.add_argument("source", help="image folder, .tar(.gz) or .zip")
+    parser.add_argument("--image-folder", default=IMAGE_FOLDER, help="where the images are copied to and served from")
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    parser.add_argument("--work-dir", help="checkpoint folder (default: <index-dir>.build)")
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE)
+    parser.add_argument("--processes", type=int, default=1, help="encoder processes, each loads CLIP")
+    parser.add_argument("--threads", type=int, help="torch threads per process (default: cores / processes)")
+    parser.add_argument("--batch-size", type=int)
+    parser.add_argument("--mode", choices=("append", "replace"), default="append")
+    parser.add_argument("--dtype", default=os.environ.get("CODRESS_INDEX_DTYPE", "float32"))
+    parser.add_argument("--no-merge", action="store_true", help="only encode and checkpoint the shards")
+    parser.add_argument("--keep-shards", action="store_true", help="keep the work dir after a successful merge")
+    args = parser.parse_args(argv)
+
+    work_dir = args.work_dir or args.index_dir.rstrip(os.sep) + ".build"
+    plan = load_or_create_plan(args.source, work_dir, args.image_folder, max(1, args.shard_size))
+    run_shards(plan, work_dir, args.image_folder, max(1, args.processes), args.threads, args.batch_size)
+    if args.no_merge:
+        return 0
+    merge_shards(plan, work_dir, args.index_dir, args.image_folder, args.mode, args.dtype)
+    if not args.keep_shards:
+        shutil.rmtree(work_dir)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
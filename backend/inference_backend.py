@@ -0,0 +1,304 @@
+# inference_backend.py
+"""
+Selectable CPU inference backends for the CLIP encoders.
+
+  eager        the PyTorch model as loaded by clip.load (reference)
+  int8         dynamic int8 quantization of every nn.Linear (the transformer
+               MLPs and projections); weights are quantized once, activations
+               per batch, ~2-3x faster text encoding on AVX2/AVX512 CPUs
+  torchscript  OpenAI's TorchScript export of the same weights, frozen
+               for inference
+  onnx         the encoders exported to ONNX and run with onnxruntime
+               (optional dependency), cached under CODRESS_ONNX_DIR per
+               model, opset and torch version
+
+CODRESS_INFER_BACKEND picks the backend and CODRESS_TORCH_THREADS /
+CODRESS_TORCH_INTEROP_THREADS the intra/inter-op thread pools (also used by
+onnxruntime). Before a non-eager backend replaces the reference model,
+parity() encodes probe prompts and images with both and reports the cosine
+drift; below CODRESS_INFER_MIN_COSINE the reference model is kept.
+
+    python inference_backend.py --backends eager,int8,torchscript,onnx --images data/
+"""
+import os
+import sys
+import json
+import time
+import types
+import hashlib
+import argparse
+import numpy as np
+import torch
+import clip
+
+from log_utils import get_logger
+
+log = get_logger("inference_backend")
+
+BACKENDS = ("eager", "int8", "torchscript", "onnx")
+INFER_BACKEND = os.environ.get("CODRESS_INFER_BACKEND", "eager")
+TORCH_THREADS = int(os.environ.get("CODRESS_TORCH_THREADS", "0"))
+TORCH_INTEROP_THREADS = int(os.environ.get("CODRESS_TORCH_INTEROP_THREADS", "0"))
+MIN_COSINE = float(os.environ.get("CODRESS_INFER_MIN_COSINE", "0.98"))
+ONNX_DIR = os.environ.get("CODRESS_ONNX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "onnx"))
+ONNX_OPSET = 14
+# Bump when the exported graphs change (wrappers, inputs, dynamic axes) so cached exports are redone
+ONNX_EXPORT_VERSION = 1
+
+PROBE_TEXTS = [
+    "black dress", "white shirt", "blue denim jacket", "formal style grey suit",
+    "casual style summer floral skirt", "red leather boots", "a photo of a striped t-shirt",
+]
+
+class BackendError(Exception):
+    """Raised when a backend cannot be built in this environment."""
+
+def configure_threads(intra=TORCH_THREADS, inter=TORCH_INTEROP_THREADS):
+    """Applies the thread settings; 0 keeps PyTorch's default."""
+    if intra > 0:
+        torch.set_num_threads(intra)
+    if inter > 0:
+        try:
+            torch.set_num_interop_threads(inter)
+        except RuntimeError as e:
+            # Can only be set before the first parallel work
+            log.warning("Could not set inter-op threads: %s", e)
+    return {"intra_op": torch.get_num_threads(), "inter_op": torch.get_num_interop_threads()}
+
+class CompiledCLIP:
+    """
+    Same interface embedding_utils uses on the eager model (encode_text,
+    encode_image, visual.output_dim, text_projection) over other runtimes.
+    """
+
+    def __init__(self, reference, encode_text, encode_image, backend):
+        self.backend = backend
+        self.visual = types.SimpleNamespace(output_dim=reference.visual.output_dim)
+        self.text_projection = reference.text_projection.detach()
+        self._encode_text = encode_text
+        self._encode_image = encode_image
+
+    def encode_text(self, tokens):
+        return self._encode_text(tokens)
+
+    def encode_image(self, images):
+        return self._encode_image(images)
+
+    def eval(self):
+        return self
+
+def _int8(model):
+    quantized = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return quantized.eval()
+
+def _torchscript(model, model_name):
+    scripted, _ = clip.load(model_name, device="cpu", jit=True)
+    scripted = scripted.eval()
+    try:
+        # Fold the constant weights into the graph; keep the unfrozen graph if that is not supported
+        scripted = torch.jit.freeze(scripted, preserved_attrs=["encode_text", "encode_image"])
+    except Exception as e:
+        log.info("TorchScript freeze skipped: %s", e)
+    return CompiledCLIP(model, scripted.encode_text, scripted.encode_image, "torchscript")
+
+class _TextEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, tokens):
+        return self.model.encode_text(tokens)
+
+class _ImageEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, images):
+        return self.model.encode_image(images)
+
+def _onnx_signature(model_name):
+    """Short hash of everything an export depends on besides the weights' name."""
+    key = json.dumps({"model": model_name, "opset": ONNX_OPSET, "export": ONNX_EXPORT_VERSION,
+                      "torch": torch.__version__, "clip": getattr(clip, "__version__", None)}, sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+
+def _remove_stale_exports(prefix, name, current):
+    """Deletes exports of the same model and encoder made under another signature."""
+    for entry in os.listdir(ONNX_DIR):
+        path = os.path.join(ONNX_DIR, entry)
+        if entry.startswith(prefix + "-") and entry.endswith(f"-{name}.onnx") and path != current:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def _onnx(model, model_name, intra=TORCH_THREADS, inter=TORCH_INTEROP_THREADS):
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise BackendError("The onnx backend needs onnxruntime (pip install onnxruntime)") from e
+    os.makedirs(ONNX_DIR, exist_ok=True)
+    prefix = model_name.replace("/", "-")
+    stem = os.path.join(ONNX_DIR, f"{prefix}-{_onnx_signature(model_name)}")
+    resolution = model.visual.input_resolution
+    graphs = {
+        "text": (_TextEncoder(model), clip.tokenize(["a photo"]), "tokens"),
+        "image": (_ImageEncoder(model), torch.zeros(1, 3, resolution, resolution), "images"),
+    }
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if intra > 0:
+        options.intra_op_num_threads = intra
+    if inter > 0:
+        options.inter_op_num_threads = inter
+    sessions = {}
+    for name, (module, example, input_name) in graphs.items():
+        path = f"{stem}-{name}.onnx"
+        if not os.path.exists(path):
+            with torch.no_grad():
+                torch.onnx.export(module.eval(), example, path + ".tmp", input_names=[input_name],
+                                  output_names=["embeddings"], opset_version=ONNX_OPSET,
+                                  dynamic_axes={input_name: {0: "batch"}, "embeddings": {0: "batch"}})
+            os.replace(path + ".tmp", path)
+            log.info("Exported %s encoder to %s", name, path)
+            _remove_stale_exports(prefix, name, path)
+        sessions[name] = (onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"]), input_name)
+
+    def runner(name):
+        session, input_name = sessions[name]
+        return lambda x: torch.from_numpy(session.run(None, {input_name: x.cpu().numpy()})[0])
+
+    return CompiledCLIP(model, runner("text"), runner("image"), "onnx")
+
+def build(model, backend, model_name, device="cpu"):
+    """Returns the encoder for backend, built from the eager reference model."""
+    if backend not in BACKENDS:
+        raise BackendError(f"Unknown inference backend '{backend}', expected one of {', '.join(BACKENDS)}")
+    if backend == "eager":
+        return model
+    if device != "cpu":
+        raise BackendError(f"The {backend} backend runs on CPU only, the model is on {device}")
+    if backend == "int8":
+        return _int8(model)
+    if backend == "torchscript":
+        return _torchscript(model, model_name)
+    return _onnx(model, model_name)
+
+def _embed(model, texts, images, device="cpu"):
+    with torch.no_grad():
+        text = model.encode_text(clip.tokenize(texts).to(device)).float()
+        image = model.encode_image(images.to(device)).float()
+    text = text / text.norm(dim=-1, keepdim=True)
+    image = image / image.norm(dim=-1, keepdim=True)
+    return text.cpu().numpy(), image.cpu().numpy()
+
+def probe_images(preprocess, paths=(), count=4, resolution=224, seed=0):
+    """Preprocessed probe images: the given files, or seeded random RGB noise."""
+    from PIL import Image
+    images = []
+    for path in list(paths)[:count]:
+        with Image.open(path) as image:
+            images.append(preprocess(image))
+    rng = np.random.default_rng(seed)
+    while len(images) < count:
+        noise = rng.integers(0, 256, size=(resolution, resolution, 3), dtype=np.uint8)
+        images.append(preprocess(Image.fromarray(noise)))
+    return torch.stack(images)
+
+def parity(reference, candidate, preprocess, texts=PROBE_TEXTS, image_paths=(), device="cpu"):
+    """
+    Cosine drift of candidate against reference on the same inputs: per
+    encoder the mean and minimum cosine similarity of paired embeddings
+    (1.0 means identical directions).
+    """
+    images = probe_images(preprocess, image_paths)
+    ref_text, ref_image = _embed(reference, texts, images, device)
+    text, image = _embed(candidate, texts, images, device)
+    text_cos = (ref_text * text).sum(axis=1)
+    image_cos = (ref_image * image).sum(axis=1)
+    return {
+        "text_mean_cosine": float(text_cos.mean()),
+        "text_min_cosine": float(text_cos.min()),
+        "image_mean_cosine": float(image_cos.mean()),
+        "image_min_cosine": float(image_cos.min()),
+        "min_cosine": float(min(text_cos.min(), image_cos.min())),
+    }
+
+def select(model, preprocess, model_name, device="cpu", backend=INFER_BACKEND, min_cosine=MIN_COSINE):
+    """
+    Builds the configured backend and checks its parity against the eager
+    model. Returns (model, info); falls back to the eager model if the
+    backend cannot be built or drifts below min_cosine.
+    """
+    info = {"backend": "eager", "requested": backend, "threads": configure_threads(), "parity": None, "error": None}
+    if backend == "eager":
+        return model, info
+    try:
+        candidate = build(model, backend, model_name, device)
+        info["parity"] = parity(model, candidate, preprocess, device=device)
+    except Exception as e:
+        info["error"] = str(e)
+        log.warning("%s backend unavailable (%s), using eager", backend, e)
+        return model, info
+    if info["parity"]["min_cosine"] < min_cosine:
+        info["error"] = f"cosine drift {info['parity']['min_cosine']:.4f} below {min_cosine}"
+        log.warning("%s backend rejected: %s, using eager", backend, info["error"])
+        return model, info
+    info["backend"] = backend
+    log.info("Using %s backend (min cosine %.4f vs eager)", backend, info["parity"]["min_cosine"])
+    return candidate, info
+
+def _latency(model, texts, images, repeats):
+    timings = {}
+    with torch.no_grad():
+        for name, run in (("text_1", lambda: model.encode_text(clip.tokenize(texts[:1]))),
+                          ("text_batch", lambda: model.encode_text(clip.tokenize(texts))),
+                          ("image_batch", lambda: model.encode_image(images))):
+            run()
+            started = time.perf_counter()
+            for _ in range(repeats):
+                run()
+            timings[f"{name}_ms"] = (time.perf_counter() - started) * 1000 / repeats
+    return timings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare CLIP inference backends against eager PyTorch.")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--images", help="folder with sample images (default: random noise)")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    from clip_model import MODEL_NAME
+    threads = configure_threads()
+    reference, preprocess = clip.load(MODEL_NAME, device="cpu")
+    reference.eval()
+    image_paths = []
+    if args.images:
+        image_paths = sorted(os.path.join(args.images, f) for f in os.listdir(args.images)
+                             if f.lower().endswith((".png", ".jpg", ".jpeg", ".webp")))
+    images = probe_images(preprocess, image_paths, count=8)
+
+    report = {"model": MODEL_NAME, "threads": threads, "backends": {}}
+    for backend in args.backends.split(","):
+        backend = backend.strip()
+        try:
+            model = build(reference, backend, MODEL_NAME)
+            entry = parity(reference, model, preprocess, image_paths=image_paths)
+            entry.update(_latency(model, PROBE_TEXTS, images, args.repeats))
+        except Exception as e:
+            entry = {"error": str(e)}
+        report["backends"][backend] = entry
+        print(f"[inference_backend.py] {backend}: {json.dumps(entry)}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
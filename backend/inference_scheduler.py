@@ -0,0 +1,137 @@
+# inference_scheduler.py
+"""
+Cross-request micro-batching for CLIP inference.
+
+Request threads submit single items and get a Future back. One dedicated
+worker thread owns the model: it takes the first queued item, keeps
+collecting until max_batch_size items are queued or max_wait_ms has passed,
+runs batch_fn once on the whole batch and resolves every Future with its row.
+A request therefore waits at most max_wait_ms plus one batch forward pass.
+If the batch fails, its items are retried one at a time, so one bad input
+fails only its own request and the others still get their rows.
+"""
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+class InferenceScheduler:
+    def __init__(self, name, batch_fn, max_batch_size=32, max_wait_ms=5.0, enabled=True):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.enabled = enabled
+        self._queue = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.split_batches = 0
+        self.total_wait = 0.0
+        self.max_observed_wait = 0.0
+        self.batch_size_histogram = {}  # power-of-two upper bound -> batch count
+
+    def submit(self, item):
+        return self.submit_many([item])[0]
+
+    def submit_many(self, items):
+        """Queues items for the next batches; returns one Future per item."""
+        futures = [Future() for _ in items]
+        if not self.enabled:
+            # With the scheduler off, run as a single batch on the calling thread
+            self._run_batch([(item, future, time.monotonic()) for item, future in zip(items, futures)])
+            return futures
+        self._ensure_worker()
+        now = time.monotonic()
+        for item, future in zip(items, futures):
+            self._queue.put((item, future, now))
+        return futures
+
+    def map(self, items):
+        """Submits items and blocks until all results are available."""
+        return [future.result() for future in self.submit_many(items)]
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "name": self.name,
+                "enabled": self.enabled,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": self.queue_depth(),
+                "batches": self.batches,
+                "items": self.items,
+                "errors": self.errors,
+                "split_batches": self.split_batches,
+                "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+                "avg_queue_wait_ms": 1000.0 * self.total_wait / self.items if self.items else 0.0,
+                "max_queue_wait_ms": 1000.0 * self.max_observed_wait,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_size_histogram.items())},
+            }
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._start_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name=f"inference-{self.name}", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        started = time.monotonic()
+        failed, split = 0, False
+        try:
+            results = self._call([item for item, _, _ in batch])
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                failed = 1
+            else:
+                # Pin the error on its own request: retry the batch item by item
+                split = True
+                for item, future, _ in batch:
+                    try:
+                        future.set_result(self._call([item])[0])
+                    except Exception as item_error:
+                        future.set_exception(item_error)
+                        failed += 1
+
+        bucket = 1
+        while bucket < len(batch):
+            bucket *= 2
+        with self._stats_lock:
+            self.batches += 1
+            self.items += len(batch)
+            self.errors += failed
+            self.split_batches += int(split)
+            self.batch_size_histogram[bucket] = self.batch_size_histogram.get(bucket, 0) + 1
+            for _, _, queued in batch:
+                wait = started - queued
+                self.total_wait += wait
+                self.max_observed_wait = max(self.max_observed_wait, wait)
+
+    def _call(self, items):
+        results = self.batch_fn(items)
+        if len(results) != len(items):
+            raise ValueError(f"{self.name} batch_fn returned {len(results)} results for {len(items)} items")
+        return results
@@ -0,0 +1,384 @@
+# ingest_queue.py
+"""
+Background ingestion of uploaded images.
+
+Uploads are saved to an incoming folder and registered as a job; the
+upload request returns right away. Worker threads encode the job's files
+in batches, move each encoded file into the image folder and commit its
+embedding to the store. Uploads that duplicate a stored image byte for
+byte are dropped and reported with the filename they duplicate; uploads
+that only look like one (embedding similarity, see dedup.py) are indexed
+and flagged with it in similarTo. Jobs with an owner go to that user's
+wardrobe partition (see partitions.py) instead of the shared store.
+Every job is persisted as a JSON file so pending work survives a crash
+and is picked up again by recover() on startup.
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import threading
+import contextlib
+
+from index_manifest import make_entry, file_hash
+from dedup import near_duplicates, NEAR_DUPLICATE_THRESHOLD, DROP_NEAR_DUPLICATES
+from partitions import partition_id
+from metrics import stage
+from log_utils import get_logger
+
+log = get_logger("ingest_queue")
+
+TERMINAL_STATES = ("done", "duplicate", "failed")
+# Finished job files are kept this long so clients can still poll their status
+JOB_RETENTION_SECONDS = 24 * 3600
+
+class QueueFullError(Exception):
+    """Raised when accepting a job would exceed the pending-file limit."""
+
+class IngestionQueue:
+    def __init__(self, store, image_folder, incoming_folder, jobs_folder, workers=1,
+                 batch_size=16, max_pending_files=1000, max_retries=3, retry_backoff=1.0, thumbnails=True,
+                 dedup=True, dedup_threshold=NEAR_DUPLICATE_THRESHOLD, drop_similar=DROP_NEAR_DUPLICATES,
+                 partitions=None, encode_images=None):
+        self.store = store
+        self.image_folder = image_folder
+        self.incoming_folder = incoming_folder
+        self.jobs_folder = jobs_folder
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.max_pending_files = max_pending_files
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.thumbnails = thumbnails
+        self.dedup = dedup
+        # None turns the embedding check off; exact copies are still skipped
+        self.dedup_threshold = dedup_threshold
+        # Near-duplicates are indexed and flagged unless drop_similar is set
+        self.drop_similar = drop_similar
+        self.partitions = partitions
+        # Defaults to the CLIP encoder, imported on first use so the queue module loads without torch
+        self.encode_images = encode_images
+        self._jobs = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending_files = 0
+        self._threads = []
+        os.makedirs(incoming_folder, exist_ok=True)
+        os.makedirs(jobs_folder, exist_ok=True)
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"ingest-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def incoming_path(self, filename):
+        return os.path.join(self.incoming_folder, filename)
+
+    def reserve(self, count):
+        """Claims room for count files, raising QueueFullError when the queue is full."""
+        with self._lock:
+            if self._pending_files + count > self.max_pending_files:
+                raise QueueFullError(f"{self._pending_files} files are already waiting to be processed")
+            self._pending_files += count
+
+    def release(self, count):
+        with self._lock:
+            self._pending_files = max(0, self._pending_files - count)
+
+    def submit(self, files, owner=None):
+        """
+        Registers a job for files already saved with incoming_path().
+        files is a list of (stored filename, original filename) pairs;
+        room must have been claimed with reserve() beforehand. With an
+        owner the files are added to that user's partition.
+        """
+        if owner is not None and self.partitions is None:
+            raise ValueError("Per-user uploads need a partition manager")
+        job = {
+            "id": uuid.uuid4().hex,
+            "owner": owner,
+            "urlPrefix": f"/data/users/{partition_id(owner)}/" if owner is not None else "/data/",
+            "state": "queued",
+            "created": time.time(),
+            "updated": time.time(),
+            "files": [
+                {"filename": filename, "original": original, "state": "queued", "attempts": 0, "error": None,
+                 "duplicateOf": None, "similarTo": None}
+                for filename, original in files
+            ],
+        }
+        with self._lock:
+            self._jobs[job["id"]] = job
+            self._save(job)
+        self._queue.put(job["id"])
+        return self.status(job["id"])
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                job = self._read(job_id)
+            if job is None:
+                return None
+            files = [dict(f, url=self._url(job, f)) for f in job["files"]]
+            counts = {}
+            for f in files:
+                counts[f["state"]] = counts.get(f["state"], 0) + 1
+            return {
+                "id": job["id"],
+                "state": job["state"],
+                "created": job["created"],
+                "updated": job["updated"],
+                "total": len(files),
+                "done": counts.get("done", 0),
+                "failed": counts.get("failed", 0),
+                "duplicates": counts.get("duplicate", 0),
+                "pending": len(files) - sum(counts.get(state, 0) for state in TERMINAL_STATES),
+                "files": files,
+            }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending_files": self._pending_files,
+                "max_pending_files": self.max_pending_files,
+                "queued_jobs": self._queue.qsize(),
+                "workers": self.workers,
+            }
+
+    def recover(self):
+        """Re-enqueues every persisted job that had not finished. Returns the number of jobs."""
+        recovered = 0
+        for name in sorted(os.listdir(self.jobs_folder)):
+            if not name.endswith(".json"):
+                continue
+            job = self._read(name[:-len(".json")])
+            if job is None:
+                continue
+            if job["state"] in TERMINAL_STATES:
+                if time.time() - job["updated"] > JOB_RETENTION_SECONDS:
+                    os.remove(self._job_file(job["id"]))
+                continue
+            pending = 0
+            with self._destination(job) as (store, image_folder):
+                for f in job["files"]:
+                    if f["state"] in TERMINAL_STATES:
+                        continue
+                    source = self.incoming_path(f["filename"])
+                    target = os.path.join(image_folder, f["filename"])
+                    if f["filename"] in store.manifest:
+                        # Committed, but crashed before moving the file or updating the job file
+                        if os.path.exists(source) and not os.path.exists(target):
+                            os.replace(source, target)
+                        f["state"] = "done"
+                    elif os.path.exists(source):
+                        f["state"] = "queued"
+                        pending += 1
+                    elif os.path.exists(target):
+                        # Moved but not committed (older versions moved first): encode again
+                        os.replace(target, source)
+                        f["state"] = "queued"
+                        pending += 1
+                    else:
+                        f.update(state="failed", error="file lost before processing")
+            with self._lock:
+                self._jobs[job["id"]] = job
+                self._pending_files += pending
+                self._finish_if_complete(job)
+                self._save(job)
+            if job["state"] not in TERMINAL_STATES:
+                self._queue.put(job["id"])
+                recovered += 1
+        if recovered:
+            log.info("Recovered %d unfinished ingestion jobs", recovered)
+        return recovered
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._process(job_id)
+            except Exception as e:
+                log.exception("Job %s crashed: %s", job_id, e)
+
+    def _process(self, job_id):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["state"] = "processing"
+            self._save(job)
+        todo = [f for f in job["files"] if f["state"] not in TERMINAL_STATES]
+        with self._destination(job) as destination:
+            for start in range(0, len(todo), self.batch_size):
+                self._process_batch(job, todo[start:start + self.batch_size], destination)
+        with self._lock:
+            self._finish_if_complete(job)
+            self._save(job)
+            # Finished jobs are read from disk, not kept in memory
+            self._jobs.pop(job_id, None)
+
+    @contextlib.contextmanager
+    def _destination(self, job):
+        """(store, image folder) the job's files go to; an owner's partition stays pinned meanwhile."""
+        if job.get("owner") is None:
+            yield self.store, self.image_folder
+            return
+        with self.partitions.pinned(job["owner"]) as partition:
+            yield partition.store, partition.folder
+
+    def _process_batch(self, job, batch, destination):
+        batch = self._skip_exact_duplicates(job, batch, destination[0])
+        while batch:
+            with self._lock:
+                for f in batch:
+                    f["state"] = "processing"
+                    f["attempts"] += 1
+                self._save(job)
+            try:
+                if self.encode_images is None:
+                    from embedding_utils import encode_images
+                    self.encode_images = encode_images
+                ok, embeddings = self.encode_images([self.incoming_path(f["filename"]) for f in batch])
+                self._commit(job, batch, ok, embeddings, *destination)
+                return
+            except Exception as e:
+                # Transient failure (e.g. during inference): set aside the files to retry
+                retry = [f for f in batch if f["attempts"] < self.max_retries]
+                with self._lock:
+                    for f in batch:
+                        f["error"] = str(e)
+                        if f["attempts"] >= self.max_retries:
+                            self._fail(f)
+                    self._save(job)
+                log.warning("Batch of job %s failed (%s); retrying %d files", job["id"], e, len(retry))
+                if retry:
+                    time.sleep(self.retry_backoff * retry[0]["attempts"])
+                batch = retry
+
+    def _skip_exact_duplicates(self, job, batch, store):
+        """Hashes the batch and drops uploads whose bytes are already stored, before encoding."""
+        if not self.dedup:
+            return batch
+        todo, seen = [], {}
+        for f in batch:
+            try:
+                f["sha256"] = file_hash(self.incoming_path(f["filename"]))
+            except OSError:
+                todo.append(f)  # encode_images reports the failure
+                continue
+            original = store.find_by_hash(f["sha256"]) or seen.get(f["sha256"])
+            if original is None:
+                seen[f["sha256"]] = f["filename"]
+                todo.append(f)
+            else:
+                with self._lock:
+                    self._mark_duplicate(f, original)
+        if len(todo) < len(batch):
+            with self._lock:
+                job["updated"] = time.time()
+                self._save(job)
+        return todo
+
+    def _commit(self, job, batch, ok, embeddings, store, image_folder):
+        rows = []
+        candidates = [f for f, encoded_ok in zip(batch, ok) if encoded_ok]
+        encoded = dict(zip((f["filename"] for f in candidates), embeddings))
+        duplicates, similar = {}, {}
+        with stage("persist", items=len(candidates)):
+            with store.lock:
+                if self.dedup:
+                    # Checked under the store lock so concurrent jobs cannot both add the same photo
+                    matches = near_duplicates(store, [encoded[f["filename"]] for f in candidates], self.dedup_threshold)
+                    for f, match in zip(candidates, matches):
+                        original = store.find_by_hash(f.get("sha256")) if f.get("sha256") else None
+                        if original is not None and original != f["filename"]:
+                            duplicates[f["filename"]] = original
+                        elif match is not None:
+                            resembled = match if isinstance(match, str) else candidates[match]["filename"]
+                            if resembled == f["filename"]:
+                                continue
+                            if self.drop_similar:
+                                duplicates[f["filename"]] = resembled
+                            else:
+                                similar[f["filename"]] = resembled
+                for f in candidates:
+                    if f["filename"] in duplicates:
+                        continue
+                    entry = make_entry(self.incoming_path(f["filename"]), sha256=f.get("sha256"))
+                    rows.append((f["filename"], encoded[f["filename"]], entry))
+                # /api/reset may already have indexed a file that reached the image folder
+                new_rows = [row for row in rows if row[0] not in store.manifest]
+                # The log record is durable before the file moves: after a crash in
+                # between, recover() sees the row and finishes the move
+                store.append_many(new_rows)
+                for filename, _, _ in rows:
+                    os.replace(self.incoming_path(filename), os.path.join(image_folder, filename))
+        with self._lock:
+            for f, encoded_ok in zip(batch, ok):
+                if f["filename"] in duplicates:
+                    self._mark_duplicate(f, duplicates[f["filename"]])
+                    continue
+                if encoded_ok:
+                    f.update(state="done", error=None, similarTo=similar.get(f["filename"]))
+                else:
+                    f["error"] = "image could not be decoded"
+                    self._fail(f)
+                    continue
+                self._pending_files = max(0, self._pending_files - 1)
+            job["updated"] = time.time()
+            self._save(job)
+        if self.thumbnails:
+            from thumbnails import generate_thumbnails
+            # The file is already searchable; gallery thumbnails follow right after
+            for filename, _, _ in rows:
+                generate_thumbnails(image_folder, filename)
+
+    def _mark_duplicate(self, f, original):
+        """Drops an upload that duplicates original. Caller holds the lock."""
+        f.update(state="duplicate", duplicateOf=original, error=None)
+        self._pending_files = max(0, self._pending_files - 1)
+        path = self.incoming_path(f["filename"])
+        if os.path.exists(path):
+            os.remove(path)
+        log.info("Upload %s duplicates %s, skipped", f["original"], original)
+
+    def _url(self, job, f):
+        prefix = job.get("urlPrefix", "/data/")
+        if f["state"] == "done":
+            return f"{prefix}{f['filename']}"
+        if f["state"] == "duplicate":
+            return f"{prefix}{f['duplicateOf']}"
+        return None
+
+    def _fail(self, f):
+        """Marks a file as permanently failed and removes its upload. Caller holds the lock."""
+        f["state"] = "failed"
+        self._pending_files = max(0, self._pending_files - 1)
+        path = self.incoming_path(f["filename"])
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _finish_if_complete(self, job):
+        if all(f["state"] in TERMINAL_STATES for f in job["files"]):
+            job["state"] = "done" if any(f["state"] in ("done", "duplicate") for f in job["files"]) else "failed"
+        job["updated"] = time.time()
+
+    def _job_file(self, job_id):
+        return os.path.join(self.jobs_folder, f"{job_id}.json")
+
+    def _save(self, job):
+        tmp_file = self._job_file(job["id"]) + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(job, f)
+        os.replace(tmp_file, self._job_file(job["id"]))
+
+    def _read(self, job_id):
+        if not job_id or not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        try:
+            with open(self._job_file(job_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
@@ -0,0 +1,137 @@
+# knn_graph.py
+"""
+Precomputed k-nearest-neighbour graph over the stored image embeddings.
+
+Row i keeps the ids and cosine scores of its k most similar images (itself
+excluded), so "more like this" for an indexed image is a row lookup instead
+of a scan. The graph follows the same build/add/save/load lifecycle as the
+vector indexes and is driven by the EmbeddingStore:
+
+  build  blocked exact all-pairs top-k, O(n^2 d); done once, then persisted
+  add    new rows get their top k, existing rows merge the new rows into
+         their lists, O(n m d) for m appended rows
+  drop   renumbers the graph when the store compacts tombstoned rows away;
+         only rows that lost a neighbour are rescored, O(r n d) for r rows
+
+Lists may point at tombstoned rows until the next compaction; callers skip
+or re-scan those (see app.similar_api).
+"""
+import os
+import numpy as np
+
+from vector_index import top_k, score_rows
+from log_utils import get_logger
+
+log = get_logger("knn_graph")
+
+KNN_FILE = "knn.npz"
+BUILD_BLOCK = 1024
+
+class KNNGraph:
+    def __init__(self, k=16):
+        self.k = k
+        self.neighbors = np.empty((0, k), dtype=np.int32)
+        self.scores = np.empty((0, k), dtype=np.float32)
+
+    @property
+    def count(self):
+        return self.neighbors.shape[0]
+
+    def build(self, embeddings):
+        n = embeddings.shape[0]
+        self.neighbors = np.full((n, self.k), -1, dtype=np.int32)
+        self.scores = np.full((n, self.k), -np.inf, dtype=np.float32)
+        if n == 0:
+            return
+        for start in range(0, n, BUILD_BLOCK):
+            block = score_rows(embeddings, np.asarray(embeddings[start:start + BUILD_BLOCK], dtype=np.float32))
+            rows = np.arange(start, start + block.shape[0])
+            block[rows - start, rows] = -np.inf  # a row is not its own neighbour
+            self._set_rows(rows, block)
+        log.info("Built %d-NN graph for %d images", self.k, n)
+
+    def add(self, embeddings, start_row):
+        """Links rows start_row.. of embeddings into the graph."""
+        if start_row != self.count:
+            self.build(embeddings)
+            return
+        n = embeddings.shape[0]
+        if n == start_row:
+            return
+        new = np.asarray(embeddings[start_row:], dtype=np.float32)
+        # (n, m): every row against the appended rows
+        cross = score_rows(embeddings, new).T
+        new_rows = np.arange(start_row, n)
+        cross[new_rows, new_rows - start_row] = -np.inf
+
+        # Existing rows: merge the appended rows into their current lists
+        old = slice(0, start_row)
+        merged_scores = np.concatenate([self.scores[old], cross[old]], axis=1)
+        merged_ids = np.concatenate([self.neighbors[old], np.broadcast_to(new_rows, (start_row, new_rows.size))], axis=1)
+        best = top_k(merged_scores, self.k)
+        self.scores = np.concatenate([np.take_along_axis(merged_scores, best, axis=1),
+                                      np.full((new_rows.size, self.k), -np.inf, dtype=np.float32)])
+        self.neighbors = np.concatenate([np.take_along_axis(merged_ids, best, axis=1).astype(np.int32),
+                                         np.full((new_rows.size, self.k), -1, dtype=np.int32)])
+        self.neighbors[~np.isfinite(self.scores)] = -1
+        # Appended rows: full top k against everything (cross.T is (m, n))
+        self._set_rows(new_rows, cross.T.copy())
+
+    def drop(self, embeddings, keep):
+        """Keeps rows keep (sorted old rows), now the rows of embeddings, and renumbers their lists."""
+        if keep.size and keep[-1] >= self.count:
+            self.build(embeddings)
+            return
+        new_ids = np.full(self.count, -1, dtype=np.int32)
+        new_ids[keep] = np.arange(keep.size, dtype=np.int32)
+        neighbors = self.neighbors[keep]
+        mapped = np.where(neighbors >= 0, new_ids[np.maximum(neighbors, 0)], -1)
+        # Rows that lost a deleted neighbour get their list recomputed
+        stale = np.flatnonzero(((neighbors >= 0) & (mapped < 0)).any(axis=1))
+        self.neighbors, self.scores = mapped.astype(np.int32), self.scores[keep]
+        if stale.size == 0:
+            return
+        self.neighbors[stale] = -1
+        self.scores[stale] = -np.inf
+        for start in range(0, stale.size, BUILD_BLOCK):
+            rows = stale[start:start + BUILD_BLOCK]
+            block = score_rows(embeddings, np.asarray(embeddings[rows], dtype=np.float32))
+            block[np.arange(rows.size), rows] = -np.inf
+            self._set_rows(rows, block)
+
+    def lookup(self, row, k):
+        """(ids, scores) of row's k nearest neighbours, best first; None if the row is not covered."""
+        if row >= self.count or k > self.k:
+            return None
+        ids, scores = self.neighbors[row, :k], self.scores[row, :k]
+        valid = ids >= 0
+        return ids[valid], scores[valid]
+
+    def save(self, index_dir):
+        tmp_path = os.path.join(index_dir, KNN_FILE) + ".tmp.npz"
+        np.savez(tmp_path, neighbors=self.neighbors, scores=self.scores)
+        os.replace(tmp_path, os.path.join(index_dir, KNN_FILE))
+
+    def load(self, index_dir, count):
+        path = os.path.join(index_dir, KNN_FILE)
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as data:
+                neighbors, scores = data["neighbors"], data["scores"]
+        except Exception as e:
+            log.warning("Error reading %s: %s", path, e)
+            return False
+        if neighbors.shape[0] != count or neighbors.shape[1] != self.k:
+            return False
+        self.neighbors, self.scores = neighbors, scores
+        return True
+
+    def _set_rows(self, rows, scores):
+        """Stores the top k of each row of scores (len(rows), n) as the lists of rows."""
+        best = top_k(scores, self.k)
+        kept = best.shape[1]
+        self.neighbors[rows, :kept] = best
+        self.scores[rows, :kept] = np.take_along_axis(scores, best, axis=1)
+        # With few images, clear the fake neighbours scored -inf
+        self.neighbors[rows] = np.where(np.isfinite(self.scores[rows]), self.neighbors[rows], -1)
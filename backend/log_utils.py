@@ -0,0 +1,39 @@
+# log_utils.py
+"""
+Leveled, sampled logging for the request path.
+
+All backend loggers live under the "codress" logger. CODRESS_LOG_LEVEL sets
+the level (INFO by default) and CODRESS_LOG_SAMPLE_RATE keeps only that
+fraction of DEBUG records, so per-request debug output can stay enabled in
+production at a fraction of its volume. With DEBUG off, log.debug() returns
+after a cached level check and never formats its arguments.
+"""
+import os
+import random
+import logging
+
+LOG_LEVEL = os.environ.get("CODRESS_LOG_LEVEL", "INFO").upper()
+DEBUG_SAMPLE_RATE = float(os.environ.get("CODRESS_LOG_SAMPLE_RATE", "1.0"))
+
+class DebugSampler(logging.Filter):
+    """Passes a random fraction of DEBUG records; INFO and above always pass."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1.0 or random.random() < self.rate
+
+_root = logging.getLogger("codress")
+if not _root.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+    _handler.addFilter(DebugSampler(DEBUG_SAMPLE_RATE))
+    _root.addHandler(_handler)
+    _root.setLevel(LOG_LEVEL)
+    _root.propagate = False
+
+def get_logger(name):
+    """Returns the logger for a backend module, e.g. get_logger("embedding_utils")."""
+    return logging.getLogger(f"codress.{name}")
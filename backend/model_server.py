@@ -0,0 +1,172 @@
+# model_server.py
+"""
+Single model/index owner for multi-process deployments.
+
+One process (CODRESS_ROLE=server) loads CLIP, owns the embedding store and
+the ingestion queue, and answers requests on a local Unix socket. WSGI
+workers (CODRESS_ROLE=worker) attach to the index files read-only, follow
+the store's shared generation counter, and send text encoding, uploads,
+deletes and re-syncs to the server with ModelClient.
+
+    python model_server.py                      # owner, no HTTP
+    CODRESS_ROLE=worker gunicorn -w 4 app:app   # read-only HTTP workers
+
+Messages are pickled over multiprocessing.connection with an HMAC authkey
+read from CODRESS_MODEL_SERVER_KEY or a 0600 key file next to the socket.
+"""
+import os
+import sys
+import secrets
+import threading
+from multiprocessing.connection import Listener, Client
+
+from ingest_queue import QueueFullError
+from log_utils import get_logger
+
+log = get_logger("model_server")
+
+# Operations that are safe to send again when the reply was lost
+IDEMPOTENT_OPS = {"encode_texts", "encode_image_bytes", "job_status", "ingest_stats", "inference_stats", "status"}
+
+class ModelServerError(Exception):
+    """Raised by ModelClient when the server is unreachable or a call fails there."""
+
+def load_authkey(socket_path, create=False):
+    """Shared secret for the socket; the owner creates the key file on first start."""
+    if os.environ.get("CODRESS_MODEL_SERVER_KEY"):
+        return os.environ["CODRESS_MODEL_SERVER_KEY"].encode("utf-8")
+    key_file = socket_path + ".key"
+    if create and not os.path.exists(key_file):
+        fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32))
+    with open(key_file, "r", encoding="utf-8") as f:
+        return f.read().strip().encode("utf-8")
+
+class ModelServer:
+    """Serves handlers[op](*args) calls, one thread per connected worker thread."""
+
+    def __init__(self, socket_path, handlers):
+        self.socket_path = socket_path
+        self.handlers = handlers
+        self._listener = None
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._listener = Listener(self.socket_path, family="AF_UNIX",
+                                  authkey=load_authkey(self.socket_path, create=True))
+        os.chmod(self.socket_path, 0o600)
+        thread = threading.Thread(target=self._accept, name="model-server", daemon=True)
+        thread.start()
+        log.info("Model server listening on %s", self.socket_path)
+        return thread
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except Exception as e:
+                # A client with the wrong authkey must not stop the server
+                log.warning("Rejected model server connection: %s", e)
+                continue
+            threading.Thread(target=self._serve, args=(conn,), name="model-server-conn", daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    op, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                handler = self.handlers.get(op)
+                try:
+                    if handler is None:
+                        raise KeyError(f"Unknown model server operation '{op}'")
+                    reply = ("ok", handler(*args))
+                except QueueFullError as e:
+                    reply = ("queue_full", str(e))
+                except Exception as e:
+                    log.exception("Model server operation %s failed", op)
+                    reply = ("error", f"{type(e).__name__}: {e}")
+                try:
+                    conn.send(reply)
+                except (EOFError, OSError):
+                    return
+
+class ModelClient:
+    """Thread-safe client; every calling thread keeps its own connection."""
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self._local = threading.local()
+
+    def call(self, op, *args):
+        for attempt in range(2):
+            conn = self._connection()
+            sent = False
+            try:
+                conn.send((op, args))
+                sent = True
+                status, result = conn.recv()
+                break
+            except (EOFError, OSError) as e:
+                self._local.conn = None
+                # The server may have restarted: reconnect once if the request never
+                # arrived or is safe to repeat; otherwise it could run twice
+                if attempt or (sent and op not in IDEMPOTENT_OPS):
+                    raise ModelServerError(f"Model server at {self.socket_path} is unavailable: {e}")
+        if status == "ok":
+            return result
+        if status == "queue_full":
+            raise QueueFullError(result)
+        raise ModelServerError(result)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            try:
+                conn = Client(self.socket_path, family="AF_UNIX", authkey=load_authkey(self.socket_path))
+            except (OSError, EOFError) as e:
+                raise ModelServerError(f"Model server at {self.socket_path} is unavailable: {e}")
+            self._local.conn = conn
+        return conn
+
+    def encode_texts(self, texts):
+        return self.call("encode_texts", list(texts))
+
+class RemoteIngestionQueue:
+    """IngestionQueue stand-in for workers: files are saved locally, the server encodes them."""
+
+    def __init__(self, client, incoming_folder):
+        self.client = client
+        self.incoming_folder = incoming_folder
+        os.makedirs(incoming_folder, exist_ok=True)
+
+    def incoming_path(self, filename):
+        return os.path.join(self.incoming_folder, filename)
+
+    def reserve(self, count):
+        self.client.call("reserve", count)
+
+    def release(self, count):
+        self.client.call("release", count)
+
+    def submit(self, files, owner=None):
+        return self.client.call("submit", files, owner)
+
+    def status(self, job_id):
+        return self.client.call("job_status", job_id)
+
+    def stats(self):
+        return self.client.call("ingest_stats")
+
+def main():
+    os.environ["CODRESS_ROLE"] = "server"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    # app loads the index on startup and, in this role, opens the socket server
+    import app
+    app.model_server_thread.join()
+
+if __name__ == "__main__":
+    main()
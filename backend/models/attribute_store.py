@@ -0,0 +1,213 @@
+# attribute_store.py
+"""
+Clothing attributes (category, color, pattern, material, style) per image.
+
+Each field is stored as one small integer code per item plus the list of
+values the codes refer to, in a single .npz file. On load every value gets
+an inverted index: a packed bitmap with one bit per item. A filter such as
+{"category": "shirt", "color": ["blue", "white"]} is an OR of bitmaps
+within a field and an AND across fields, so it costs n/8 bytes per value
+touched no matter how many items match.
+
+Items are keyed by image filename, the same id the embedding store uses,
+so matching rows can be handed to search_images and only they get scored.
+
+    python -m models.attribute_store items.jsonl --output data/index/attributes.npz
+
+where every line of items.jsonl is {"id": "<filename>", "category": ..., ...}.
+"""
+import os
+import sys
+import json
+import argparse
+import threading
+import numpy as np
+
+from log_utils import get_logger
+
+log = get_logger("attribute_store")
+
+FIELDS = ("category", "color", "pattern", "material", "style")
+MISSING = -1
+
+def normalize_value(value):
+    return str(value).strip().lower()
+
+class AttributeStore:
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.RLock()
+        self.ids = []
+        self.values = {field: [] for field in FIELDS}
+        self.codes = {field: np.empty(0, dtype=np.int16) for field in FIELDS}
+        self._rows = {}
+        self._bitmaps = {field: {} for field in FIELDS}
+        self._mtime = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def load(self):
+        """Reads the attribute file, if there is one, and builds the bitmaps."""
+        with self.lock:
+            if not self.path or not os.path.exists(self.path):
+                return self
+            try:
+                mtime = os.path.getmtime(self.path)
+                with np.load(self.path, allow_pickle=False) as data:
+                    ids = data["ids"].tolist()
+                    values = {field: data[f"{field}_values"].tolist() for field in FIELDS}
+                    codes = {field: data[f"{field}_codes"].astype(np.int16) for field in FIELDS}
+            except Exception as e:
+                log.warning("Error reading %s: %s. Keeping the previous attributes.", self.path, e)
+                return self
+            self.ids, self.values, self.codes = ids, values, codes
+            self._mtime = mtime
+            self._reindex()
+            log.info("Loaded attributes of %d items from %s", len(ids), self.path)
+            return self
+
+    def refresh(self):
+        """Reloads the file if it was rewritten since it was loaded. Cheap enough for every request."""
+        if not self.path:
+            return False
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        self.load()
+        return True
+
+    def save(self, path=None):
+        """Atomically writes the codes and vocabularies."""
+        path = path or self.path
+        with self.lock:
+            arrays = {"ids": np.array(self.ids, dtype=str)}
+            for field in FIELDS:
+                arrays[f"{field}_values"] = np.array(self.values[field], dtype=str)
+                arrays[f"{field}_codes"] = self.codes[field]
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            tmp_path = path + ".tmp.npz"
+            np.savez_compressed(tmp_path, **arrays)
+            os.replace(tmp_path, path)
+
+    def set_items(self, items):
+        """Adds or replaces items given as {"id", field: value, ...} dicts."""
+        items = list(items)
+        with self.lock:
+            new_ids = list(dict.fromkeys(str(item["id"]) for item in items if str(item["id"]) not in self._rows))
+            for item_id in new_ids:
+                self._rows[item_id] = len(self.ids)
+                self.ids.append(item_id)
+            for field in FIELDS:
+                self.codes[field] = np.concatenate([self.codes[field], np.full(len(new_ids), MISSING, dtype=np.int16)])
+            for item in items:
+                row = self._rows[str(item["id"])]
+                for field in FIELDS:
+                    value = item.get(field)
+                    self.codes[field][row] = MISSING if value in (None, "") else self._code(field, normalize_value(value))
+            self._reindex()
+
+    def get_item(self, item_id):
+        row = self._rows.get(item_id)
+        if row is None:
+            return None
+        return self._item(row)
+
+    def get_categories(self):
+        return list(self.values["category"])
+
+    def get_attributes(self):
+        return {field: list(self.values[field]) for field in FIELDS}
+
+    def match(self, filters=None):
+        """
+        Packed bitmap of the items matching filters, a {field: value or
+        [values]} dict. Raises ValueError for an unknown field.
+        """
+        with self.lock:
+            result = np.packbits(np.ones(len(self.ids), dtype=bool))
+            for field, wanted in (filters or {}).items():
+                if field not in FIELDS:
+                    raise ValueError(f"Unknown attribute '{field}', expected one of {', '.join(FIELDS)}")
+                wanted = wanted if isinstance(wanted, (list, tuple)) else [wanted]
+                either = np.zeros_like(result)
+                for value in wanted:
+                    bitmap = self._bitmaps[field].get(normalize_value(value))
+                    if bitmap is not None:
+                        either |= bitmap
+                result &= either
+            return result
+
+    def matching_ids(self, filters=None):
+        with self.lock:
+            rows = np.flatnonzero(np.unpackbits(self.match(filters), count=len(self.ids)))
+            return [self.ids[row] for row in rows.tolist()]
+
+    def matching_items(self, filters=None, limit=None, store=None):
+        """Items matching filters, in attribute order; with an embedding store only the ones stored in it."""
+        # Read the store first: hybrid search takes store.lock before this lock
+        paths = None
+        if store is not None:
+            with store.lock:
+                paths = store.live_paths()
+        with self.lock:
+            bitmap = self.match(filters)
+            if paths is not None:
+                bitmap &= self._present(paths)
+            rows = np.flatnonzero(np.unpackbits(bitmap, count=len(self.ids)))[:limit]
+            return [self._item(row) for row in rows.tolist()]
+
+    def get_matching_items(self, style, limit=None):
+        return self.matching_items({"style": style}, limit)
+
+    def embedding_rows(self, store, filters=None):
+        """Sorted rows of the embedding store whose images match filters."""
+        rows = [store.row_of(item_id) for item_id in self.matching_ids(filters)]
+        return np.array(sorted(row for row in rows if row is not None), dtype=np.int64)
+
+    def _present(self, paths):
+        """Packed bitmap of the items among paths. Caller holds the lock."""
+        present = np.zeros(len(self.ids), dtype=bool)
+        present[[row for row in map(self._rows.get, paths) if row is not None]] = True
+        return np.packbits(present)
+
+    def _item(self, row):
+        item = {"id": self.ids[row]}
+        for field in FIELDS:
+            code = int(self.codes[field][row])
+            item[field] = self.values[field][code] if code != MISSING else None
+        return item
+
+    def _code(self, field, value):
+        values = self.values[field]
+        if value in values:
+            return values.index(value)
+        values.append(value)
+        return len(values) - 1
+
+    def _reindex(self):
+        self._rows = {item_id: row for row, item_id in enumerate(self.ids)}
+        self._bitmaps = {
+            field: {value: np.packbits(self.codes[field] == code) for code, value in enumerate(self.values[field])}
+            for field in FIELDS
+        }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the attribute file from JSON lines.")
+    parser.add_argument("items", help="JSON lines file, one {\"id\": filename, field: value} object per line")
+    parser.add_argument("--output", required=True, help="attribute .npz file to create or update")
+    args = parser.parse_args(argv)
+
+    attributes = AttributeStore(args.output).load()
+    with open(args.items, "r", encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    attributes.set_items(items)
+    attributes.save()
+    print(f"[attribute_store.py] Wrote {len(attributes)} items to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
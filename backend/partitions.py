@@ -0,0 +1,239 @@
+# partitions.py
+"""
+Per-user wardrobe partitions.
+
+Every user owns a partition: a folder data/users/<id>/ holding their
+images and an index/ subfolder with their own EmbeddingStore (embedding
+segment, path list, manifest, append log). A search or listing by that
+user touches only their partition, so its cost follows the size of one
+wardrobe instead of the whole corpus. The shared store in data/index stays
+the "catalogue" partition for anonymous requests and is added to a user's
+results on request.
+
+Partitions are opened on first use and closed (their log compacted) when
+idle for longer than idle_seconds or when more than max_loaded are open,
+least recently used first. Writers (ingestion, deletes) pin the partition
+while they change it, so it is never closed and reopened under them.
+Opening and closing happen outside the manager lock but under a per-owner
+lock, held from eviction until the close (and its compaction) is done, so
+a request for the same owner waits instead of opening a second store on
+the same files.
+"""
+import os
+import time
+import hashlib
+import threading
+import contextlib
+from collections import OrderedDict
+
+from embedding_store import EmbeddingStore
+from vector_index import ExactIndex
+from catalogue import CatalogueView
+from result_cache import SearchResultCache
+from zero_shot import LabelScores
+from log_utils import get_logger
+
+log = get_logger("partitions")
+
+def partition_id(owner):
+    """Folder name of an owner's partition; hashed so usernames never reach the file system."""
+    return hashlib.sha1(owner.encode("utf-8")).hexdigest()[:20]
+
+class Partition:
+    """One store with the folder its images live in and the views served from it."""
+
+    def __init__(self, owner, folder, store, url_prefix, result_cache, catalogue=None):
+        self.owner = owner
+        self.id = os.path.basename(folder) if owner is not None else "catalogue"
+        self.folder = folder
+        self.store = store
+        self.url_prefix = url_prefix
+        self.catalogue = catalogue or CatalogueView(store, url_prefix=url_prefix)
+        self.result_cache = result_cache
+        self.last_used = time.monotonic()
+        self.pins = 0
+
+class PartitionManager:
+    def __init__(self, users_folder, model_name, dtype="float32", compact_every=256, max_loaded=64,
+                 idle_seconds=900, publish=False, read_only=False, cache_entries=128, label_set=None):
+        self.users_folder = users_folder
+        self.model_name = model_name
+        self.dtype = dtype
+        self.compact_every = compact_every
+        self.max_loaded = max(1, max_loaded)
+        self.idle_seconds = idle_seconds
+        self.publish = publish
+        self.read_only = read_only
+        self.cache_entries = cache_entries
+        # With a label set every partition keeps zero-shot label scores (see zero_shot.py)
+        self.label_set = label_set
+        self._loaded = OrderedDict()  # owner -> Partition, least recently used first
+        self._lock = threading.Lock()
+        # owner -> [Lock held while that owner's partition opens or closes, threads holding or awaiting it];
+        # an entry is dropped when its last user is done, so the dict only holds owners in flux
+        self._owner_locks = {}
+        self.loads = 0
+        self.evictions = 0
+
+    def folder(self, owner):
+        return os.path.join(self.users_folder, partition_id(owner))
+
+    def get(self, owner, pin=False):
+        """The owner's partition, loading it if needed; pin=True also pins it (see pinned)."""
+        with self._lock:
+            partition = self._loaded.get(owner)
+            if partition is not None:
+                evicted = self._use(partition, pin)
+            else:
+                owner_lock = self._owner_lock(owner)
+        if partition is None:
+            # If this user's partition is closing, wait for it instead of opening a second store on the same files
+            try:
+                with owner_lock:
+                    with self._lock:
+                        partition = self._loaded.get(owner)
+                    if partition is None:
+                        partition = self._open(owner)
+                        with self._lock:
+                            self._loaded[owner] = partition
+                            self.loads += 1
+                    with self._lock:
+                        evicted = self._use(partition, pin)
+            finally:
+                with self._lock:
+                    self._unref_owner_lock(owner)
+        for old in evicted:
+            self._close(old)
+        if self.read_only:
+            # Reload if the owning process published a new generation
+            partition.store.refresh()
+        return partition
+
+    @contextlib.contextmanager
+    def pinned(self, owner):
+        """The owner's partition, kept open until the block exits."""
+        partition = self.get(owner, pin=True)
+        try:
+            yield partition
+        finally:
+            with self._lock:
+                partition.pins -= 1
+                partition.last_used = time.monotonic()
+
+    def evict_idle(self):
+        """Closes partitions idle for longer than idle_seconds. Returns how many."""
+        with self._lock:
+            evicted = self._take_evictions(time.monotonic())
+        for partition in evicted:
+            self._close(partition)
+        return len(evicted)
+
+    def start_idle_sweeper(self):
+        """Background thread that closes idle partitions even when no request arrives."""
+        def sweep():
+            while True:
+                time.sleep(max(1, self.idle_seconds // 4))
+                self.evict_idle()
+        threading.Thread(target=sweep, name="partition-sweeper", daemon=True).start()
+        return self
+
+    def close_all(self):
+        with self._lock:
+            owners = [(owner, self._owner_lock(owner)) for owner in self._loaded]
+        for owner, owner_lock in owners:
+            try:
+                with owner_lock:
+                    with self._lock:
+                        partition = self._loaded.pop(owner, None)
+                    if partition is not None:
+                        self._close_store(partition)
+            finally:
+                with self._lock:
+                    self._unref_owner_lock(owner)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": len(self._loaded),
+                "max_loaded": self.max_loaded,
+                "idle_seconds": self.idle_seconds,
+                "images_loaded": sum(len(p.store) for p in self._loaded.values()),
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+    def _open(self, owner):
+        folder = self.folder(owner)
+        index_dir = os.path.join(folder, "index")
+        if not self.read_only:
+            os.makedirs(index_dir, exist_ok=True)
+        # Wardrobes are small: exact scan, no ANN training needed
+        store = EmbeddingStore(index_dir, self.model_name, dtype=self.dtype, compact_every=self.compact_every,
+                               vector_index=ExactIndex(), publish=self.publish, read_only=self.read_only,
+                               label_scores=LabelScores(self.label_set) if self.label_set else None)
+        if self.read_only:
+            store.refresh()
+        else:
+            store.load()
+        log.debug("Opened partition %s (%d images)", os.path.basename(folder), len(store))
+        cache = SearchResultCache(max_entries=self.cache_entries, max_bytes=self.cache_entries << 12)
+        return Partition(owner, folder, store, f"/data/users/{os.path.basename(folder)}/", cache)
+
+    def _owner_lock(self, owner):
+        """The owner's lock, counting the caller as a user until _unref_owner_lock. Caller holds the lock."""
+        entry = self._owner_locks.get(owner)
+        if entry is None:
+            entry = self._owner_locks[owner] = [threading.Lock(), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def _unref_owner_lock(self, owner):
+        """Drops the caller's use of the owner's lock, and the lock once unused. Caller holds the lock."""
+        entry = self._owner_locks[owner]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._owner_locks[owner]
+
+    def _use(self, partition, pin):
+        """Marks a loaded partition as used (and pinned) and takes evictions. Caller holds the lock."""
+        now = time.monotonic()
+        self._loaded.move_to_end(partition.owner)
+        partition.last_used = now
+        if pin:
+            partition.pins += 1
+        return self._take_evictions(now, keep=partition)
+
+    def _take_evictions(self, now, keep=None):
+        """
+        Pops idle and over-limit partitions, never a pinned one or keep, and
+        returns them with their owner lock held; _close releases it. Owners
+        whose lock is busy (opening or closing) are skipped. Caller holds the lock.
+        """
+        evicted = []
+        for owner, partition in list(self._loaded.items()):
+            if partition.pins or partition is keep:
+                continue
+            if len(self._loaded) > self.max_loaded or now - partition.last_used > self.idle_seconds:
+                if self._owner_lock(owner).acquire(blocking=False):
+                    evicted.append(self._loaded.pop(owner))
+                else:
+                    self._unref_owner_lock(owner)
+        self.evictions += len(evicted)
+        return evicted
+
+    def _close(self, partition):
+        """Closes an evicted partition, then releases its owner lock taken by _take_evictions."""
+        try:
+            self._close_store(partition)
+        finally:
+            with self._lock:
+                self._owner_locks[partition.owner][0].release()
+                self._unref_owner_lock(partition.owner)
+
+    def _close_store(self, partition):
+        try:
+            partition.store.close()
+        except Exception as e:
+            log.warning("Closing partition %s failed: %s", partition.id, e)
+        else:
+            log.debug("Closed idle partition %s", partition.id)
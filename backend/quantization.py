@@ -0,0 +1,250 @@
+# quantization.py
+"""
+Compressed embedding codes with exact re-ranking.
+
+  sq8  per-dimension scalar quantization to uint8 (4x smaller than float32)
+  pq   product quantization: the vector is split into m sub-vectors and each
+       one is replaced by the id of its nearest of 256 trained centroids
+       (m bytes per vector, e.g. 64 bytes for m=64 instead of 2048)
+
+QuantizedIndex keeps only the codes in RAM, scores every row against the
+codes, and re-ranks a shortlist of rerank_factor * k rows with the full
+precision vectors from the (memory-mapped) embedding matrix.
+"""
+import os
+import time
+import numpy as np
+
+from vector_index import ExactIndex, top_k, cluster_sums, deleted_rows
+from metrics import observe_stage
+from log_utils import get_logger
+
+log = get_logger("quantization")
+
+QUANTIZED_FILE = "quantized.npz"
+SCORE_BLOCK = 65536
+
+def _kmeans(x, k, iters, rng):
+    """Plain euclidean k-means used to train the PQ codebooks."""
+    centroids = x[rng.choice(x.shape[0], size=k, replace=False)].copy()
+    for _ in range(iters):
+        distances = (centroids ** 2).sum(axis=1)[None, :] - 2 * x @ centroids.T
+        labels = np.argmin(distances, axis=1)
+        sums, counts = cluster_sums(x, labels, k)
+        empty = counts == 0
+        sums[empty] = x[rng.choice(x.shape[0], size=int(empty.sum()))]
+        counts[empty] = 1
+        centroids = sums / counts[:, None]
+    return centroids.astype(np.float32)
+
+class ScalarQuantizer:
+    name = "sq8"
+
+    def __init__(self):
+        self.low = None
+        self.scale = None
+
+    def train(self, x, rng):
+        self.low = x.min(axis=0)
+        self.scale = np.maximum((x.max(axis=0) - self.low) / 255.0, 1e-12).astype(np.float32)
+
+    def encode(self, x):
+        return np.clip(np.rint((x - self.low) / self.scale), 0, 255).astype(np.uint8)
+
+    def scores(self, queries, codes):
+        """Approximate inner products, (len(queries), len(codes))."""
+        offset = queries @ self.low
+        scaled = queries * self.scale
+        out = np.empty((queries.shape[0], codes.shape[0]), dtype=np.float32)
+        for start in range(0, codes.shape[0], SCORE_BLOCK):
+            block = codes[start:start + SCORE_BLOCK].astype(np.float32)
+            out[:, start:start + SCORE_BLOCK] = scaled @ block.T + offset[:, None]
+        return out
+
+    def state(self):
+        return {"low": self.low, "scale": self.scale}
+
+    def load_state(self, state):
+        self.low, self.scale = state["low"], state["scale"]
+
+class ProductQuantizer:
+    name = "pq"
+
+    def __init__(self, m=64, ksub=256, train_iters=10, max_train_rows=16384):
+        self.m = m
+        self.ksub = ksub
+        self.train_iters = train_iters
+        self.max_train_rows = max_train_rows
+        self.codebooks = None  # (m, ksub, dsub)
+
+    def train(self, x, rng):
+        if x.shape[1] % self.m:
+            raise ValueError(f"Embedding dimension {x.shape[1]} is not divisible by pq m={self.m}")
+        dsub = x.shape[1] // self.m
+        if x.shape[0] > self.max_train_rows:
+            x = x[rng.choice(x.shape[0], size=self.max_train_rows, replace=False)]
+        self.codebooks = np.stack([
+            _kmeans(np.ascontiguousarray(x[:, j * dsub:(j + 1) * dsub]), self.ksub, self.train_iters, rng)
+            for j in range(self.m)
+        ])
+
+    def encode(self, x):
+        dsub = self.codebooks.shape[2]
+        codes = np.empty((x.shape[0], self.m), dtype=np.uint8)
+        for j in range(self.m):
+            sub = x[:, j * dsub:(j + 1) * dsub]
+            book = self.codebooks[j]
+            codes[:, j] = np.argmin((book ** 2).sum(axis=1)[None, :] - 2 * sub @ book.T, axis=1)
+        return codes
+
+    def scores(self, queries, codes):
+        """Asymmetric distance computation with one lookup table per query."""
+        dsub = self.codebooks.shape[2]
+        out = np.zeros((queries.shape[0], codes.shape[0]), dtype=np.float32)
+        for qi, query in enumerate(queries):
+            # (m, ksub): inner product of sub-query j with every centroid of codebook j
+            table = np.einsum("jd,jkd->jk", query.reshape(self.m, dsub), self.codebooks)
+            for j in range(self.m):
+                out[qi] += np.take(table[j], codes[:, j])
+        return out
+
+    def state(self):
+        return {"codebooks": self.codebooks}
+
+    def load_state(self, state):
+        self.codebooks = state["codebooks"]
+        self.m, self.ksub = self.codebooks.shape[0], self.codebooks.shape[1]
+
+class QuantizedIndex:
+    """
+    Vector index over compressed codes. Rows appended after build() are
+    encoded with the trained quantizer; below min_train_size rows it falls
+    back to exact search.
+    """
+
+    def __init__(self, quantizer, rerank_factor=8, min_train_size=1024, max_train_rows=50000, seed=0):
+        self.quantizer = quantizer
+        self.name = quantizer.name
+        self.rerank_factor = max(1, rerank_factor)
+        self.min_train_size = min_train_size
+        self.max_train_rows = max_train_rows
+        self.seed = seed
+        self.codes = None
+        self._exact = ExactIndex()
+
+    @property
+    def trained(self):
+        return self.codes is not None
+
+    @property
+    def memory_bytes(self):
+        if not self.trained:
+            return 0
+        return self.codes.nbytes + sum(np.asarray(v).nbytes for v in self.quantizer.state().values())
+
+    def build(self, embeddings):
+        n = embeddings.shape[0]
+        if n < self.min_train_size:
+            self.codes = None
+            return
+        rng = np.random.default_rng(self.seed)
+        sample_rows = np.sort(rng.choice(n, size=min(n, self.max_train_rows), replace=False))
+        self.quantizer.train(np.asarray(embeddings[sample_rows], dtype=np.float32), rng)
+        self.codes = self._encode(embeddings)
+        log.info("Built %s codes for %d rows (%.0f bytes/vector)", self.name, n, self.codes.nbytes / n)
+
+    def add(self, embeddings, start_row):
+        if not self.trained:
+            if embeddings.shape[0] >= self.min_train_size:
+                self.build(embeddings)
+            return
+        if start_row != self.codes.shape[0]:
+            self.build(embeddings)
+            return
+        self.codes = np.concatenate([self.codes, self._encode(embeddings[start_row:])])
+
+    def drop(self, embeddings, keep):
+        """Keeps the codes of rows keep (sorted old rows), now the rows of embeddings."""
+        if not self.trained:
+            return
+        if keep.size and keep[-1] >= self.codes.shape[0]:
+            self.build(embeddings)
+            return
+        self.codes = self.codes[keep]
+
+    def search(self, embeddings, queries, k):
+        queries = np.atleast_2d(queries).astype(np.float32, copy=False)
+        n = embeddings.shape[0]
+        codes = self.codes
+        if codes is None or n < self.min_train_size:
+            return self._exact.search(embeddings, queries, k)
+
+        coded = min(codes.shape[0], n)
+        started = time.perf_counter()
+        approx = self.quantizer.scores(queries, codes[:coded])
+        deleted = deleted_rows(embeddings)
+        if deleted is not None:
+            approx[:, deleted[deleted < coded]] = -np.inf
+        scored = time.perf_counter()
+        shortlist = top_k(approx, min(coded, k * self.rerank_factor))
+        topk_seconds = time.perf_counter() - scored
+        tail = np.arange(coded, n)
+        k = min(k, n)
+        all_scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+        all_ids = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        for qi, query in enumerate(queries):
+            # Rerank the shortlist with the full-precision vectors
+            candidates = np.sort(np.concatenate([shortlist[qi], tail]))
+            if deleted is not None:
+                candidates = candidates[~np.isin(candidates, deleted)]
+            if candidates.size == 0:
+                continue
+            scores = np.asarray(embeddings[candidates], dtype=np.float32) @ query
+            scored = time.perf_counter()
+            best = top_k(scores[None, :], k)[0]
+            topk_seconds += time.perf_counter() - scored
+            all_scores[qi, :best.size] = scores[best]
+            all_ids[qi, :best.size] = candidates[best]
+        observe_stage("similarity", time.perf_counter() - started - topk_seconds, items=queries.shape[0])
+        observe_stage("topk", topk_seconds)
+        return all_scores, all_ids
+
+    def save(self, index_dir):
+        path = os.path.join(index_dir, QUANTIZED_FILE)
+        if not self.trained:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, kind=self.name, codes=self.codes, **self.quantizer.state())
+        os.replace(tmp_path, path)
+
+    def load(self, index_dir, count):
+        path = os.path.join(index_dir, QUANTIZED_FILE)
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as data:
+                if str(data["kind"]) != self.name:
+                    return False
+                state = {key: data[key] for key in data.files if key not in ("kind", "codes")}
+                codes = data["codes"]
+        except Exception as e:
+            log.warning("Error reading %s: %s", path, e)
+            return False
+        if codes.shape[0] > count:
+            return False
+        self.quantizer.load_state(state)
+        self.codes = codes
+        return True
+
+    def _encode(self, embeddings, block=SCORE_BLOCK):
+        return np.concatenate([
+            self.quantizer.encode(np.asarray(embeddings[start:start + block], dtype=np.float32))
+            for start in range(0, embeddings.shape[0], block)
+        ]) if embeddings.shape[0] else np.empty((0,) + self._code_shape(), dtype=np.uint8)
+
+    def _code_shape(self):
+        if isinstance(self.quantizer, ProductQuantizer):
+            return (self.quantizer.m,)
+        return (self.quantizer.low.shape[0],)
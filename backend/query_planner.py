@@ -0,0 +1,82 @@
+# query_planner.py
+"""
+Compound query planning and score fusion.
+
+"white shirt and jeans" / "gömlek ve pantolon" is split into parts, every
+part is encoded in one text batch and scored with one matrix-matrix product
+(see search_images). fuse() then merges the per-part top-k lists with
+NumPy only:
+
+  max    an image's score is its best similarity over all parts
+  rrf    reciprocal-rank fusion, sum of 1 / (rrf_k + rank) over parts
+  quota  each part contributes up to its own k images, interleaved by rank
+
+Each part has its own k (candidates taken from that part) and threshold.
+"""
+import re
+import numpy as np
+
+FUSION_STRATEGIES = ("max", "rrf", "quota")
+RRF_K = 60
+COMPOUND_SPLIT = re.compile(r'\s+(?:and|ve)\s+')
+
+def split_query(text_query):
+    """Splits a compound query on 'and' / 've'; a plain query gives one part."""
+    return [part.strip() for part in COMPOUND_SPLIT.split(text_query.lower()) if part.strip()]
+
+def plan_query(text_query, k, threshold, parts=None):
+    """
+    Returns the query parts as {"query", "k", "threshold"} dicts. parts, if
+    given, is a list of {"query", optional "k", optional "threshold"} that
+    replaces the automatic split, so callers can tune each part.
+    """
+    if parts:
+        return [{
+            "query": part["query"].strip(),
+            "k": int(part["k"]) if part.get("k") is not None else k,
+            "threshold": float(part["threshold"]) if part.get("threshold") is not None else threshold,
+        } for part in parts if part["query"].strip()]
+    return [{"query": part, "k": k, "threshold": threshold} for part in split_query(text_query)]
+
+def fuse(scores, ids, ks, thresholds, strategy="max", limit=None, rrf_k=RRF_K):
+    """
+    Merges per-part results. scores and ids are the (parts, depth) output of
+    a vector index search, best first; ks and thresholds hold one value per
+    part. Returns (rows, similarities, parts, fused_scores) in result order,
+    where similarities and parts belong to the part that ranked each row best.
+    """
+    if strategy not in FUSION_STRATEGIES:
+        raise ValueError(f"Unknown fusion strategy '{strategy}', expected one of {FUSION_STRATEGIES}")
+    scores = np.asarray(scores, dtype=np.float32)
+    ids = np.asarray(ids)
+    ranks = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    parts = np.broadcast_to(np.arange(scores.shape[0])[:, None], scores.shape)
+    mask = (ranks < np.asarray(ks)[:, None]) & (scores >= np.asarray(thresholds, dtype=np.float32)[:, None]) & (ids >= 0)
+    rows, sims, parts, ranks = ids[mask], scores[mask], parts[mask], ranks[mask]
+    if rows.size == 0:
+        empty = np.empty(0)
+        return empty.astype(np.int64), empty.astype(np.float32), empty.astype(np.int64), empty.astype(np.float32)
+
+    if strategy == "max":
+        # Highest similarity first: where a row is first seen is its best part
+        order = np.lexsort((parts, -sims))
+        _, first = np.unique(rows[order], return_index=True)
+        best = order[first]
+        fused = sims[best]
+        result = best[np.argsort(-fused, kind="stable")][:limit]
+        return rows[result], sims[result], parts[result], sims[result]
+
+    if strategy == "rrf":
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        fused = np.bincount(inverse, weights=1.0 / (rrf_k + ranks + 1), minlength=unique_rows.size)
+        order = np.lexsort((-sims, ranks))
+        _, first = np.unique(rows[order], return_index=True)
+        best = order[first]
+        result = np.argsort(-fused, kind="stable")[:limit]
+        return rows[best][result], sims[best][result], parts[best][result], fused[result].astype(np.float32)
+
+    # quota: rank 0 of every part, then rank 1 of every part, ...
+    order = np.lexsort((parts, ranks))
+    _, first = np.unique(rows[order], return_index=True)
+    result = order[np.sort(first)][:limit]
+    return rows[result], sims[result], parts[result], sims[result]
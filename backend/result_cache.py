@@ -0,0 +1,108 @@
+# result_cache.py
+import json
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+
+from text_cache import normalize_query
+
+def search_key(query, style=None, k=None, threshold=None, fusion=None, limit=None, parts=None, labels=None):
+    """Cache key of a /api/search request: every option that changes its results, normalized."""
+    if parts:
+        parts = [[normalize_query(p["query"]), p.get("k"), p.get("threshold")] for p in parts]
+    if labels:
+        labels = sorted([group, sorted([wanted] if isinstance(wanted, str) else wanted)] for group, wanted in labels.items())
+    return json.dumps([normalize_query(query or ""), (style or "").strip().lower(), k, threshold,
+                       fusion or "max", limit, parts, labels or None], separators=(",", ":"))
+
+class SearchResultCache:
+    """
+    Bounded LRU cache of serialized search responses for one index
+    generation. The first lookup or insert under a newer generation drops
+    every entry, so results from before an upload, delete or re-sync are
+    never served and nothing has to be flushed by hand. Memory is bounded
+    by entry count and by the total size of the cached bodies.
+    """
+
+    def __init__(self, max_entries=2048, max_bytes=32 << 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # So ETags don't collide with responses from before a restart
+        self.instance = uuid.uuid4().hex[:8]
+        self._entries = OrderedDict()  # key -> (etag, body)
+        self._bytes = 0
+        self._generation = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def etag(self, generation, key):
+        return f"{self.instance}-{generation}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+
+    def get(self, generation, key):
+        """(etag, body) cached for key at this generation, or None."""
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, generation, key, body):
+        """Caches body and returns its (etag, body) entry."""
+        entry = (self.etag(generation, key), body)
+        if self.max_entries <= 0 or len(body) > self.max_bytes:
+            return entry
+        with self._lock:
+            self._check_generation(generation)
+            if self._generation != generation:
+                return entry  # a newer generation is already cached
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[key] = entry
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "generation": self._generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _check_generation(self, generation):
+        """Drops every entry when the index moved past the cached generation. Caller holds the lock."""
+        if self._generation is None or generation > self._generation:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._generation = generation
@@ -0,0 +1,37 @@
+# conftest.py
+"""
+Shared fixtures. The backend modules are flat, so the backend folder goes on
+sys.path; run the suite from backend/ with `python -m pytest -q`.
+"""
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def unit_rows(rng, n, dim=32):
+    """n random L2-normalized float32 rows, like CLIP embeddings."""
+    rows = rng.normal(size=(n, dim)).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+class Snapshot(np.ndarray):
+    """A plain matrix with the deleted rows a store snapshot carries."""
+
+def with_deleted(embeddings, deleted):
+    """embeddings as a search sees them with the given rows tombstoned."""
+    view = embeddings.view(Snapshot)
+    view.deleted = np.asarray(deleted, dtype=np.int64)
+    return view
+
+def exact_ids(embeddings, queries, k):
+    """Brute-force top-k row ids, best first."""
+    return np.argsort(-(queries @ embeddings.T), axis=1, kind="stable")[:, :k]
+
+def recall(found, expected):
+    """Mean fraction of the expected ids each row of found contains."""
+    return np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found.tolist(), expected.tolist())])
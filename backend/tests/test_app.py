@@ -0,0 +1,97 @@
+# test_app.py
+"""
+Route tests against app.py with the benchmarks' stub encoder. app reads its
+settings and opens its data folder at import time, so it is imported once,
+against a temporary folder, for the whole module.
+"""
+import os
+import sys
+import time
+import numpy as np
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("torch")
+pytest.importorskip("clip")
+Image = pytest.importorskip("PIL.Image")
+
+IMAGES = [f"{i:02d}.jpg" for i in range(6)]
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    from benchmarks.stub_model import install_stub_model
+
+    data_dir = tmp_path_factory.mktemp("app") / "data"
+    data_dir.mkdir()
+    rng = np.random.default_rng(0)
+    for name in IMAGES:
+        Image.fromarray(rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)).save(data_dir / name)
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("CODRESS_DATA_DIR", str(data_dir))
+        patch.setenv("CODRESS_ROLE", "standalone")
+        patch.setenv("CODRESS_MODEL_WARMUP", "0")
+        patch.setenv("CODRESS_SECRET_KEY", "test")
+        patch.setenv("CODRESS_ZERO_SHOT", "0")
+        patch.setenv("CODRESS_THUMBNAILS_AT_INGEST", "0")
+        patch.setenv("CODRESS_MAX_BATCH_QUERIES", "4")
+        # app creates ./embeddings at import
+        patch.chdir(data_dir.parent)
+        install_stub_model()
+        sys.modules.pop("app", None)
+        import app
+        deadline = time.monotonic() + 30
+        while not app.index_ready.is_set() and app.index_status["state"] != "error" and time.monotonic() < deadline:
+            time.sleep(0.01)
+    assert app.index_status["state"] == "ready", app.index_status
+    return app
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+def search(client, query, **options):
+    response = client.post("/api/search", json=dict(options, query=query))
+    assert response.status_code == 200
+    return [(r["filename"], round(r["score"], 5)) for r in response.get_json()]
+
+def test_index_is_built_from_the_data_folder(app_module, client):
+    assert sorted(app_module.store.live_paths()) == IMAGES
+    assert client.get("/healthz").get_json() == {"status": "ok"}
+    ready = client.get("/readyz")
+    assert ready.status_code == 200 and ready.get_json()["index"]["images"] == len(IMAGES)
+
+def test_batch_answers_each_query_like_a_single_search(client):
+    queries = [{"query": "black dress", "k": 3, "threshold": -1},
+               {"query": "white shirt", "style": "casual", "k": 5, "threshold": -1},
+               {"query": "red skirt", "threshold": 1.0}]
+    response = client.post("/api/search/batch", json={"queries": queries})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert [len(r) for r in results] == [3, 5, 0]
+    for query, found in zip(queries, results):
+        assert [(r["filename"], round(r["score"], 5)) for r in found] == search(client, **query)
+        assert all(r["url"] == f"/data/{r['filename']}" for r in found)
+
+@pytest.mark.parametrize("body", [{}, {"queries": []}, {"queries": "dress"}, {"queries": [{"query": " "}]},
+                                  {"queries": [{"query": "dress", "k": 0}]},
+                                  {"queries": [{"query": "dress", "threshold": "high"}]},
+                                  {"queries": [{"query": "dress"}] * 5}])
+def test_batch_rejects_bad_queries(client, body):
+    response = client.post("/api/search/batch", json=body)
+    assert response.status_code == 400 and "error" in response.get_json()
+
+def test_repeated_search_is_served_from_the_result_cache(client):
+    first = client.post("/api/search", json={"query": "black dress", "threshold": -1})
+    etag = first.headers["ETag"]
+    again = client.post("/api/search", json={"query": "  Black DRESS", "threshold": -1},
+                        headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.headers["ETag"] == etag
+
+def test_logged_in_users_search_their_own_wardrobe(client):
+    token = client.post("/api/login", json={"username": "testuser", "password": "password123"}).get_json()["user"]["token"]
+    response = client.post("/api/search", json={"query": "black dress", "threshold": -1},
+                           headers={"Authorization": f"Bearer {token}"})
+    # A new user's wardrobe is empty
+    assert response.status_code == 200 and response.get_json() == []
+    forged = client.post("/api/search", json={"query": "black dress"}, headers={"Authorization": "Bearer forged"})
+    assert forged.status_code == 401
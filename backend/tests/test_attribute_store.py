@@ -0,0 +1,68 @@
+# test_attribute_store.py
+import os
+import numpy as np
+import pytest
+
+from conftest import unit_rows
+from models.attribute_store import AttributeStore
+from embedding_store import EmbeddingStore
+
+ITEMS = [
+    {"id": "0.jpg", "category": "shirt", "color": "Blue", "style": "casual"},
+    {"id": "1.jpg", "category": "shirt", "color": "white", "style": "formal"},
+    {"id": "2.jpg", "category": "skirt", "color": "black", "style": "formal"},
+    {"id": "3.jpg", "category": "shirt", "color": "white", "style": "casual"},
+    {"id": "4.jpg", "category": "dress", "color": None, "style": "casual"},
+]
+
+@pytest.fixture
+def attributes():
+    store = AttributeStore()
+    store.set_items(ITEMS)
+    return store
+
+def test_filters_or_within_a_field_and_across_fields(attributes):
+    assert attributes.matching_ids({"category": "shirt"}) == ["0.jpg", "1.jpg", "3.jpg"]
+    assert attributes.matching_ids({"category": "shirt", "color": ["BLUE", "white "]}) == ["0.jpg", "1.jpg", "3.jpg"]
+    assert attributes.matching_ids({"category": "shirt", "style": "formal"}) == ["1.jpg"]
+    assert attributes.matching_ids({"color": "green"}) == []
+    assert attributes.matching_ids() == [item["id"] for item in ITEMS]
+    with pytest.raises(ValueError):
+        attributes.match({"size": "m"})
+
+def test_items_and_vocabularies(attributes):
+    assert attributes.get_item("4.jpg") == {"id": "4.jpg", "category": "dress", "color": None,
+                                            "pattern": None, "material": None, "style": "casual"}
+    assert attributes.get_item("missing.jpg") is None
+    assert attributes.get_categories() == ["shirt", "skirt", "dress"]
+    assert attributes.get_attributes()["color"] == ["blue", "white", "black"]
+
+def test_set_items_replaces_existing_ones(attributes):
+    attributes.set_items([{"id": "1.jpg", "category": "dress", "style": "formal"}, {"id": "5.jpg", "style": "formal"}])
+    assert len(attributes) == 6
+    assert attributes.matching_ids({"category": "dress"}) == ["1.jpg", "4.jpg"]
+    assert attributes.matching_ids({"style": "formal"}) == ["1.jpg", "2.jpg", "5.jpg"]
+
+def test_matching_items_limit_and_store_scope(attributes, tmp_path, rng):
+    assert [item["id"] for item in attributes.matching_items({"style": "casual"}, limit=2)] == ["0.jpg", "3.jpg"]
+    store = EmbeddingStore(str(tmp_path), "m").load()
+    store.append_many([(name, row, None) for name, row in zip(["3.jpg", "other.jpg", "4.jpg", "0.jpg"],
+                                                              unit_rows(rng, 4))])
+    store.remove(["0.jpg"])
+    assert [item["id"] for item in attributes.matching_items({"style": "casual"}, store=store)] == ["3.jpg", "4.jpg"]
+    assert [item["id"] for item in attributes.matching_items({"style": "casual"}, limit=1, store=store)] == ["3.jpg"]
+    assert attributes.embedding_rows(store, {"style": "casual"}).tolist() == [0, 2]
+
+def test_save_load_and_refresh(attributes, tmp_path):
+    path = str(tmp_path / "attributes.npz")
+    attributes.save(path)
+    loaded = AttributeStore(path).load()
+    assert loaded.ids == attributes.ids
+    assert loaded.matching_ids({"color": "white"}) == ["1.jpg", "3.jpg"]
+    assert not loaded.refresh()
+
+    attributes.set_items([{"id": "6.jpg", "color": "white"}])
+    attributes.save(path)
+    os.utime(path, (1, 1))
+    assert loaded.refresh() and loaded.matching_ids({"color": "white"}) == ["1.jpg", "3.jpg", "6.jpg"]
+    assert len(AttributeStore(str(tmp_path / "none.npz")).load()) == 0
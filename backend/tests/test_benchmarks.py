@@ -0,0 +1,59 @@
+# test_benchmarks.py
+import json
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("clip")
+pytest.importorskip("PIL")
+
+import clip_model
+from benchmarks import run
+from benchmarks.stub_model import StubCLIP, install_stub_model
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setattr(clip_model, "_loaded", None)
+    monkeypatch.setattr(clip_model, "_status", dict(clip_model._status))
+    return install_stub_model()
+
+def test_stub_encoder_is_deterministic():
+    tokens = torch.tensor([[49406, 320, 1125, 49407, 0, 0]])
+    images = torch.rand(2, 3, 224, 224, generator=torch.Generator().manual_seed(0))
+    first, second = StubCLIP(dim=64), StubCLIP(dim=64)
+    assert torch.equal(first.encode_text(tokens), second.encode_text(tokens))
+    assert torch.equal(first.encode_image(images), second.encode_image(images))
+    assert first.encode_text(tokens).shape == (1, 64) and first.encode_image(images).shape == (2, 64)
+    assert not torch.equal(StubCLIP(dim=64, seed=1).encode_text(tokens), first.encode_text(tokens))
+
+def test_synthetic_corpus_is_normalized(rng):
+    paths, embeddings = run.synthetic_corpus(500, 16, rng)
+    assert len(paths) == len(set(paths)) == 500 and embeddings.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), 1.0, rtol=1e-5)
+
+def test_percentiles():
+    stats = run.percentiles(list(range(1, 101)))
+    assert stats["count"] == 100 and stats["max_ms"] == 100
+    assert stats["p50_ms"] == pytest.approx(50.5) and stats["p99_ms"] == pytest.approx(99.01)
+
+def test_search_benchmark_runs_on_the_stub(stub, rng):
+    paths, embeddings = run.synthetic_corpus(300, 512, rng)
+    rows = run.bench_search(300, paths, embeddings, "exact", iterations=3, batch_size=4, warm_cache=False)
+    assert [row["benchmark"] for row in rows] == ["search.single", "search.compound", "search.batch"]
+    assert all(row["count"] == 3 and row["p50_ms"] > 0 for row in rows)
+    assert rows[2]["queries_per_second"] > 0
+
+def test_compare_flags_regressions(tmp_path, capsys):
+    baseline = tmp_path / "bench.json"
+    baseline.write_text(json.dumps({"meta": {"commit": "abc"}, "results": [
+        {"benchmark": "search.single", "n": 1000, "index": "exact", "p50_ms": 1.0},
+        {"benchmark": "index.save", "n": 1000, "index": None, "mean_ms": 10.0},
+    ]}))
+    current = [
+        {"benchmark": "search.single", "n": 1000, "index": "exact", "p50_ms": 1.5},
+        {"benchmark": "index.save", "n": 1000, "index": None, "mean_ms": 11.0},
+        {"benchmark": "index.save", "n": 5000, "index": None, "mean_ms": 99.0},
+    ]
+    assert run.compare(current, str(baseline)) == 1
+    lines = [line for line in capsys.readouterr().out.splitlines() if "->" in line]
+    assert len(lines) == 2 and lines[0].endswith("REGRESSION") and not lines[1].endswith("REGRESSION")
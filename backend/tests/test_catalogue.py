@@ -0,0 +1,71 @@
+# test_catalogue.py
+import json
+import numpy as np
+import pytest
+
+from conftest import unit_rows
+from embedding_store import EmbeddingStore
+from catalogue import CatalogueView, InvalidCursorError, encode_cursor, decode_cursor, MAX_PAGE_SIZE
+
+@pytest.fixture
+def store(tmp_path, rng):
+    store = EmbeddingStore(str(tmp_path), "m").load()
+    store.append_many([(f"{i}.jpg", row, None) for i, row in enumerate(unit_rows(rng, 10))])
+    return store
+
+def read(view, cursor=None, limit=4):
+    etag, body = view.page(cursor, limit)
+    return etag, json.loads(body)
+
+def walk(view, limit):
+    filenames, cursor = [], None
+    while True:
+        _, page = read(view, cursor, limit)
+        filenames += [image["filename"] for image in page["images"]]
+        cursor = page["nextCursor"]
+        if cursor is None:
+            return filenames
+
+def test_cursors_walk_the_store_in_row_order(store):
+    view = CatalogueView(store, url_prefix="/data/users/u/")
+    _, page = read(view)
+    assert page["total"] == 10 and page["generation"] == store.generation
+    assert page["images"][1] == {"id": 1, "filename": "1.jpg", "url": "/data/users/u/1.jpg"}
+    assert walk(view, 4) == [f"{i}.jpg" for i in range(10)]
+    assert walk(view, 10) == walk(view, 3)
+
+def test_pages_are_cached_until_the_generation_moves(store, rng):
+    view = CatalogueView(store)
+    first = view.page(None, 4)
+    assert view.page(None, 4) is first
+    store.append("10.jpg", unit_rows(rng, 1)[0])
+    etag, body = view.page(None, 4)
+    assert etag != first[0] and json.loads(body)["total"] == 11
+    # ETags differ between instances, e.g. across a restart
+    assert CatalogueView(store).page(None, 4)[0] != etag
+
+def test_cursor_resumes_after_its_file_is_deleted(store):
+    view = CatalogueView(store)
+    _, page = read(view, limit=4)
+    store.remove(["3.jpg"])
+    _, page = read(view, page["nextCursor"], limit=4)
+    assert [image["filename"] for image in page["images"]] == ["4.jpg", "5.jpg", "6.jpg", "7.jpg"]
+    assert page["total"] == 9
+
+def test_cursor_of_a_live_file_survives_earlier_deletes(store):
+    view = CatalogueView(store)
+    _, page = read(view, limit=4)
+    store.remove(["0.jpg"])
+    _, page = read(view, page["nextCursor"], limit=4)
+    assert page["images"][0]["filename"] == "4.jpg"
+
+def test_invalid_cursors_and_limits(store):
+    view = CatalogueView(store)
+    for cursor in ("not base64!", encode_cursor("a.jpg", 1)[:-2], "bnVsbA"):
+        with pytest.raises(InvalidCursorError):
+            view.page(cursor)
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(encode_cursor("a.jpg", 0).replace("MF0", "LTFd"))
+    assert decode_cursor(encode_cursor("a b.jpg", 7)) == ("a b.jpg", 7)
+    assert len(read(view, limit=0)[1]["images"]) == 1
+    assert len(read(view, limit=MAX_PAGE_SIZE * 10)[1]["images"]) == 10
@@ -0,0 +1,80 @@
+# test_clip_model.py
+import threading
+import time
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("clip")
+
+import clip_model
+
+class FakeCLIP:
+    def __init__(self):
+        self.calls = []
+
+    def eval(self):
+        return self
+
+    def encode_text(self, tokens):
+        self.calls.append(("text", tuple(tokens.shape)))
+        return torch.zeros(tokens.shape[0], 4)
+
+    def encode_image(self, images):
+        self.calls.append(("image", tuple(images.shape)))
+        return torch.zeros(images.shape[0], 4)
+
+@pytest.fixture
+def registry(monkeypatch):
+    """clip_model with fresh module state and clip.load replaced by a slow fake; yields the load calls."""
+    monkeypatch.setattr(clip_model, "_loaded", None)
+    monkeypatch.setattr(clip_model, "_warm", threading.Event())
+    monkeypatch.setattr(clip_model, "_status", dict(clip_model._status, state="not_loaded", error=None))
+    monkeypatch.setattr(clip_model.torch.cuda, "is_available", lambda: False)
+    monkeypatch.setattr(clip_model.inference_backend, "select", lambda model, *args: (model, {"backend": "eager"}))
+    loads = []
+
+    def load(name, device):
+        loads.append((name, device))
+        time.sleep(0.05)
+        return FakeCLIP(), lambda image: torch.zeros(3, 224, 224)
+    monkeypatch.setattr(clip_model.clip, "load", load)
+    return loads
+
+def test_nothing_is_loaded_until_first_use(registry):
+    assert not clip_model.is_loaded() and not clip_model.is_warm()
+    assert clip_model.model_status()["state"] == "not_loaded"
+    assert registry == []
+
+def test_concurrent_callers_share_one_load(registry):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(clip_model.load_model())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert registry == [(clip_model.MODEL_NAME, "cpu")]
+    assert len({id(result[0]) for result in results}) == 1
+    status = clip_model.model_status()
+    assert status["state"] == "loaded" and status["load_seconds"] > 0 and status["inference"] == {"backend": "eager"}
+
+def test_a_failed_load_is_reported_and_retried(registry, monkeypatch):
+    load = clip_model.clip.load
+    monkeypatch.setattr(clip_model.clip, "load", lambda name, device: (_ for _ in ()).throw(OSError("no weights")))
+    with pytest.raises(OSError):
+        clip_model.load_model()
+    assert clip_model.model_status()["state"] == "error" and clip_model.model_status()["error"] == "no weights"
+    monkeypatch.setattr(clip_model.clip, "load", load)
+    clip_model.load_model()
+    assert clip_model.model_status()["state"] == "loaded" and clip_model.model_status()["error"] is None
+
+def test_background_warm_up_runs_both_encoders(registry):
+    clip_model.start_background_warmup().join(5)
+    model = clip_model.load_model()[0]
+    assert clip_model.is_warm() and clip_model.model_status()["warm"]
+    assert [kind for kind, _ in model.calls] == ["text", "image"]
+    assert model.calls[1][1] == (1, 3, 224, 224)
+
+def test_set_model_skips_loading(registry):
+    model = FakeCLIP()
+    clip_model.set_model(model, None)
+    assert clip_model.load_model() == (model, None, "cpu") and registry == []
@@ -0,0 +1,54 @@
+# test_dedup.py
+import numpy as np
+import pytest
+
+from conftest import unit_rows
+from dedup import find_duplicate_clusters, near_duplicates, parse_threshold
+from embedding_store import EmbeddingStore
+
+def nudged(rng, row, scale=0.01):
+    """A near copy of row, still unit length."""
+    copy = row + scale * rng.normal(size=row.shape).astype(np.float32)
+    return copy / np.linalg.norm(copy)
+
+def test_clusters_are_transitive_and_ordered(rng):
+    embeddings = unit_rows(rng, 40, dim=64)
+    embeddings[10] = nudged(rng, embeddings[3])
+    embeddings[25] = nudged(rng, embeddings[10])
+    embeddings[30] = nudged(rng, embeddings[7])
+    clusters = find_duplicate_clusters(embeddings, threshold=0.97)
+    assert clusters == [[3, 10, 25], [7, 30]]
+
+@pytest.mark.parametrize("block", [1, 7, 1024])
+def test_clusters_do_not_depend_on_block_size(rng, block):
+    embeddings = unit_rows(rng, 30, dim=64)
+    embeddings[29] = nudged(rng, embeddings[0])
+    embeddings[15] = nudged(rng, embeddings[14])
+    assert find_duplicate_clusters(embeddings, threshold=0.97, block=block) == [[0, 29], [14, 15]]
+
+def test_no_clusters(rng):
+    assert find_duplicate_clusters(unit_rows(rng, 20, dim=64), threshold=0.97) == []
+    assert find_duplicate_clusters(np.empty((0, 64), dtype=np.float32)) == []
+
+def test_near_duplicates_against_store_and_batch(tmp_path, rng):
+    stored = unit_rows(rng, 10, dim=64)
+    store = EmbeddingStore(str(tmp_path), "m").load()
+    store.append_many([(f"{i}.jpg", row, None) for i, row in enumerate(stored)])
+    store.remove(["4.jpg"])
+
+    fresh = unit_rows(rng, 1, dim=64)[0]
+    batch = np.stack([nudged(rng, stored[2]), fresh, nudged(rng, fresh), nudged(rng, stored[4])])
+    with store.lock:
+        matches = near_duplicates(store, batch, 0.97)
+    # A deleted image is not a duplicate any more
+    assert matches == ["2.jpg", None, 1, None]
+    with store.lock:
+        assert near_duplicates(store, batch, None) == [None] * 4
+
+def test_parse_threshold():
+    assert parse_threshold("0.95") == 0.95
+    assert parse_threshold(" 1 ") == 1.0
+    for off in (None, "", "off", "OFF", "0", "-1"):
+        assert parse_threshold(off) is None
+    with pytest.raises(ValueError):
+        parse_threshold("high")
@@ -0,0 +1,197 @@
+# test_embedding_store.py
+import os
+import numpy as np
+import pytest
+
+from conftest import unit_rows
+from embedding_store import EmbeddingStore, EmbeddingView, ReadOnlyStoreError, LOG_FILE
+from index_store import save_index, load_index, IndexFormatError
+
+MODEL = "ViT-B/32"
+
+def open_store(index_dir, **kwargs):
+    kwargs.setdefault("compact_every", 10_000)
+    return EmbeddingStore(str(index_dir), MODEL, **kwargs).load()
+
+def add_rows(store, embeddings, first=0):
+    names = [f"{first + i}.jpg" for i in range(len(embeddings))]
+    store.append_many([(name, row, {"sha256": name}) for name, row in zip(names, embeddings)])
+    return names
+
+def test_log_replay(tmp_path, rng):
+    embeddings = unit_rows(rng, 5)
+    store = open_store(tmp_path)
+    names = add_rows(store, embeddings[:3])
+    store.append("3.jpg", embeddings[3])
+    store.append("4.jpg", embeddings[4], {"sha256": "x"})
+    assert os.path.getsize(tmp_path / LOG_FILE) > 0
+
+    reopened = open_store(tmp_path)
+    assert reopened.paths == names + ["3.jpg", "4.jpg"]
+    np.testing.assert_array_equal(np.asarray(reopened.embeddings), embeddings)
+    assert reopened.manifest["0.jpg"]["sha256"] == "0.jpg"
+    assert reopened.find_by_hash("x") == "4.jpg"
+
+def test_torn_log_record_is_dropped(tmp_path, rng):
+    embeddings = unit_rows(rng, 3)
+    store = open_store(tmp_path)
+    add_rows(store, embeddings)
+    log_file = tmp_path / LOG_FILE
+    size = os.path.getsize(log_file)
+    with open(log_file, "r+b") as f:
+        f.truncate(size - 5)
+
+    reopened = open_store(tmp_path)
+    assert reopened.paths == ["0.jpg", "1.jpg"]
+    np.testing.assert_array_equal(np.asarray(reopened.embeddings), embeddings[:2])
+    # The torn tail is cut so new records follow the last good one
+    reopened.append("9.jpg", embeddings[2])
+    assert open_store(tmp_path).paths == ["0.jpg", "1.jpg", "9.jpg"]
+
+def test_appends_go_to_the_tail_over_the_mapped_base(tmp_path, rng):
+    embeddings = unit_rows(rng, 100)
+    store = open_store(tmp_path)
+    add_rows(store, embeddings[:40])
+    store.compact()
+    assert isinstance(store.embeddings, np.memmap)
+
+    for i in range(40, 100):
+        store.append(f"{i}.jpg", embeddings[i])
+    view = store.embeddings
+    assert isinstance(view, EmbeddingView)
+    assert isinstance(view.base, np.memmap) and view.base.shape[0] == 40
+    assert [start for start, _ in view.blocks()] == [0, 40]
+    np.testing.assert_array_equal(np.asarray(view), embeddings)
+    np.testing.assert_array_equal(view[[1, 50, 99]], embeddings[[1, 50, 99]])
+    np.testing.assert_array_equal(view[38:42], embeddings[38:42])
+
+    # A snapshot taken before more appends keeps its rows
+    paths, snapshot = store.snapshot()
+    store.append("100.jpg", unit_rows(rng, 1)[0])
+    assert snapshot.shape[0] == len(paths) == 100
+    np.testing.assert_array_equal(np.asarray(snapshot), embeddings)
+
+    scores, ids = store.vector_index.search(store.embeddings, embeddings[75], 1)
+    assert ids[0, 0] == 75
+
+def test_compaction_writes_the_base_and_empties_the_log(tmp_path, rng):
+    embeddings = unit_rows(rng, 30)
+    store = open_store(tmp_path, compact_every=8)
+    add_rows(store, embeddings[:5])
+    assert os.path.getsize(tmp_path / LOG_FILE) > 0
+    # The eighth record compacts on its own
+    for i in range(5, 8):
+        store.append(f"{i}.jpg", embeddings[i])
+    assert os.path.getsize(tmp_path / LOG_FILE) == 0
+    paths, base, header = load_index(str(tmp_path), verify=True, model_name=MODEL)
+    assert paths == [f"{i}.jpg" for i in range(8)]
+    np.testing.assert_array_equal(base, embeddings[:8])
+
+    add_rows(store, embeddings[8:], first=8)
+    store.close()
+    reopened = open_store(tmp_path)
+    assert len(reopened) == 30
+    np.testing.assert_array_equal(np.asarray(reopened.embeddings), embeddings)
+
+def test_tombstones_hide_rows_until_compaction(tmp_path, rng):
+    embeddings = unit_rows(rng, 10)
+    store = open_store(tmp_path)
+    add_rows(store, embeddings)
+    assert store.remove(["3.jpg", "7.jpg", "missing.jpg"]) == 2
+    assert store.remove(["3.jpg"]) == 0
+
+    assert len(store) == 8
+    assert store.deleted.tolist() == [3, 7]
+    assert store.row_of("3.jpg") is None and store.row_of("4.jpg") == 4
+    assert "3.jpg" not in store.manifest
+    assert store.live_paths() == [f"{i}.jpg" for i in range(10) if i not in (3, 7)]
+    # Rows stay in place, searches skip them
+    assert store.embeddings.shape[0] == 10
+    _, ids = store.vector_index.search(store.embeddings, embeddings[3], 10)
+    assert 3 not in ids[0].tolist() and 7 not in ids[0].tolist()
+
+    # Delete records are replayed from the log
+    reopened = open_store(tmp_path)
+    assert reopened.deleted.tolist() == [3, 7] and len(reopened) == 8
+
+    reopened.compact()
+    assert reopened.deleted.size == 0
+    assert reopened.paths == [f"{i}.jpg" for i in range(10) if i not in (3, 7)]
+    np.testing.assert_array_equal(np.asarray(reopened.embeddings), np.delete(embeddings, [3, 7], axis=0))
+    assert reopened.row_of("4.jpg") == 3
+    assert open_store(tmp_path).paths == reopened.paths
+
+def test_deleted_name_can_be_added_again(tmp_path, rng):
+    embeddings = unit_rows(rng, 4)
+    store = open_store(tmp_path)
+    add_rows(store, embeddings[:3])
+    store.remove(["1.jpg"])
+    store.append("1.jpg", embeddings[3], {"sha256": "new"})
+    assert store.row_of("1.jpg") == 3
+    assert store.live_paths() == ["0.jpg", "2.jpg", "1.jpg"]
+    assert store.find_by_hash("new") == "1.jpg"
+
+    # Replay applies the delete before the later add of the same name
+    reopened = open_store(tmp_path)
+    assert reopened.row_of("1.jpg") == 3 and reopened.deleted.tolist() == [1]
+    reopened.compact()
+    assert reopened.paths == ["0.jpg", "2.jpg", "1.jpg"]
+    np.testing.assert_array_equal(np.asarray(reopened.embeddings), embeddings[[0, 2, 3]])
+    assert reopened.manifest["1.jpg"]["sha256"] == "new"
+
+def test_removing_every_row_and_compacting(tmp_path, rng):
+    store = open_store(tmp_path)
+    add_rows(store, unit_rows(rng, 3))
+    store.remove(["0.jpg", "1.jpg", "2.jpg"])
+    assert len(store) == 0 and store.live_paths() == []
+    store.compact()
+    assert store.paths == [] and len(open_store(tmp_path)) == 0
+
+def test_replace_swaps_the_whole_index(tmp_path, rng):
+    store = open_store(tmp_path)
+    add_rows(store, unit_rows(rng, 4))
+    store.remove(["0.jpg"])
+    fresh = unit_rows(rng, 2)
+    store.replace(["a.jpg", "b.jpg"], fresh, {"a.jpg": {"sha256": "a", "row": 0}})
+    assert store.paths == ["a.jpg", "b.jpg"] and store.deleted.size == 0
+    reopened = open_store(tmp_path)
+    np.testing.assert_array_equal(np.asarray(reopened.embeddings), fresh)
+    assert os.path.getsize(tmp_path / LOG_FILE) == 0
+
+def test_other_model_starts_empty_damaged_index_raises(tmp_path, rng):
+    save_index(str(tmp_path), ["a.jpg"], unit_rows(rng, 1), "RN50")
+    assert len(open_store(tmp_path)) == 0
+
+    save_index(str(tmp_path), ["a.jpg"], unit_rows(rng, 1), MODEL)
+    header = load_index(str(tmp_path))[2]
+    with open(tmp_path / header["matrix_file"], "ab") as f:
+        f.write(b"\0")
+    with pytest.raises(IndexFormatError):
+        open_store(tmp_path)
+
+def test_read_only_store_rejects_writes(tmp_path, rng):
+    writer = open_store(tmp_path)
+    add_rows(writer, unit_rows(rng, 2))
+    reader = open_store(tmp_path, read_only=True)
+    assert len(reader) == 2
+    with pytest.raises(ReadOnlyStoreError):
+        reader.append("x.jpg", unit_rows(rng, 1)[0])
+    with pytest.raises(ReadOnlyStoreError):
+        reader.remove(["0.jpg"])
+
+def test_reader_reloads_published_generations(tmp_path, rng):
+    embeddings = unit_rows(rng, 3)
+    writer = open_store(tmp_path, publish=True)
+    add_rows(writer, embeddings[:2])
+    reader = open_store(tmp_path, read_only=True)
+    assert reader.paths == ["0.jpg", "1.jpg"]
+    reader.refresh()
+    assert not reader.refresh()
+
+    writer.append("2.jpg", embeddings[2])
+    writer.remove(["0.jpg"])
+    assert reader.refresh()
+    assert reader.live_paths() == ["1.jpg", "2.jpg"]
+    np.testing.assert_array_equal(np.asarray(reader.embeddings), embeddings)
+    writer.compact()
+    assert reader.refresh() and reader.paths == ["1.jpg", "2.jpg"]
@@ -0,0 +1,112 @@
+# test_embedding_utils.py
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("clip")
+pytest.importorskip("PIL")
+
+import embedding_utils
+
+DIM = 4
+
+class _Visual:
+    output_dim = DIM
+
+class _Model:
+    visual = _Visual()
+
+@pytest.fixture
+def encoder_batches(monkeypatch):
+    """
+    Replaces the model with one that encodes "img<i>.jpg" as [i, 1, 0, 0];
+    files named "bad*" fail to decode. Returns the sizes of the encoded batches.
+    """
+    batches = []
+
+    def preprocess(path):
+        name = os.path.basename(path)
+        return None if name.startswith("bad") else float(name[3:-4])
+
+    def encode(values):
+        batches.append(len(values))
+        return np.array([[v, 1.0, 0.0, 0.0] for v in values], dtype=np.float32)
+
+    monkeypatch.setattr(embedding_utils, "load_model", lambda: (_Model(), None, "cpu"))
+    monkeypatch.setattr(embedding_utils, "_load_and_preprocess", preprocess)
+    monkeypatch.setattr(embedding_utils.image_scheduler, "batch_fn", encode)
+    # Run batches on the calling thread so their sizes are exactly the encoder's
+    monkeypatch.setattr(embedding_utils.image_scheduler, "enabled", False)
+    return batches
+
+def test_rows_keep_input_order_across_batches(encoder_batches):
+    files = [f"img{i}.jpg" for i in range(8)]
+    ok, embeddings = embedding_utils.encode_images(files, batch_size=3, num_workers=2)
+    assert ok.all()
+    assert embeddings.shape == (8, DIM) and embeddings.dtype == np.float32
+    assert embeddings[:, 0].tolist() == list(range(8))
+    assert encoder_batches == [3, 3, 2]
+
+def test_unreadable_images_are_masked_out(encoder_batches):
+    files = ["img0.jpg", "bad.jpg", "bad2.jpg", "bad3.jpg", "img4.jpg"]
+    ok, embeddings = embedding_utils.encode_images(files, batch_size=2, num_workers=3)
+    assert ok.tolist() == [True, False, False, False, True]
+    assert embeddings[:, 0].tolist() == [0, 4]
+    assert sum(encoder_batches) == 2
+
+def test_empty_input(encoder_batches):
+    ok, embeddings = embedding_utils.encode_images([])
+    assert ok.shape == (0,) and embeddings.shape == (0, DIM)
+    assert encoder_batches == []
+
+def test_single_image_failure_raises(encoder_batches):
+    assert embedding_utils.encode_single_image("img7.jpg")[0] == 7
+    with pytest.raises(ValueError):
+        embedding_utils.encode_single_image("bad.jpg")
+
+def test_folder_listing_keeps_encoded_filenames(encoder_batches, tmp_path):
+    for name in ("img1.jpg", "bad.png", "img3.webp", "notes.txt"):
+        (tmp_path / name).write_bytes(b"")
+    paths, embeddings = embedding_utils.generate_image_embeddings(str(tmp_path), batch_size=2)
+    assert sorted(paths) == ["img1.jpg", "img3.webp"]
+    assert len(embeddings) == 2
+
+WORDS = ["red", "dress", "white", "shoes"]
+
+@pytest.fixture
+def text_batches(monkeypatch):
+    """Encodes a text as the normalized sum of its WORDS one-hots; returns the encoded batches."""
+    batches = []
+
+    def encode(texts):
+        batches.append(list(texts))
+        rows = np.array([[float(word in text.split()) for word in WORDS] for text in texts], dtype=np.float32)
+        return rows / np.maximum(np.linalg.norm(rows, axis=1, keepdims=True), 1e-6)
+
+    monkeypatch.setattr(embedding_utils.text_scheduler, "batch_fn", encode)
+    monkeypatch.setattr(embedding_utils.text_scheduler, "enabled", False)
+    monkeypatch.setattr(embedding_utils, "text_cache", embedding_utils.TextEmbeddingCache())
+    return batches
+
+# Rows: a red dress, white shoes, a white dress, red shoes
+IMAGES = np.array([[1, 1, 0, 0], [0, 0, 1, 1], [0, 1, 1, 0], [1, 0, 0, 1]], dtype=np.float32) / np.sqrt(2)
+NAMES = ["red-dress.jpg", "white-shoes.jpg", "white-dress.jpg", "red-shoes.jpg"]
+
+def test_compound_query_encodes_its_parts_in_one_batch(text_batches):
+    results = embedding_utils.search_images("Red dress and WHITE shoes", IMAGES, NAMES, k=1)
+    assert text_batches == [["red dress", "white shoes"]]
+    assert [(r["filename"], r["query"]) for r in results] == [
+        ("red-dress.jpg", "red dress"), ("white-shoes.jpg", "white shoes")]
+    assert results[0]["score"] == pytest.approx(1.0)
+
+def test_rrf_ranks_rows_found_by_both_parts_first(text_batches):
+    results = embedding_utils.search_images("red dress and white shoes", IMAGES, NAMES,
+                                            fusion="rrf", k=4, limit=3, threshold=0.1)
+    assert len(results) == 3 and all("fusedScore" in r for r in results)
+    assert {r["filename"] for r in results[:2]} == {"white-dress.jpg", "red-shoes.jpg"}
+
+def test_rows_restrict_the_search(text_batches):
+    results = embedding_utils.search_images("red dress", IMAGES, NAMES, k=2, threshold=0.0, rows=[1, 2, 3])
+    assert [r["filename"] for r in results] == ["white-dress.jpg", "red-shoes.jpg"]
+    assert embedding_utils.search_images("red dress", IMAGES, NAMES, rows=[]) == []
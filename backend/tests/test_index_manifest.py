@@ -0,0 +1,89 @@
+# test_index_manifest.py
+import os
+import json
+import numpy as np
+import pytest
+
+from index_manifest import sync_index, load_manifest, save_manifest
+
+class FakeEncoder:
+    """Encodes a file as [first byte, 1]; files starting with b"x" fail."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, image_files):
+        self.calls.append([os.path.basename(f) for f in image_files])
+        data = [open(f, "rb").read() for f in image_files]
+        ok = np.array([not d.startswith(b"x") for d in data], dtype=bool)
+        rows = np.array([[d[0], 1.0] for d, good in zip(data, ok) if good], dtype=np.float32)
+        return ok, rows.reshape(-1, 2)
+
+@pytest.fixture
+def folder(tmp_path):
+    for name, content in (("a.jpg", b"a"), ("b.png", b"b"), ("c.webp", b"c"), ("notes.txt", b"n")):
+        (tmp_path / name).write_bytes(content)
+    return tmp_path
+
+def build(folder, encoder):
+    return sync_index(str(folder), [], None, {}, encode_images=encoder)
+
+def test_first_sync_encodes_every_image(folder):
+    encoder = FakeEncoder()
+    paths, embeddings, manifest, stats = build(folder, encoder)
+    assert paths == ["a.jpg", "b.png", "c.webp"]
+    assert embeddings[:, 0].tolist() == [ord("a"), ord("b"), ord("c")]
+    assert {name: entry["row"] for name, entry in manifest.items()} == {"a.jpg": 0, "b.png": 1, "c.webp": 2}
+    assert stats == {"reused": 0, "added": 3, "changed": 0, "removed": 0, "total": 3}
+
+def test_unchanged_folder_reuses_the_matrix(folder):
+    paths, embeddings, manifest, _ = build(folder, FakeEncoder())
+    encoder = FakeEncoder()
+    new_paths, new_embeddings, _, stats = sync_index(str(folder), paths, embeddings, manifest, encode_images=encoder)
+    assert encoder.calls == []
+    assert new_paths == paths and new_embeddings is embeddings
+    assert stats["reused"] == 3
+
+def test_only_added_and_changed_files_are_encoded(folder):
+    paths, embeddings, manifest, _ = build(folder, FakeEncoder())
+    (folder / "b.png").write_bytes(b"B2")
+    os.remove(folder / "c.webp")
+    (folder / "d.jpeg").write_bytes(b"d")
+    encoder = FakeEncoder()
+    new_paths, new_embeddings, new_manifest, stats = sync_index(
+        str(folder), paths, embeddings, manifest, encode_images=encoder)
+    assert encoder.calls == [["b.png", "d.jpeg"]]
+    assert new_paths == ["a.jpg", "b.png", "d.jpeg"]
+    assert new_embeddings[:, 0].tolist() == [ord("a"), ord("B"), ord("d")]
+    assert [new_manifest[p]["row"] for p in new_paths] == [0, 1, 2]
+    assert stats == {"reused": 1, "added": 1, "changed": 1, "removed": 1, "total": 3}
+
+def test_touched_file_with_same_content_is_not_reencoded(folder):
+    paths, embeddings, manifest, _ = build(folder, FakeEncoder())
+    stat = os.stat(folder / "a.jpg")
+    os.utime(folder / "a.jpg", (stat.st_atime, stat.st_mtime + 10))
+    encoder = FakeEncoder()
+    _, _, new_manifest, stats = sync_index(str(folder), paths, embeddings, manifest, encode_images=encoder)
+    assert encoder.calls == [] and stats["reused"] == 3
+    assert new_manifest["a.jpg"]["mtime"] == stat.st_mtime + 10
+
+def test_images_that_fail_to_encode_are_left_out(folder):
+    (folder / "bad.jpg").write_bytes(b"x")
+    paths, embeddings, manifest, stats = build(folder, FakeEncoder())
+    assert "bad.jpg" not in paths and "bad.jpg" not in manifest
+    assert embeddings.shape == (3, 2) and stats["added"] == 3
+
+def test_full_sync_reencodes_everything(folder):
+    paths, embeddings, manifest, _ = build(folder, FakeEncoder())
+    encoder = FakeEncoder()
+    sync_index(str(folder), paths, embeddings, manifest, full=True, encode_images=encoder)
+    assert encoder.calls == [["a.jpg", "b.png", "c.webp"]]
+
+def test_manifest_round_trip_and_unknown_versions(tmp_path):
+    manifest_file = str(tmp_path / "manifest.json")
+    assert load_manifest(manifest_file) == {}
+    save_manifest({"a.jpg": {"sha256": "00", "mtime": 1.0, "size": 1, "row": 0}}, manifest_file)
+    assert load_manifest(manifest_file)["a.jpg"]["row"] == 0
+    with open(manifest_file, "w") as f:
+        json.dump({"version": 99, "files": {}}, f)
+    assert load_manifest(manifest_file) == {}
@@ -0,0 +1,109 @@
+# test_index_store.py
+import os
+import json
+import numpy as np
+import pytest
+
+from conftest import unit_rows
+from index_store import (save_index, load_index, read_header, index_exists, migrate_npy, IndexFormatError,
+                         HEADER_FILE, MATRIX_FILE, PATHS_FILE)
+
+def test_round_trip(tmp_path, rng):
+    embeddings = unit_rows(rng, 50)
+    paths = [f"{i}.jpg" for i in range(50)]
+    header = save_index(str(tmp_path), paths, embeddings, "ViT-B/32")
+
+    loaded_paths, loaded, loaded_header = load_index(str(tmp_path), verify=True, model_name="ViT-B/32")
+    assert loaded_paths == paths
+    assert isinstance(loaded, np.memmap)
+    np.testing.assert_array_equal(loaded, embeddings)
+    assert loaded_header["checksum"] == header["checksum"]
+    assert (loaded_header["count"], loaded_header["dim"]) == (50, 32)
+
+def test_float16_round_trip(tmp_path, rng):
+    embeddings = unit_rows(rng, 10)
+    save_index(str(tmp_path), [f"{i}.jpg" for i in range(10)], embeddings, "m", dtype="float16")
+    _, loaded, header = load_index(str(tmp_path), mmap=False, verify=True)
+    assert header["dtype"] == "float16"
+    np.testing.assert_allclose(loaded, embeddings, atol=1e-3)
+
+def test_empty_index(tmp_path):
+    save_index(str(tmp_path), [], np.empty((0, 0), dtype=np.float32), "m")
+    paths, embeddings, header = load_index(str(tmp_path), verify=True)
+    assert paths == [] and embeddings.shape[0] == 0 and header["count"] == 0
+
+def test_save_in_chunks(tmp_path, rng, monkeypatch):
+    import index_store
+    monkeypatch.setattr(index_store, "WRITE_CHUNK_BYTES", 7 * 32 * 4)
+    embeddings = unit_rows(rng, 30)
+    save_index(str(tmp_path), [f"{i}.jpg" for i in range(30)], embeddings, "m")
+    _, loaded, _ = load_index(str(tmp_path), verify=True)
+    np.testing.assert_array_equal(loaded, embeddings)
+
+def test_new_version_replaces_old_files(tmp_path, rng):
+    first = save_index(str(tmp_path), ["a.jpg"], unit_rows(rng, 1), "m")
+    second = save_index(str(tmp_path), ["a.jpg", "b.jpg"], unit_rows(rng, 2), "m")
+    files = set(os.listdir(tmp_path))
+    assert {second["matrix_file"], second["paths_file"], HEADER_FILE} <= files
+    assert first["matrix_file"] not in files and first["paths_file"] not in files
+    assert not [name for name in files if name.endswith(".tmp")]
+
+def test_mapped_old_version_stays_readable(tmp_path, rng):
+    old = unit_rows(rng, 4)
+    save_index(str(tmp_path), [f"{i}.jpg" for i in range(4)], old, "m")
+    _, mapped, _ = load_index(str(tmp_path))
+    save_index(str(tmp_path), ["x.jpg"], unit_rows(rng, 1), "m")
+    np.testing.assert_array_equal(mapped, old)
+
+def test_rejects_mismatched_rows(tmp_path, rng):
+    with pytest.raises(IndexFormatError):
+        save_index(str(tmp_path), ["a.jpg"], unit_rows(rng, 2), "m")
+    with pytest.raises(IndexFormatError):
+        save_index(str(tmp_path), ["a\nb.jpg"], unit_rows(rng, 1), "m")
+    assert not index_exists(str(tmp_path))
+
+def test_detects_damage(tmp_path, rng):
+    header = save_index(str(tmp_path), ["a.jpg", "b.jpg"], unit_rows(rng, 2), "m")
+    matrix_file = os.path.join(tmp_path, header["matrix_file"])
+    with open(matrix_file, "r+b") as f:
+        f.write(b"\xff\xff\xff\xff")
+    with pytest.raises(IndexFormatError):
+        load_index(str(tmp_path), verify=True)
+    with open(matrix_file, "ab") as f:
+        f.write(b"\0")
+    with pytest.raises(IndexFormatError):
+        load_index(str(tmp_path))
+
+def test_rejects_other_model_and_bad_header(tmp_path, rng):
+    save_index(str(tmp_path), ["a.jpg"], unit_rows(rng, 1), "m")
+    with pytest.raises(IndexFormatError):
+        load_index(str(tmp_path), model_name="other")
+    with open(os.path.join(tmp_path, HEADER_FILE), "w", encoding="utf-8") as f:
+        json.dump({"format": "something-else"}, f)
+    with pytest.raises(IndexFormatError):
+        read_header(str(tmp_path))
+
+def test_reads_version_1_files(tmp_path, rng):
+    embeddings = unit_rows(rng, 3)
+    header = save_index(str(tmp_path), ["a.jpg", "b.jpg", "c.jpg"], embeddings, "m")
+    os.replace(os.path.join(tmp_path, header["matrix_file"]), os.path.join(tmp_path, MATRIX_FILE))
+    os.replace(os.path.join(tmp_path, header["paths_file"]), os.path.join(tmp_path, PATHS_FILE))
+    for key in ("matrix_file", "paths_file"):
+        del header[key]
+    header["version"] = 1
+    with open(os.path.join(tmp_path, HEADER_FILE), "w", encoding="utf-8") as f:
+        json.dump(header, f)
+    paths, loaded, _ = load_index(str(tmp_path), verify=True)
+    assert paths == ["a.jpg", "b.jpg", "c.jpg"]
+    np.testing.assert_array_equal(loaded, embeddings)
+
+def test_migrates_legacy_npy(tmp_path, rng):
+    embeddings = unit_rows(rng, 5)
+    npy_file = str(tmp_path / "image_embeddings.npy")
+    np.save(npy_file, {"embeddings": embeddings, "paths": [f"{i}.jpg" for i in range(5)]})
+    index_dir = str(tmp_path / "index")
+    migrate_npy(npy_file, index_dir, "m", remove_source=True)
+    paths, loaded, header = load_index(index_dir, verify=True, model_name="m")
+    assert paths == [f"{i}.jpg" for i in range(5)] and header["version"] == 2
+    np.testing.assert_array_equal(loaded, embeddings)
+    assert not os.path.exists(npy_file)
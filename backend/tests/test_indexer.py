@@ -0,0 +1,151 @@
+# test_indexer.py
+import os
+import json
+import tarfile
+import zipfile
+import numpy as np
+import pytest
+
+pytest.importorskip("werkzeug")
+
+import indexer
+from conftest import unit_rows
+
+def write_images(folder, names):
+    for name in names:
+        path = os.path.join(folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(name.encode("utf-8"))
+
+@pytest.fixture
+def catalogue(tmp_path):
+    source = tmp_path / "catalogue"
+    write_images(str(source), ["b.jpg", "a.png", "notes.txt", "spring/a.png", "spring/c.webp"])
+    return str(source)
+
+def test_plan_lists_images_in_a_stable_order_and_shards_them(tmp_path, catalogue):
+    image_folder, work_dir = tmp_path / "data", str(tmp_path / "work")
+    image_folder.mkdir()
+    plan = indexer.load_or_create_plan(catalogue, work_dir, str(image_folder), shard_size=2)
+    assert plan["kind"] == "dir"
+    assert plan["members"] == ["a.png", "b.jpg", os.path.join("spring", "a.png"), os.path.join("spring", "c.webp")]
+    assert plan["shards"] == [[0, 2], [2, 4]]
+    # The second a.png gets a hash of its member path instead of overwriting the first
+    assert plan["names"][:2] == ["a.png", "b.jpg"] and plan["names"][3] == "c.webp"
+    assert plan["names"][2].startswith("a-") and plan["names"][2].endswith(".png")
+    assert len(set(plan["names"])) == 4
+
+def test_plan_is_resumed_for_the_same_source_only(tmp_path, catalogue):
+    work_dir = str(tmp_path / "work")
+    plan = indexer.load_or_create_plan(catalogue, work_dir, str(tmp_path / "data"), shard_size=3)
+    write_images(catalogue, ["late.jpg"])
+    assert indexer.load_or_create_plan(catalogue, work_dir, str(tmp_path / "data"), shard_size=1) == plan
+    with pytest.raises(ValueError, match="holds a run"):
+        indexer.load_or_create_plan(str(tmp_path), work_dir, str(tmp_path / "data"), shard_size=3)
+
+def test_names_that_exist_in_the_image_folder_are_not_overwritten(tmp_path):
+    write_images(str(tmp_path), ["a.jpg"])
+    names = indexer.target_names(["x/a.jpg", "x/../evil name.jpg"], str(tmp_path))
+    assert names[0] != "a.jpg" and names[0].startswith("a-")
+    assert names[1] == "evil_name.jpg"
+
+def test_in_place_run_skips_the_server_folders(tmp_path):
+    image_folder = str(tmp_path / "data")
+    write_images(image_folder, ["shirt.jpg", "summer/dress.jpg", "thumbs/shirt.jpg.w128.webp", "index.build/x.png",
+                                "users/alice/coat.jpg", "incoming/upload.jpg", "work/stale.png"])
+    work_dir = os.path.join(image_folder, "work")
+    plan = indexer.load_or_create_plan(image_folder, work_dir, image_folder, shard_size=10)
+    assert plan["members"] == ["shirt.jpg", os.path.join("summer", "dress.jpg")]
+    # Top-level files keep their names, the rest are flattened next to them
+    assert plan["names"] == ["shirt.jpg", "dress.jpg"]
+    paths = indexer.materialize(indexer.shard_job(plan, 0), image_folder)
+    assert paths == [(os.path.join(image_folder, "shirt.jpg"), False), (os.path.join(image_folder, "dress.jpg"), True)]
+
+@pytest.mark.parametrize("kind", ["tar", "zip"])
+def test_archive_members_are_extracted_into_the_image_folder(tmp_path, catalogue, kind):
+    archive_path = str(tmp_path / f"catalogue.{kind}")
+    members = ["b.jpg", "notes.txt", "spring/c.webp"]
+    if kind == "tar":
+        with tarfile.open(archive_path, "w") as archive:
+            for member in members:
+                archive.add(os.path.join(catalogue, member), arcname=member)
+    else:
+        with zipfile.ZipFile(archive_path, "w") as archive:
+            for member in members:
+                archive.write(os.path.join(catalogue, member), arcname=member)
+    image_folder = str(tmp_path / "data")
+    os.makedirs(image_folder)
+    plan = indexer.load_or_create_plan(archive_path, str(tmp_path / "work"), image_folder, shard_size=10)
+    assert plan["kind"] == kind and plan["members"] == ["b.jpg", "spring/c.webp"]
+    paths = indexer.materialize(indexer.shard_job(plan, 0), image_folder)
+    assert [copied for _, copied in paths] == [True, True]
+    with open(os.path.join(image_folder, "c.webp"), "rb") as f:
+        assert f.read() == b"spring/c.webp"
+    assert not [name for name in os.listdir(image_folder) if name.endswith(".part")]
+
+def test_unknown_sources_are_rejected(tmp_path):
+    path = tmp_path / "catalogue.txt"
+    path.write_text("not an archive")
+    with pytest.raises(ValueError, match="neither a folder"):
+        indexer.source_kind(str(path))
+
+@pytest.fixture
+def checkpointed(tmp_path, rng, monkeypatch):
+    """A two-shard plan whose shards were encoded already; returns (plan, work_dir, image_folder, rows)."""
+    pytest.importorskip("torch")
+    pytest.importorskip("clip")
+    from clip_model import MODEL_NAME
+    monkeypatch.setenv("CODRESS_ZERO_SHOT", "0")
+    monkeypatch.setenv("CODRESS_KNN_GRAPH", "0")
+    image_folder, work_dir = str(tmp_path / "data"), str(tmp_path / "work")
+    names = ["a.jpg", "b.jpg", "c.jpg"]
+    write_images(image_folder, names)
+    os.makedirs(work_dir)
+    plan = {"source": image_folder, "kind": "dir", "members": names, "names": names, "shards": [[0, 2], [2, 3]]}
+    rows = unit_rows(rng, 3)
+    for shard_id, (start, stop) in enumerate(plan["shards"]):
+        np.savez(indexer.shard_file(work_dir, shard_id), names=np.array(names[start:stop], dtype=str),
+                 embeddings=rows[start:stop], sha256=np.array([f"h{i}" for i in range(start, stop)], dtype=str),
+                 model=np.array(MODEL_NAME))
+    return plan, work_dir, image_folder, rows
+
+def test_checkpointed_shards_are_not_encoded_again(checkpointed):
+    plan, work_dir, image_folder, _ = checkpointed
+    assert indexer.run_shards(plan, work_dir, image_folder) == 0
+
+def test_merge_appends_the_shards_once(tmp_path, checkpointed):
+    from embedding_store import EmbeddingStore
+    from clip_model import MODEL_NAME
+    plan, work_dir, image_folder, rows = checkpointed
+    index_dir = str(tmp_path / "index")
+    assert indexer.merge_shards(plan, work_dir, index_dir, image_folder) == 3
+    # Rerunning the merge doesn't add the same images twice
+    assert indexer.merge_shards(plan, work_dir, index_dir, image_folder) == 3
+
+    store = EmbeddingStore(index_dir, MODEL_NAME).load()
+    assert store.live_paths() == ["a.jpg", "b.jpg", "c.jpg"]
+    assert store.manifest["c.jpg"]["sha256"] == "h2"
+    np.testing.assert_allclose(np.asarray(store.snapshot()[1]), rows, atol=1e-6)
+
+def test_merge_replace_drops_the_previous_index(tmp_path, checkpointed, rng):
+    from embedding_store import EmbeddingStore
+    from clip_model import MODEL_NAME
+    plan, work_dir, image_folder, _ = checkpointed
+    index_dir = str(tmp_path / "index")
+    write_images(image_folder, ["old.jpg"])
+    store = EmbeddingStore(index_dir, MODEL_NAME).load()
+    store.append_many([("old.jpg", unit_rows(rng, 1)[0], None)])
+    store.compact()
+
+    assert indexer.merge_shards(plan, work_dir, index_dir, image_folder, mode="replace") == 3
+    store = EmbeddingStore(index_dir, MODEL_NAME).load()
+    assert store.live_paths() == ["a.jpg", "b.jpg", "c.jpg"]
+    assert "old.jpg" not in store.manifest and store.manifest["b.jpg"]["row"] == 1
+
+def test_merge_rejects_shards_of_another_model(checkpointed, tmp_path):
+    plan, work_dir, image_folder, rows = checkpointed
+    np.savez(indexer.shard_file(work_dir, 1), names=np.array(["c.jpg"]), embeddings=rows[2:],
+             sha256=np.array(["h2"]), model=np.array("RN50"))
+    with pytest.raises(ValueError, match="encoded with RN50"):
+        indexer.merge_shards(plan, work_dir, str(tmp_path / "index"), image_folder)
@@ -0,0 +1,55 @@
+# test_inference_backend.py
+import os
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("clip")
+
+import inference_backend
+from inference_backend import BackendError
+
+class Model:
+    """Stands in for the eager CLIP model; select() only passes it around."""
+
+def test_unknown_and_gpu_backends_are_rejected():
+    with pytest.raises(BackendError, match="Unknown inference backend"):
+        inference_backend.build(Model(), "tensorrt", "ViT-B/32")
+    with pytest.raises(BackendError, match="CPU only"):
+        inference_backend.build(Model(), "int8", "ViT-B/32", device="cuda")
+    model = Model()
+    assert inference_backend.build(model, "eager", "ViT-B/32", device="cuda") is model
+
+def test_select_keeps_the_eager_model_when_the_backend_fails(monkeypatch):
+    model = Model()
+    chosen, info = inference_backend.select(model, None, "ViT-B/32", backend="tensorrt")
+    assert chosen is model
+    assert info["backend"] == "eager" and info["requested"] == "tensorrt" and "Unknown" in info["error"]
+
+@pytest.mark.parametrize("min_cosine, expected", [(0.99, "eager"), (0.95, "int8")])
+def test_select_checks_the_cosine_drift(monkeypatch, min_cosine, expected):
+    model, candidate = Model(), Model()
+    monkeypatch.setattr(inference_backend, "build", lambda *args: candidate)
+    monkeypatch.setattr(inference_backend, "parity", lambda *args, **kwargs: {"min_cosine": 0.97})
+    chosen, info = inference_backend.select(model, None, "ViT-B/32", backend="int8", min_cosine=min_cosine)
+    assert info["backend"] == expected and info["parity"] == {"min_cosine": 0.97}
+    assert chosen is (candidate if expected == "int8" else model)
+    assert (info["error"] is None) == (expected == "int8")
+
+def test_onnx_signature_follows_the_export_settings(monkeypatch):
+    signature = inference_backend._onnx_signature("ViT-B/32")
+    assert signature == inference_backend._onnx_signature("ViT-B/32") and len(signature) == 12
+    assert inference_backend._onnx_signature("RN50") != signature
+    monkeypatch.setattr(inference_backend, "ONNX_OPSET", inference_backend.ONNX_OPSET + 1)
+    assert inference_backend._onnx_signature("ViT-B/32") != signature
+    monkeypatch.undo()
+    monkeypatch.setattr(inference_backend.torch, "__version__", "0.0.1")
+    assert inference_backend._onnx_signature("ViT-B/32") != signature
+
+def test_only_stale_exports_of_the_same_encoder_are_removed(tmp_path, monkeypatch):
+    monkeypatch.setattr(inference_backend, "ONNX_DIR", str(tmp_path))
+    names = ["ViT-B-32-aaa-text.onnx", "ViT-B-32-bbb-text.onnx", "ViT-B-32-aaa-image.onnx",
+             "ViT-B-32-bbb-image.onnx", "RN50-aaa-text.onnx"]
+    for name in names:
+        (tmp_path / name).write_bytes(b"onnx")
+    inference_backend._remove_stale_exports("ViT-B-32", "text", str(tmp_path / "ViT-B-32-bbb-text.onnx"))
+    assert sorted(os.listdir(tmp_path)) == sorted(names[1:])
@@ -0,0 +1,76 @@
+# test_inference_scheduler.py
+import threading
+import pytest
+
+from inference_scheduler import InferenceScheduler
+
+class Recorder:
+    """batch_fn doubling its items; fails on any item in `bad` and records every batch."""
+
+    def __init__(self, bad=()):
+        self.bad = set(bad)
+        self.batches = []
+
+    def __call__(self, items):
+        self.batches.append(list(items))
+        if self.bad & set(items):
+            raise ValueError(f"bad items in {items}")
+        return [item * 2 for item in items]
+
+def test_queued_items_are_batched_up_to_the_limit():
+    recorder = Recorder()
+    scheduler = InferenceScheduler("test", recorder, max_batch_size=8, max_wait_ms=200)
+    futures = scheduler.submit_many(list(range(11)))
+    assert [future.result(5) for future in futures] == [2 * i for i in range(11)]
+    assert [len(batch) for batch in recorder.batches] == [8, 3]
+    stats = scheduler.stats()
+    assert (stats["batches"], stats["items"], stats["errors"]) == (2, 11, 0)
+    assert stats["batch_size_histogram"] == {"4": 1, "8": 1}
+
+def test_concurrent_requests_share_a_batch():
+    recorder = Recorder()
+    scheduler = InferenceScheduler("test", recorder, max_batch_size=64, max_wait_ms=200)
+    start = threading.Barrier(6)
+    results = {}
+
+    def request(i):
+        start.wait()
+        results[i] = scheduler.submit(i).result(5)
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {i: 2 * i for i in range(6)}
+    assert len(recorder.batches) < 6
+
+def test_failing_batch_is_split_per_item():
+    recorder = Recorder(bad={3})
+    scheduler = InferenceScheduler("test", recorder, enabled=False)
+    futures = scheduler.submit_many([1, 2, 3, 4])
+    assert [futures[i].result() for i in (0, 1, 3)] == [2, 4, 8]
+    with pytest.raises(ValueError):
+        futures[2].result()
+    assert recorder.batches == [[1, 2, 3, 4], [1], [2], [3], [4]]
+    stats = scheduler.stats()
+    assert (stats["split_batches"], stats["errors"]) == (1, 1)
+
+def test_wrong_result_count_fails_the_items():
+    scheduler = InferenceScheduler("test", lambda items: [0], enabled=False)
+    futures = scheduler.submit_many([1, 2])
+    assert futures[0].result() == 0 and futures[1].result() == 0
+    with pytest.raises(ValueError):
+        InferenceScheduler("test", lambda items: [], enabled=False).submit(1).result()
+
+def test_disabled_scheduler_runs_on_the_calling_thread():
+    threads = []
+
+    def batch_fn(items):
+        threads.append(threading.current_thread())
+        return items
+
+    scheduler = InferenceScheduler("test", batch_fn, enabled=False)
+    assert scheduler.map([1, 2, 3]) == [1, 2, 3]
+    assert threads == [threading.current_thread()]
+    assert scheduler._worker is None
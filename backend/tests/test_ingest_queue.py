@@ -0,0 +1,197 @@
+# test_ingest_queue.py
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import pytest
+
+from embedding_store import EmbeddingStore
+from ingest_queue import IngestionQueue, QueueFullError, TERMINAL_STATES
+
+DIM = 16
+
+class FakeEncoder:
+    """
+    Encodes a file as a unit vector seeded by its bytes; files starting with
+    b"x" don't decode, and trailing b"'" bytes (a re-encoded copy) are ignored.
+    """
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self, image_files):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("inference failed")
+        data = [open(path, "rb").read() for path in image_files]
+        ok = np.array([not d.startswith(b"x") for d in data], dtype=bool)
+        rows = [embed(d.rstrip(b"'")) for d, good in zip(data, ok) if good]
+        return ok, np.array(rows, dtype=np.float32).reshape(-1, DIM)
+
+def embed(content):
+    seed = int.from_bytes(hashlib.sha256(content).digest()[:8], "little")
+    row = np.random.default_rng(seed).normal(size=DIM).astype(np.float32)
+    return row / np.linalg.norm(row)
+
+@pytest.fixture
+def folders(tmp_path):
+    paths = {name: str(tmp_path / name) for name in ("images", "incoming", "jobs", "index")}
+    os.makedirs(paths["images"])
+    return paths
+
+def make_queue(folders, encoder=None, **kwargs):
+    store = EmbeddingStore(folders["index"], "m").load()
+    kwargs.setdefault("thumbnails", False)
+    kwargs.setdefault("retry_backoff", 0)
+    return IngestionQueue(store, folders["images"], folders["incoming"], folders["jobs"],
+                          encode_images=encoder or FakeEncoder(), **kwargs)
+
+def upload(queue, files):
+    """Saves {filename: bytes} to the incoming folder and submits them as one job."""
+    queue.reserve(len(files))
+    for filename, content in files.items():
+        with open(queue.incoming_path(filename), "wb") as f:
+            f.write(content)
+    return queue.submit([(filename, f"original-{filename}") for filename in files])["id"]
+
+def wait_for(queue, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = queue.status(job_id)
+        if status["state"] in TERMINAL_STATES:
+            return status
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish: {queue.status(job_id)}")
+
+def test_uploads_are_committed_then_moved(folders):
+    queue = make_queue(folders).start()
+    job_id = upload(queue, {"a.jpg": b"a", "b.jpg": b"b"})
+    status = wait_for(queue, job_id)
+    assert (status["state"], status["done"], status["pending"]) == ("done", 2, 0)
+    assert [f["url"] for f in status["files"]] == ["/data/a.jpg", "/data/b.jpg"]
+    assert sorted(os.listdir(folders["images"])) == ["a.jpg", "b.jpg"]
+    assert os.listdir(folders["incoming"]) == []
+    assert queue.store.live_paths() == ["a.jpg", "b.jpg"]
+    np.testing.assert_allclose(queue.store.embeddings[queue.store.row_of("b.jpg")], embed(b"b"))
+    assert queue.stats()["pending_files"] == 0
+
+def test_undecodable_upload_fails_alone(folders):
+    queue = make_queue(folders).start()
+    status = wait_for(queue, upload(queue, {"a.jpg": b"a", "bad.jpg": b"x"}))
+    assert [f["state"] for f in status["files"]] == ["done", "failed"]
+    assert status["files"][1]["error"] == "image could not be decoded"
+    assert not os.path.exists(queue.incoming_path("bad.jpg"))
+
+def test_transient_failures_are_retried(folders):
+    encoder = FakeEncoder(failures=1)
+    queue = make_queue(folders, encoder, max_retries=3).start()
+    status = wait_for(queue, upload(queue, {"a.jpg": b"a"}))
+    assert status["state"] == "done" and status["files"][0]["attempts"] == 2 and encoder.calls == 2
+
+def test_files_fail_after_max_retries(folders):
+    queue = make_queue(folders, FakeEncoder(failures=10), max_retries=2).start()
+    status = wait_for(queue, upload(queue, {"a.jpg": b"a"}))
+    assert status["state"] == "failed"
+    assert status["files"][0]["error"] == "inference failed"
+    assert len(queue.store) == 0 and queue.stats()["pending_files"] == 0
+
+def test_queue_limit(folders):
+    queue = make_queue(folders, max_pending_files=2)
+    queue.reserve(2)
+    with pytest.raises(QueueFullError):
+        queue.reserve(1)
+    queue.release(1)
+    queue.reserve(1)
+
+def test_recover_finishes_a_commit_that_crashed_before_the_move(folders):
+    queue = make_queue(folders)
+    job_id = upload(queue, {"a.jpg": b"a", "b.jpg": b"b"})
+    # Crash right after the log record of a.jpg became durable: the file is still incoming
+    queue.store.append("a.jpg", embed(b"a"), {"sha256": "a"})
+    queue.store.close()
+
+    restarted = make_queue(folders)
+    assert restarted.recover() == 1
+    assert os.path.exists(os.path.join(folders["images"], "a.jpg"))
+    assert [f["state"] for f in restarted.status(job_id)["files"]] == ["done", "queued"]
+    restarted.start()
+    status = wait_for(restarted, job_id)
+    assert status["done"] == 2
+    assert restarted.store.live_paths() == ["a.jpg", "b.jpg"]
+
+def test_recover_reencodes_files_moved_before_their_commit(folders):
+    queue = make_queue(folders)
+    job_id = upload(queue, {"a.jpg": b"a"})
+    os.replace(queue.incoming_path("a.jpg"), os.path.join(folders["images"], "a.jpg"))
+
+    restarted = make_queue(folders)
+    assert restarted.recover() == 1
+    assert os.path.exists(restarted.incoming_path("a.jpg"))
+    status = wait_for(restarted.start(), job_id)
+    assert status["done"] == 1 and restarted.store.row_of("a.jpg") == 0
+
+def test_recover_fails_lost_files_and_drops_expired_jobs(folders, monkeypatch):
+    queue = make_queue(folders)
+    job_id = upload(queue, {"a.jpg": b"a"})
+    os.remove(queue.incoming_path("a.jpg"))
+
+    restarted = make_queue(folders)
+    assert restarted.recover() == 0
+    status = restarted.status(job_id)
+    assert status["state"] == "failed" and status["files"][0]["error"] == "file lost before processing"
+
+    import ingest_queue
+    monkeypatch.setattr(ingest_queue, "JOB_RETENTION_SECONDS", -1)
+    make_queue(folders).recover()
+    assert make_queue(folders).status(job_id) is None
+
+def test_job_status_is_read_from_disk(folders):
+    queue = make_queue(folders).start()
+    job_id = wait_for(queue, upload(queue, {"a.jpg": b"a"}))["id"]
+    with open(os.path.join(folders["jobs"], f"{job_id}.json"), encoding="utf-8") as f:
+        assert json.load(f)["state"] == "done"
+    assert make_queue(folders).status(job_id)["done"] == 1
+    assert queue.status("not-a-job") is None and queue.status("../x") is None
+
+def test_exact_copies_are_skipped_before_encoding(folders):
+    encoder = FakeEncoder()
+    queue = make_queue(folders, encoder).start()
+    wait_for(queue, upload(queue, {"a.jpg": b"a"}))
+    status = wait_for(queue, upload(queue, {"copy.jpg": b"a", "b.jpg": b"b", "b2.jpg": b"b"}))
+    assert [f["state"] for f in status["files"]] == ["duplicate", "done", "duplicate"]
+    assert [f["duplicateOf"] for f in status["files"]] == ["a.jpg", None, "b.jpg"]
+    assert status["files"][0]["url"] == "/data/a.jpg" and status["duplicates"] == 2
+    assert encoder.calls == 2 and queue.store.live_paths() == ["a.jpg", "b.jpg"]
+    assert os.listdir(folders["incoming"]) == []
+
+def test_near_duplicates_are_indexed_and_flagged(folders):
+    queue = make_queue(folders).start()
+    wait_for(queue, upload(queue, {"a.jpg": b"a"}))
+    status = wait_for(queue, upload(queue, {"a-resized.jpg": b"a'", "b.jpg": b"b", "b-resized.jpg": b"b''"}))
+    assert [f["state"] for f in status["files"]] == ["done"] * 3
+    assert [f["similarTo"] for f in status["files"]] == ["a.jpg", None, "b.jpg"]
+    assert queue.store.live_paths() == ["a.jpg", "a-resized.jpg", "b.jpg", "b-resized.jpg"]
+
+def test_near_duplicates_are_dropped_on_request(folders):
+    queue = make_queue(folders, drop_similar=True).start()
+    wait_for(queue, upload(queue, {"a.jpg": b"a"}))
+    status = wait_for(queue, upload(queue, {"a-resized.jpg": b"a'"}))
+    assert status["files"][0]["state"] == "duplicate" and status["files"][0]["duplicateOf"] == "a.jpg"
+    assert queue.store.live_paths() == ["a.jpg"]
+
+def test_similarity_check_can_be_turned_off(folders):
+    queue = make_queue(folders, dedup_threshold=None).start()
+    wait_for(queue, upload(queue, {"a.jpg": b"a"}))
+    status = wait_for(queue, upload(queue, {"a-resized.jpg": b"a'", "copy.jpg": b"a"}))
+    assert [f["state"] for f in status["files"]] == ["done", "duplicate"]
+    assert status["files"][0]["similarTo"] is None
+
+def test_dedup_can_be_turned_off(folders):
+    queue = make_queue(folders, dedup=False).start()
+    wait_for(queue, upload(queue, {"a.jpg": b"a"}))
+    status = wait_for(queue, upload(queue, {"copy.jpg": b"a"}))
+    assert status["files"][0]["state"] == "done"
+    assert queue.store.live_paths() == ["a.jpg", "copy.jpg"]
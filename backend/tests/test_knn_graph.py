@@ -0,0 +1,88 @@
+# test_knn_graph.py
+import numpy as np
+import pytest
+
+from conftest import unit_rows
+from knn_graph import KNNGraph
+from embedding_store import EmbeddingStore
+
+def brute_force(embeddings, k):
+    scores = embeddings @ embeddings.T
+    np.fill_diagonal(scores, -np.inf)
+    return np.argsort(-scores, axis=1, kind="stable")[:, :k]
+
+def test_build_matches_brute_force(rng, monkeypatch):
+    import knn_graph
+    monkeypatch.setattr(knn_graph, "BUILD_BLOCK", 16)
+    embeddings = unit_rows(rng, 100)
+    graph = KNNGraph(5)
+    graph.build(embeddings)
+    np.testing.assert_array_equal(graph.neighbors, brute_force(embeddings, 5))
+    assert np.all(np.diff(graph.scores, axis=1) <= 0)
+    np.testing.assert_allclose(graph.scores[7, 0], embeddings[7] @ embeddings[graph.neighbors[7, 0]], rtol=1e-5)
+
+def test_appends_merge_into_existing_lists(rng):
+    embeddings = unit_rows(rng, 120)
+    graph = KNNGraph(6)
+    graph.build(embeddings[:50])
+    graph.add(embeddings[:90], 50)
+    graph.add(embeddings, 90)
+    np.testing.assert_array_equal(graph.neighbors, brute_force(embeddings, 6))
+
+def test_drop_renumbers_and_rescores_rows_that_lost_a_neighbour(rng):
+    embeddings = unit_rows(rng, 80)
+    graph = KNNGraph(4)
+    graph.build(embeddings)
+    keep = np.setdiff1d(np.arange(80), [0, 13, 14, 60])
+    graph.drop(embeddings[keep], keep)
+    np.testing.assert_array_equal(graph.neighbors, brute_force(embeddings[keep], 4))
+
+def test_few_images_leave_empty_slots(rng):
+    graph = KNNGraph(4)
+    graph.build(unit_rows(rng, 3))
+    ids, scores = graph.lookup(0, 4)
+    assert sorted(ids.tolist()) == [1, 2] and scores.shape == (2,)
+    assert graph.neighbors[0, 2:].tolist() == [-1, -1]
+    assert graph.lookup(3, 2) is None and graph.lookup(0, 5) is None
+    graph.build(np.empty((0, 32), dtype=np.float32))
+    assert graph.count == 0
+
+def test_save_load(tmp_path, rng):
+    graph = KNNGraph(4)
+    graph.build(unit_rows(rng, 20))
+    graph.save(str(tmp_path))
+    loaded = KNNGraph(4)
+    assert loaded.load(str(tmp_path), 20)
+    np.testing.assert_array_equal(loaded.neighbors, graph.neighbors)
+    assert not KNNGraph(4).load(str(tmp_path), 21)
+    assert not KNNGraph(8).load(str(tmp_path), 20)
+
+def test_store_compaction_renumbers_the_graph(tmp_path, rng):
+    embeddings = unit_rows(rng, 60)
+    store = EmbeddingStore(str(tmp_path), "m", compact_every=10_000, neighbor_graph=KNNGraph(4)).load()
+    store.append_many([(f"{i}.jpg", row, None) for i, row in enumerate(embeddings[:40])])
+    store.append_many([(f"{i}.jpg", row, None) for i, row in enumerate(embeddings[40:], 40)])
+    assert store.neighbor_graph.count == 60
+
+    dead = list(range(0, 60, 4))
+    store.remove([f"{i}.jpg" for i in dead])
+    # Until the compaction, lists may still point at tombstoned rows
+    assert store.neighbor_graph.count == 60
+    store.compact()
+    live = np.delete(embeddings, dead, axis=0)
+    np.testing.assert_array_equal(store.neighbor_graph.neighbors, brute_force(live, 4))
+
+    reopened = EmbeddingStore(str(tmp_path), "m", neighbor_graph=KNNGraph(4)).load()
+    np.testing.assert_array_equal(reopened.neighbor_graph.neighbors, store.neighbor_graph.neighbors)
+
+def test_store_replays_the_graph_for_log_records(tmp_path, rng):
+    embeddings = unit_rows(rng, 30)
+    store = EmbeddingStore(str(tmp_path), "m", compact_every=10_000, neighbor_graph=KNNGraph(3)).load()
+    store.append_many([(f"{i}.jpg", row, None) for i, row in enumerate(embeddings)])
+    store.remove(["5.jpg"])
+    store.append("5.jpg", embeddings[5])
+    reopened = EmbeddingStore(str(tmp_path), "m", neighbor_graph=KNNGraph(3)).load()
+    assert reopened.neighbor_graph.count == 31
+    reopened.compact()
+    order = [i for i in range(30) if i != 5] + [5]
+    np.testing.assert_array_equal(reopened.neighbor_graph.neighbors, brute_force(embeddings[order], 3))
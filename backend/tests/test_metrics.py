@@ -0,0 +1,51 @@
+# test_metrics.py
+import pytest
+
+import metrics
+from metrics import Registry
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "Latency", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, "search")
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP latency_seconds Latency", "# TYPE latency_seconds histogram"]
+    assert lines[2:] == [
+        'latency_seconds_bucket{stage="search",le="0.1"} 2',
+        'latency_seconds_bucket{stage="search",le="1.0"} 3',
+        'latency_seconds_bucket{stage="search",le="+Inf"} 4',
+        'latency_seconds_sum{stage="search"} 3.65',
+        'latency_seconds_count{stage="search"} 4',
+    ]
+
+def test_counters_and_label_values_are_escaped():
+    registry = Registry()
+    counter = registry.counter("requests_total", "Requests", ("endpoint", "status"))
+    counter.inc("/api/search", 200)
+    counter.inc("/api/search", 200, amount=2)
+    counter.inc('a"b\\c\n', 500)
+    lines = registry.render().splitlines()
+    assert 'requests_total{endpoint="/api/search",status="200"} 3' in lines
+    assert 'requests_total{endpoint="a\\"b\\\\c\\n",status="500"} 1' in lines
+
+def test_collectors_render_gauges_and_survive_errors():
+    registry = Registry()
+    registry.add_collector(lambda: [("queue_depth", "Queued files", {(): 3, (("partition", "alice"),): 1.5})])
+
+    def broken():
+        raise RuntimeError("store closed")
+    registry.add_collector(broken)
+    text = registry.render()
+    assert "# TYPE queue_depth gauge\nqueue_depth 3\nqueue_depth{partition=\"alice\"} 1.5\n" in text
+    assert text.endswith("# collector error: store closed\n")
+
+def test_stage_times_the_block_even_when_it_raises(monkeypatch):
+    observed = []
+    monkeypatch.setattr(metrics, "observe_stage", lambda *args: observed.append(args))
+    ticks = iter([10.0, 10.25])
+    monkeypatch.setattr(metrics.time, "perf_counter", lambda: next(ticks))
+    with pytest.raises(ValueError):
+        with metrics.stage("text_encode", items=4):
+            raise ValueError
+    assert observed == [("text_encode", 0.25, 4)]
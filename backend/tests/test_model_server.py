@@ -0,0 +1,102 @@
+# test_model_server.py
+import os
+import stat
+import pytest
+from multiprocessing import AuthenticationError
+
+from ingest_queue import QueueFullError
+from model_server import ModelServer, ModelClient, ModelServerError, load_authkey
+
+class DroppedConnection:
+    """A connection to a server that went away, failing on send or while awaiting the reply."""
+
+    def __init__(self, fail_on):
+        self.fail_on = fail_on
+        self.sent = []
+
+    def send(self, message):
+        if self.fail_on == "send":
+            raise BrokenPipeError("connection closed")
+        self.sent.append(message)
+
+    def recv(self):
+        raise EOFError()
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.delenv("CODRESS_MODEL_SERVER_KEY", raising=False)
+    calls = []
+
+    def submit(files, owner):
+        calls.append(("submit", files, owner))
+        return {"id": "job"}
+
+    def reserve(count):
+        raise QueueFullError(f"no room for {count}")
+
+    handlers = {
+        "encode_texts": lambda texts: [len(text) for text in texts],
+        "submit": submit,
+        "reserve": reserve,
+        "fail": lambda: 1 / 0,
+    }
+    socket_path = str(tmp_path / "model.sock")
+    ModelServer(socket_path, handlers).start()
+    return socket_path, calls
+
+def test_calls_round_trip(server):
+    socket_path, calls = server
+    client = ModelClient(socket_path)
+    assert client.encode_texts(["ab", "c"]) == [2, 1]
+    assert client.call("submit", [("a.jpg", "a.jpg")], "alice") == {"id": "job"}
+    assert calls == [("submit", [("a.jpg", "a.jpg")], "alice")]
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(socket_path + ".key").st_mode) == 0o600
+
+def test_server_errors_are_raised_on_the_client(server):
+    client = ModelClient(server[0])
+    with pytest.raises(QueueFullError, match="no room for 3"):
+        client.call("reserve", 3)
+    with pytest.raises(ModelServerError, match="ZeroDivisionError"):
+        client.call("fail")
+    with pytest.raises(ModelServerError, match="Unknown model server operation"):
+        client.call("missing")
+    # The connection survives failed calls
+    assert client.encode_texts(["x"]) == [1]
+
+def test_idempotent_calls_reconnect_after_a_lost_reply(server):
+    client = ModelClient(server[0])
+    client._local.conn = DroppedConnection("recv")
+    assert client.encode_texts(["abc"]) == [3]
+
+def test_unsent_calls_reconnect(server):
+    socket_path, calls = server
+    client = ModelClient(socket_path)
+    client._local.conn = DroppedConnection("send")
+    assert client.call("submit", [], None) == {"id": "job"}
+    assert len(calls) == 1
+
+def test_non_idempotent_calls_are_not_sent_twice(server):
+    socket_path, calls = server
+    client = ModelClient(socket_path)
+    dropped = DroppedConnection("recv")
+    client._local.conn = dropped
+    with pytest.raises(ModelServerError, match="unavailable"):
+        client.call("submit", [], None)
+    assert len(dropped.sent) == 1 and calls == []
+    # The broken connection is dropped; the next call opens a new one
+    assert client.call("submit", [], None) == {"id": "job"}
+
+def test_unreachable_server_and_wrong_key(tmp_path, server, monkeypatch):
+    with pytest.raises(ModelServerError, match="unavailable"):
+        ModelClient(str(tmp_path / "none.sock")).encode_texts(["a"])
+    monkeypatch.setenv("CODRESS_MODEL_SERVER_KEY", "wrong")
+    with pytest.raises(AuthenticationError):
+        ModelClient(server[0]).encode_texts(["a"])
+    monkeypatch.delenv("CODRESS_MODEL_SERVER_KEY")
+    # The server keeps accepting clients with the right key
+    assert ModelClient(server[0]).encode_texts(["a"]) == [1]
+
+def test_authkey_from_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("CODRESS_MODEL_SERVER_KEY", "secret")
+    assert load_authkey(str(tmp_path / "x.sock")) == b"secret"
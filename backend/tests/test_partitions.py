@@ -0,0 +1,107 @@
+# test_partitions.py
+import os
+import threading
+import pytest
+
+import partitions
+from partitions import PartitionManager, partition_id
+from conftest import unit_rows
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(partitions.time, "monotonic", lambda: now[0])
+    return now
+
+def manager(tmp_path, **options):
+    return PartitionManager(str(tmp_path / "users"), "m", **options)
+
+def test_partition_folders_do_not_contain_the_username(tmp_path):
+    partitions = manager(tmp_path)
+    alice = partitions.get("../alice")
+    assert partition_id("../alice") == partition_id("../alice") != partition_id("alice")
+    assert alice.folder == os.path.join(str(tmp_path / "users"), partition_id("../alice"))
+    assert alice.url_prefix == f"/data/users/{alice.id}/"
+    assert os.path.isdir(os.path.join(alice.folder, "index"))
+    assert partitions.get("../alice") is alice and partitions.stats()["loads"] == 1
+
+def test_least_recently_used_partitions_are_closed_over_the_limit(tmp_path):
+    partitions = manager(tmp_path, max_loaded=2)
+    alice = partitions.get("alice")
+    partitions.get("bob")
+    partitions.get("alice")
+    partitions.get("carol")
+    assert partitions.stats()["loaded"] == 2 and partitions.stats()["evictions"] == 1
+    # bob was the least recently used; alice stays open
+    assert partitions.get("alice") is alice
+    assert partitions.stats()["loads"] == 3
+
+def test_idle_partitions_are_closed_and_reopen_with_their_rows(tmp_path, clock, rng):
+    partitions = manager(tmp_path, idle_seconds=60)
+    partitions.get("alice").store.append("coat.jpg", unit_rows(rng, 1)[0])
+    partitions.get("bob")
+    clock[0] += 30
+    partitions.get("bob")
+    clock[0] += 40
+    assert partitions.evict_idle() == 1
+    assert partitions.stats()["loaded"] == 1
+    # Closing compacted the append log, so the reopened store has the row
+    assert partitions.get("alice").store.live_paths() == ["coat.jpg"]
+    assert partitions.stats()["loads"] == 3
+
+def test_pinned_partitions_are_never_closed(tmp_path, clock):
+    partitions = manager(tmp_path, max_loaded=1, idle_seconds=60)
+    with partitions.pinned("alice") as alice:
+        partitions.get("bob")
+        clock[0] += 100
+        assert partitions.evict_idle() == 1  # bob only
+        assert partitions.get("alice") is alice and alice.pins == 1
+    assert alice.pins == 0 and alice.last_used == clock[0]
+    partitions.get("bob")
+    assert partitions.stats()["loaded"] == 1
+
+def test_owner_locks_are_dropped_when_unused(tmp_path, clock):
+    partitions = manager(tmp_path, max_loaded=1, idle_seconds=60)
+    for owner in ["alice", "bob", "carol", "alice"]:
+        partitions.get(owner)
+    clock[0] += 100
+    partitions.evict_idle()
+    assert partitions._owner_locks == {}
+    partitions.get("bob")
+    partitions.close_all()
+    assert partitions._owner_locks == {} and partitions.stats()["loaded"] == 0
+
+def test_a_closing_partition_is_not_reopened_until_it_is_closed(tmp_path, clock, monkeypatch):
+    partitions = manager(tmp_path, idle_seconds=60)
+    alice = partitions.get("alice")
+    closing, release = threading.Event(), threading.Event()
+    opened = []
+    close_store = alice.store.close
+
+    def slow_close():
+        closing.set()
+        release.wait(5)
+        close_store()
+    monkeypatch.setattr(alice.store, "close", slow_close)
+    clock[0] += 100
+    sweeper = threading.Thread(target=partitions.evict_idle)
+    sweeper.start()
+    assert closing.wait(5)
+    reader = threading.Thread(target=lambda: opened.append(partitions.get("alice")))
+    reader.start()
+    reader.join(0.2)
+    # The request for alice waits for her store to finish closing
+    assert reader.is_alive() and not opened
+    release.set()
+    sweeper.join(5)
+    reader.join(5)
+    assert opened and opened[0] is not alice
+    assert partitions._owner_locks == {}
+
+def test_read_only_partitions_follow_the_owner(tmp_path, rng):
+    writer = manager(tmp_path, publish=True)
+    reader = manager(tmp_path, read_only=True)
+    assert len(reader.get("alice").store) == 0
+    writer.get("alice").store.append("coat.jpg", unit_rows(rng, 1)[0])
+    writer.get("alice").store.compact()
+    assert reader.get("alice").store.live_paths() == ["coat.jpg"]
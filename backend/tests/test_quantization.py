@@ -0,0 +1,74 @@
+# test_quantization.py
+import numpy as np
+import pytest
+
+from conftest import unit_rows, with_deleted, exact_ids, recall
+from quantization import QuantizedIndex, ScalarQuantizer, ProductQuantizer
+from vector_index import create_index
+
+@pytest.mark.parametrize("quantizer", [ScalarQuantizer(), ProductQuantizer(m=8)], ids=["sq8", "pq"])
+def test_quantized_recall(rng, quantizer):
+    embeddings, queries = unit_rows(rng, 1500), unit_rows(rng, 20)
+    index = QuantizedIndex(quantizer, rerank_factor=8, min_train_size=100)
+    index.build(embeddings[:1000])
+    index.add(embeddings, 1000)
+    assert index.codes.shape[0] == 1500
+    assert index.memory_bytes < embeddings.nbytes
+    scores, ids = index.search(embeddings, queries, 10)
+    assert recall(ids, exact_ids(embeddings, queries, 10)) > 0.8
+    # Re-ranked scores are the exact cosine similarities
+    np.testing.assert_allclose(scores, np.take_along_axis(queries @ embeddings.T, ids, axis=1), rtol=1e-5)
+
+def test_quantized_deleted_save_load_and_drop(tmp_path, rng):
+    embeddings = unit_rows(rng, 300)
+    index = QuantizedIndex(ScalarQuantizer(), min_train_size=100)
+    index.build(embeddings)
+    _, ids = index.search(with_deleted(embeddings, [5]), embeddings[5], 3)
+    assert 5 not in ids[0].tolist()
+
+    index.save(str(tmp_path))
+    loaded = QuantizedIndex(ScalarQuantizer(), min_train_size=100)
+    assert loaded.load(str(tmp_path), 300)
+    np.testing.assert_array_equal(loaded.codes, index.codes)
+    assert not QuantizedIndex(ProductQuantizer(m=8)).load(str(tmp_path), 300)
+
+    keep = np.setdiff1d(np.arange(300), [5])
+    index.drop(embeddings[keep], keep)
+    assert index.codes.shape[0] == 299
+    _, ids = index.search(embeddings[keep], embeddings[keep][5], 1)
+    assert ids[0, 0] == 5
+
+def test_sq8_code_error_is_within_one_step(rng):
+    embeddings = unit_rows(rng, 200)
+    quantizer = ScalarQuantizer()
+    quantizer.train(embeddings, rng)
+    codes = quantizer.encode(embeddings)
+    assert codes.dtype == np.uint8 and codes.shape == embeddings.shape
+    decoded = codes * quantizer.scale + quantizer.low
+    assert np.all(np.abs(decoded - embeddings) <= quantizer.scale / 2 + 1e-6)
+
+def test_pq_codes_are_one_byte_per_subspace(rng):
+    embeddings = unit_rows(rng, 500)
+    quantizer = ProductQuantizer(m=8)
+    quantizer.train(embeddings, rng)
+    codes = quantizer.encode(embeddings)
+    assert codes.shape == (500, 8) and codes.dtype == np.uint8
+    approx = quantizer.scores(embeddings[:5], codes)
+    exact = embeddings[:5] @ embeddings.T
+    assert np.corrcoef(approx.ravel(), exact.ravel())[0, 1] > 0.8
+
+def test_untrained_falls_back_to_exact(rng):
+    embeddings, queries = unit_rows(rng, 50), unit_rows(rng, 3)
+    index = QuantizedIndex(ScalarQuantizer(), min_train_size=100)
+    index.build(embeddings)
+    assert not index.trained and index.memory_bytes == 0
+    _, ids = index.search(embeddings, queries, 5)
+    np.testing.assert_array_equal(ids, exact_ids(embeddings, queries, 5))
+    # Training starts once enough rows were appended
+    more = np.vstack([embeddings, unit_rows(rng, 60)])
+    index.add(more, 50)
+    assert index.trained and index.codes.shape[0] == 110
+
+def test_create_quantized_indexes():
+    assert create_index("sq8").name == "sq8"
+    assert create_index("pq").name == "pq"
@@ -0,0 +1,48 @@
+# test_query_planner.py
+import numpy as np
+import pytest
+
+from query_planner import split_query, plan_query, fuse
+
+# Two parts, depth 3: part 0 ranks rows 10, 11, 12 and part 1 ranks 20, 10, 21
+SCORES = [[0.9, 0.5, 0.2], [0.8, 0.7, 0.6]]
+IDS = [[10, 11, 12], [20, 10, 21]]
+
+def test_split_and_plan():
+    assert split_query("Red Dress and white shoes") == ["red dress", "white shoes"]
+    assert split_query("kırmızı elbise ve beyaz ayakkabı") == ["kırmızı elbise", "beyaz ayakkabı"]
+    assert plan_query("a and b", 5, 0.2) == [{"query": "a", "k": 5, "threshold": 0.2},
+                                              {"query": "b", "k": 5, "threshold": 0.2}]
+    parts = plan_query("ignored", 5, 0.2, parts=[{"query": " shirt ", "k": 2}, {"query": " "}])
+    assert parts == [{"query": "shirt", "k": 2, "threshold": 0.2}]
+
+def test_max_keeps_each_rows_best_part():
+    rows, sims, parts, fused = fuse(SCORES, IDS, [3, 3], [0.0, 0.0], "max")
+    assert rows.tolist() == [10, 20, 21, 11, 12]
+    assert parts.tolist() == [0, 1, 1, 0, 0]
+    np.testing.assert_allclose(sims, [0.9, 0.8, 0.6, 0.5, 0.2])
+    np.testing.assert_array_equal(fused, sims)
+
+def test_rrf_rewards_rows_found_by_several_parts():
+    rows, sims, parts, fused = fuse(SCORES, IDS, [3, 3], [0.0, 0.0], "rrf")
+    assert rows[0] == 10
+    np.testing.assert_allclose(fused[0], 1 / 61 + 1 / 62)
+    assert sorted(rows.tolist()) == [10, 11, 12, 20, 21]
+    assert np.all(np.diff(fused) <= 0)
+
+def test_quota_interleaves_parts():
+    rows, _, parts, _ = fuse(SCORES, IDS, [3, 3], [0.0, 0.0], "quota")
+    assert rows.tolist() == [10, 20, 11, 12, 21]
+    assert parts.tolist() == [0, 1, 0, 0, 1]
+
+def test_per_part_k_threshold_limit_and_missing_ids():
+    rows, _, _, _ = fuse(SCORES, IDS, [1, 3], [0.0, 0.65], "max")
+    assert rows.tolist() == [10, 20]
+    rows, _, _, _ = fuse(SCORES, [[10, -1, -1], [20, 10, -1]], [3, 3], [0.0, 0.0], "max", limit=2)
+    assert rows.tolist() == [10, 20]
+    rows, sims, parts, fused = fuse(SCORES, IDS, [3, 3], [1.0, 1.0], "rrf")
+    assert rows.size == sims.size == parts.size == fused.size == 0
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        fuse(SCORES, IDS, [3, 3], [0.0, 0.0], "borda")
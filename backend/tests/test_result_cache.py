@@ -0,0 +1,66 @@
+# test_result_cache.py
+import pytest
+
+from result_cache import SearchResultCache, search_key
+
+def test_key_normalizes_the_query_and_label_order():
+    assert search_key("  Black DRESS ", style=" Casual") == search_key("black dress", style="casual")
+    assert search_key("dress", labels={"color": ["red", "blue"], "style": "casual"}) == \
+        search_key("dress", labels={"style": ["casual"], "color": ["blue", "red"]})
+    assert search_key("dress", fusion=None) == search_key("dress", fusion="max")
+
+@pytest.mark.parametrize("options", [{"k": 5}, {"threshold": 0.3}, {"fusion": "rrf"}, {"limit": 10},
+                                     {"style": "formal"}, {"labels": {"color": "red"}},
+                                     {"parts": [{"query": "red", "k": 3}]}])
+def test_key_changes_with_every_result_option(options):
+    assert search_key("dress", **options) != search_key("dress")
+
+def test_hits_are_served_until_the_generation_moves():
+    cache = SearchResultCache()
+    key = search_key("dress")
+    assert cache.get(1, key) is None
+    etag, body = cache.put(1, key, b'{"results":[]}')
+    assert cache.get(1, key) == (etag, body)
+    # Any write to the index drops the cached responses
+    assert cache.get(2, key) is None
+    assert len(cache) == 0
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["invalidations"], stats["generation"]) == (1, 2, 1, 2)
+
+def test_responses_of_an_older_generation_are_not_cached():
+    cache = SearchResultCache()
+    cache.get(3, "a")
+    etag, _ = cache.put(2, "a", b"old")
+    assert etag == cache.etag(2, "a")
+    assert cache.get(3, "a") is None and len(cache) == 0
+
+def test_etags_differ_by_generation_key_and_instance():
+    cache = SearchResultCache()
+    assert cache.etag(1, "a") == cache.etag(1, "a")
+    assert len({cache.etag(1, "a"), cache.etag(2, "a"), cache.etag(1, "b"), SearchResultCache().etag(1, "a")}) == 4
+
+def test_least_recently_used_entries_are_evicted_by_count_and_bytes():
+    cache = SearchResultCache(max_entries=2, max_bytes=10)
+    cache.put(1, "a", b"aaa")
+    cache.put(1, "b", b"bbb")
+    cache.get(1, "a")
+    cache.put(1, "c", b"ccc")
+    assert cache.get(1, "b") is None and cache.get(1, "a") is not None
+    cache.put(1, "a", b"aaaaaaaa")
+    assert cache.get(1, "c") is None
+    assert cache.stats()["bytes"] == 8 and cache.stats()["evictions"] == 2
+    # A body larger than the whole cache is returned but not stored
+    assert cache.put(1, "d", b"d" * 11)[1] == b"d" * 11
+    assert cache.get(1, "d") is None and cache.get(1, "a") is not None
+
+def test_disabled_cache_stores_nothing():
+    cache = SearchResultCache(max_entries=0)
+    etag, body = cache.put(1, "a", b"x")
+    assert etag and body == b"x"
+    assert cache.get(1, "a") is None and len(cache) == 0
+
+def test_clear_keeps_the_generation():
+    cache = SearchResultCache()
+    cache.put(4, "a", b"x")
+    cache.clear()
+    assert len(cache) == 0 and cache.stats()["bytes"] == 0 and cache.stats()["generation"] == 4
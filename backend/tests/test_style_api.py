@@ -0,0 +1,73 @@
+# test_style_api.py
+import types
+import numpy as np
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("torch")
+pytest.importorskip("clip")
+
+from flask import Flask
+
+from conftest import unit_rows
+from api import style_api
+from models.attribute_store import AttributeStore
+from embedding_store import EmbeddingStore
+
+ITEMS = [
+    {"id": "0.jpg", "category": "shirt", "color": "blue", "style": "casual"},
+    {"id": "1.jpg", "category": "shirt", "color": "white", "style": "formal"},
+    {"id": "2.jpg", "category": "skirt", "color": "black", "style": "casual"},
+    {"id": "3.jpg", "category": "dress", "color": "red", "style": "casual"},
+]
+
+@pytest.fixture
+def wardrobe(tmp_path, rng):
+    """A partition owned by "alice" holding 2.jpg and 3.jpg."""
+    store = EmbeddingStore(str(tmp_path), "m").load()
+    store.append_many([(name, row, None) for name, row in zip(["2.jpg", "3.jpg"], unit_rows(rng, 2))])
+    return types.SimpleNamespace(owner="alice", store=store, url_prefix="/data/users/alice/")
+
+@pytest.fixture
+def client(monkeypatch, wardrobe):
+    attributes = AttributeStore()
+    attributes.set_items(ITEMS)
+    monkeypatch.setattr(style_api, "clothing_dataset", attributes)
+    app = Flask(__name__)
+    app.register_blueprint(style_api.style_bp, url_prefix="/api/style")
+    partition = {"current": wardrobe}
+    app.config["CALLER_PARTITION"] = lambda: partition["current"]
+    client = app.test_client()
+    client.partition = partition
+    return client
+
+def test_preferences_list_only_the_wardrobe_items(client):
+    response = client.post("/api/style/preferences", json={"style": "casual"})
+    assert response.status_code == 200
+    suggestions = response.get_json()["matching_suggestions"]
+    assert [item["id"] for item in suggestions] == ["2.jpg", "3.jpg"]
+    assert suggestions[0]["url"] == "/data/users/alice/2.jpg"
+    response = client.post("/api/style/preferences", json={"style": "casual", "limit": 1})
+    assert [item["id"] for item in response.get_json()["matching_suggestions"]] == ["2.jpg"]
+
+def test_preferences_of_the_shared_catalogue(client, wardrobe):
+    client.partition["current"] = types.SimpleNamespace(owner=None, store=wardrobe.store, url_prefix="/data/")
+    response = client.post("/api/style/preferences", json={"style": "casual", "filters": {"category": "shirt"}})
+    assert [item["id"] for item in response.get_json()["matching_suggestions"]] == ["0.jpg"]
+
+@pytest.mark.parametrize("body", [{"wardrobe": ["shirt"]}, {"wardrobe": 3}, {"limit": 0}, {"limit": True},
+                                  {"filters": {"size": "m"}}, {"filters": {"color": [1]}}])
+def test_preferences_reject_bad_input(client, body):
+    response = client.post("/api/style/preferences", json=body)
+    assert response.status_code == 400 and "error" in response.get_json()
+
+def test_items_outside_the_wardrobe_are_not_found(client, wardrobe):
+    assert client.get("/api/style/item/3.jpg").get_json()["item"]["category"] == "dress"
+    assert client.get("/api/style/item/0.jpg").status_code == 404
+    assert client.get("/api/style/item/missing.jpg").status_code == 404
+    client.partition["current"] = types.SimpleNamespace(owner=None, store=wardrobe.store, url_prefix="/data/")
+    assert client.get("/api/style/item/0.jpg").status_code == 200
+
+def test_search_requires_a_query(client):
+    assert client.post("/api/style/search", json={"query": " "}).status_code == 400
+    assert client.post("/api/style/search", json={"query": "shirt", "threshold": "high"}).status_code == 400
@@ -0,0 +1,59 @@
+# test_text_cache.py
+import numpy as np
+import pytest
+
+import text_cache
+from text_cache import TextEmbeddingCache, normalize_query
+
+def vector(value):
+    return np.full(4, value, dtype=np.float32)
+
+def test_queries_are_normalized():
+    assert normalize_query("  Black   DRESS\n") == "black dress"
+    cache = TextEmbeddingCache()
+    cache.put("Black Dress", vector(1))
+    assert cache.get("black  dress")[0] == 1
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TextEmbeddingCache(max_size=2)
+    cache.put("a", vector(1))
+    cache.put("b", vector(2))
+    cache.get("a")
+    cache.put("c", vector(3))
+    assert cache.get("b") is None
+    assert cache.get("a")[0] == 1 and cache.get("c")[0] == 3
+    assert len(cache) == 2 and cache.stats()["evictions"] == 1
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(text_cache.time, "monotonic", lambda: now[0])
+    cache = TextEmbeddingCache(ttl=10)
+    cache.put("a", vector(1))
+    now[0] += 5
+    assert cache.get("a") is not None
+    now[0] += 6
+    assert cache.get("a") is None
+    assert len(cache) == 0 and cache.stats()["expirations"] == 1
+
+def test_cached_arrays_are_read_only():
+    cache = TextEmbeddingCache()
+    cache.put("a", vector(1))
+    with pytest.raises(ValueError):
+        cache.get("a")[0] = 5
+
+def test_disabled_cache_stores_nothing():
+    cache = TextEmbeddingCache(max_size=0)
+    cache.put("a", vector(1))
+    assert cache.get("a") is None and len(cache) == 0
+
+def test_stats_count_hits_and_misses():
+    cache = TextEmbeddingCache()
+    cache.get("a")
+    cache.put("a", vector(1))
+    cache.get("a")
+    cache.get("A ")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (2, 1, 1)
+    assert stats["hit_rate"] == pytest.approx(2 / 3)
+    cache.clear()
+    assert cache.get("a") is None
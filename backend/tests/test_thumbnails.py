@@ -0,0 +1,53 @@
+# test_thumbnails.py
+import os
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+import thumbnails
+from thumbnails import get_thumbnail, generate_thumbnails, remove_thumbnails, nearest_width, thumbnail_file
+
+@pytest.fixture
+def folder(tmp_path):
+    Image.new("RGB", (600, 300), (200, 30, 30)).save(tmp_path / "wide.jpg", "JPEG")
+    Image.new("RGB", (100, 50), (30, 200, 30)).save(tmp_path / "small.png", "PNG")
+    return tmp_path
+
+def test_requested_widths_round_up_to_a_configured_one(monkeypatch):
+    monkeypatch.setattr(thumbnails, "THUMBNAIL_WIDTHS", (128, 256, 512))
+    assert [nearest_width(w) for w in (1, 128, 129, 500, 4000)] == [128, 128, 256, 512, 512]
+
+def test_thumbnail_is_a_resized_webp(folder):
+    path = get_thumbnail(str(folder), "wide.jpg", 128)
+    assert path == thumbnail_file(str(folder), "wide.jpg", 128)
+    with Image.open(path) as image:
+        assert image.format == "WEBP" and image.size == (128, 64)
+
+def test_small_images_are_not_enlarged(folder):
+    with Image.open(get_thumbnail(str(folder), "small.png", 512)) as image:
+        assert image.size == (100, 50)
+
+def test_fresh_thumbnails_are_reused_and_stale_ones_rendered_again(folder):
+    path = get_thumbnail(str(folder), "wide.jpg", 256)
+    os.utime(path, (1, 1))
+    source_mtime = os.stat(folder / "wide.jpg").st_mtime
+    os.utime(folder / "wide.jpg", (0, 0))
+    # Newer than its (backdated) source: served as is
+    assert get_thumbnail(str(folder), "wide.jpg", 256) == path and os.stat(path).st_mtime == 1
+    os.utime(folder / "wide.jpg", (source_mtime, source_mtime))
+    get_thumbnail(str(folder), "wide.jpg", 256)
+    assert os.stat(path).st_mtime >= source_mtime
+
+def test_generate_and_remove_every_width(folder, monkeypatch):
+    monkeypatch.setattr(thumbnails, "THUMBNAIL_WIDTHS", (64, 128))
+    generate_thumbnails(str(folder), "wide.jpg")
+    assert sorted(os.listdir(folder / "thumbs")) == ["wide.jpg.w128.webp", "wide.jpg.w64.webp"]
+    remove_thumbnails(str(folder), "wide.jpg")
+    assert os.listdir(folder / "thumbs") == []
+
+def test_unreadable_images_are_logged_not_raised(folder):
+    (folder / "broken.jpg").write_bytes(b"not an image")
+    generate_thumbnails(str(folder), "broken.jpg")
+    with pytest.raises(Exception):
+        get_thumbnail(str(folder), "broken.jpg", 128)
+    assert not os.path.exists(thumbnail_file(str(folder), "broken.jpg", 128))
@@ -0,0 +1,98 @@
+# test_vector_index.py
+import numpy as np
+import pytest
+
+from conftest import unit_rows, with_deleted, exact_ids, recall
+from vector_index import ExactIndex, IVFIndex, create_index, top_k
+
+def test_top_k_is_sorted_best_first():
+    scores = np.array([[0.1, 0.9, 0.5, 0.7], [1.0, 0.0, 0.2, 0.3]], dtype=np.float32)
+    assert top_k(scores, 2).tolist() == [[1, 3], [0, 3]]
+    assert top_k(scores, 10).shape == (2, 4)
+    assert top_k(scores, 0).shape == (2, 0)
+
+def test_exact_matches_brute_force(rng):
+    embeddings, queries = unit_rows(rng, 500), unit_rows(rng, 5)
+    scores, ids = ExactIndex().search(embeddings, queries, 10)
+    np.testing.assert_array_equal(ids, exact_ids(embeddings, queries, 10))
+    assert np.all(np.diff(scores, axis=1) <= 0)
+
+def test_exact_empty_and_small(rng):
+    scores, ids = ExactIndex().search(np.empty((0, 32), dtype=np.float32), unit_rows(rng, 2), 5)
+    assert scores.shape == ids.shape == (2, 0)
+    _, ids = ExactIndex().search(unit_rows(rng, 3), unit_rows(rng, 1), 5)
+    assert sorted(ids[0].tolist()) == [0, 1, 2]
+
+def test_exact_skips_deleted_rows(rng):
+    embeddings = unit_rows(rng, 20)
+    _, ids = ExactIndex().search(with_deleted(embeddings, [3]), embeddings[3], 5)
+    assert 3 not in ids[0].tolist()
+    # Fewer live rows than k: the deleted ones come back as -1
+    _, ids = ExactIndex().search(with_deleted(embeddings, range(18)), embeddings[0], 5)
+    assert sorted(i for i in ids[0].tolist() if i >= 0) == [18, 19]
+    assert (ids[0] == -1).sum() == 3
+
+def test_ivf_recall_and_appends(rng):
+    embeddings, queries = unit_rows(rng, 2000), unit_rows(rng, 20)
+    index = IVFIndex(nlist=16, nprobe=16, min_train_size=100)
+    index.build(embeddings[:1500])
+    assert index.trained
+    # Rows appended after build() are assigned to their nearest centroid
+    index.add(embeddings, 1500)
+    assert index.assignments.shape == (2000,)
+    _, ids = index.search(embeddings, queries, 10)
+    # Probing every cluster is exact
+    assert recall(ids, exact_ids(embeddings, queries, 10)) == 1.0
+    index.nprobe = 4
+    _, ids = index.search(embeddings, queries, 10)
+    assert recall(ids, exact_ids(embeddings, queries, 10)) > 0.3
+
+def test_ivf_untrained_falls_back_to_exact(rng):
+    embeddings, queries = unit_rows(rng, 50), unit_rows(rng, 3)
+    index = IVFIndex(min_train_size=100)
+    index.build(embeddings)
+    assert not index.trained
+    _, ids = index.search(embeddings, queries, 5)
+    np.testing.assert_array_equal(ids, exact_ids(embeddings, queries, 5))
+
+def test_ivf_save_load_and_drop(tmp_path, rng):
+    embeddings = unit_rows(rng, 400)
+    index = IVFIndex(nlist=8, nprobe=8, min_train_size=100)
+    index.build(embeddings)
+    index.save(str(tmp_path))
+    loaded = IVFIndex(nlist=8, nprobe=8, min_train_size=100)
+    assert loaded.load(str(tmp_path), 400)
+    np.testing.assert_array_equal(loaded.assignments, index.assignments)
+    assert not IVFIndex().load(str(tmp_path), 399)
+
+    _, ids = index.search(with_deleted(embeddings, [7]), embeddings[7], 5)
+    assert 7 not in ids[0].tolist()
+    keep = np.setdiff1d(np.arange(400), [7])
+    index.drop(embeddings[keep], keep)
+    assert index.assignments.shape == (399,)
+    _, ids = index.search(embeddings[keep], embeddings[keep][10], 1)
+    assert ids[0, 0] == 10
+
+def test_store_compaction_renumbers_ivf_assignments(tmp_path, rng):
+    from embedding_store import EmbeddingStore
+
+    embeddings = unit_rows(rng, 300)
+    store = EmbeddingStore(str(tmp_path), "m", compact_every=10_000,
+                           vector_index=IVFIndex(nlist=4, nprobe=4, min_train_size=100)).load()
+    store.append_many([(f"{i}.jpg", row, None) for i, row in enumerate(embeddings)])
+    assert store.vector_index.trained
+    store.remove([f"{i}.jpg" for i in range(0, 300, 3)])
+    store.compact()
+
+    live = np.delete(embeddings, np.arange(0, 300, 3), axis=0)
+    assert store.vector_index.assignments.shape == (200,)
+    for row in (0, 57, 199):
+        _, ids = store.vector_index.search(store.embeddings, live[row], 1)
+        assert ids[0, 0] == row
+
+def test_create_index(monkeypatch):
+    assert isinstance(create_index("exact"), ExactIndex)
+    monkeypatch.setenv("CODRESS_VECTOR_INDEX", "ivf")
+    assert isinstance(create_index(), IVFIndex)
+    with pytest.raises(ValueError):
+        create_index("hnsw")
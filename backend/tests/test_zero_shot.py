@@ -0,0 +1,108 @@
+# test_zero_shot.py
+import json
+import numpy as np
+import pytest
+
+from zero_shot import LabelScores, load_label_set
+from embedding_store import EmbeddingStore
+
+LABEL_SET = {"style": ["formal", "casual"], "color": ["red", "blue", "green"]}
+DIM = 8
+
+VOCABULARY = ["formal", "casual", "red", "blue", "green", "sporty"]
+
+class PromptEncoder:
+    """Encodes a prompt about VOCABULARY[i] as the unit vector e_i and counts the calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, prompts):
+        self.calls += 1
+        rows = np.zeros((len(prompts), DIM), dtype=np.float32)
+        for row, prompt in zip(rows, prompts):
+            row[[i for i, word in enumerate(VOCABULARY) if f" {word} " in f" {prompt} "]] = 1
+        return rows
+
+def image(style, color):
+    """Unit embedding closest to the given style and color prompts."""
+    row = np.zeros(DIM, dtype=np.float32)
+    row[VOCABULARY.index(style)] = 1
+    row[VOCABULARY.index(color)] = 1
+    return row / np.linalg.norm(row)
+
+IMAGES = [image("formal", "red"), image("casual", "blue"), image("casual", "red"), image("formal", "green")]
+
+def test_scores_are_per_group_probabilities():
+    labels = LabelScores(LABEL_SET, encode_texts=PromptEncoder())
+    labels.build(np.stack(IMAGES))
+    assert labels.scores.dtype == np.float16 and labels.scores.shape == (4, 5)
+    np.testing.assert_allclose(labels.scores[:, :2].astype(np.float32).sum(axis=1), 1, atol=1e-2)
+    np.testing.assert_allclose(labels.scores[:, 2:].astype(np.float32).sum(axis=1), 1, atol=1e-2)
+    assert labels.top.tolist() == [[0, 0], [1, 1], [1, 0], [0, 2]]
+
+def test_filters_mask_rows_by_top_label():
+    labels = LabelScores(LABEL_SET, encode_texts=PromptEncoder())
+    labels.build(np.stack(IMAGES))
+    assert labels.rows({"style": "casual"}).tolist() == [1, 2]
+    assert labels.rows({"style": "formal", "color": ["red", "green"]}).tolist() == [0, 3]
+    assert labels.rows({"color": "blue", "style": "formal"}).tolist() == []
+    assert labels.counts() == {"style": {"formal": 2, "casual": 2}, "color": {"red": 2, "blue": 1, "green": 1}}
+    assert labels.counts(exclude=[0])["color"]["red"] == 1
+
+def test_filter_validation():
+    labels = LabelScores(LABEL_SET, encode_texts=PromptEncoder())
+    assert labels.filter_error({"style": "casual", "color": ["red"]}) is None
+    assert "Unknown label group" in labels.filter_error({"size": "m"})
+    assert "not a style label" in labels.filter_error({"style": "punk"})
+    assert labels.filter_error({"color": []}) is not None
+    assert labels.filter_error(["style"]) is not None
+
+def test_add_and_drop_follow_the_rows():
+    encoder = PromptEncoder()
+    labels = LabelScores(LABEL_SET, encode_texts=encoder)
+    embeddings = np.stack(IMAGES)
+    labels.build(embeddings[:2])
+    labels.add(embeddings, 2)
+    assert labels.count == 4 and labels.top[3].tolist() == [0, 2]
+    labels.drop(embeddings[[1, 3]], np.array([1, 3]))
+    assert labels.top.tolist() == [[1, 1], [0, 2]]
+    # The prompts are encoded once
+    assert encoder.calls == 1
+
+def test_save_load_and_label_set_changes(tmp_path):
+    labels = LabelScores(LABEL_SET, encode_texts=PromptEncoder())
+    labels.build(np.stack(IMAGES))
+    labels.save(str(tmp_path))
+    loaded = LabelScores(LABEL_SET, encode_texts=PromptEncoder())
+    assert loaded.load(str(tmp_path), 4)
+    assert loaded.top.tolist() == labels.top.tolist()
+    assert not loaded.load(str(tmp_path), 5)
+    other = LabelScores(dict(LABEL_SET, style=["formal", "casual", "sporty"]), encode_texts=PromptEncoder())
+    assert not other.load(str(tmp_path), 4)
+
+def test_store_keeps_scores_in_step_and_rescores_on_a_new_label_set(tmp_path):
+    encoder = PromptEncoder()
+    store = EmbeddingStore(str(tmp_path), "m", label_scores=LabelScores(LABEL_SET, encode_texts=encoder)).load()
+    store.append_many([(f"{i}.jpg", row, None) for i, row in enumerate(IMAGES)])
+    store.remove(["0.jpg"])
+    store.compact()
+    assert store.label_scores.top.tolist() == [[1, 1], [1, 0], [0, 2]]
+
+    reopened = EmbeddingStore(str(tmp_path), "m", label_scores=LabelScores(LABEL_SET, encode_texts=encoder)).load()
+    assert reopened.label_scores.rows({"style": "casual"}).tolist() == [0, 1]
+
+    colors = {"color": ["red", "blue", "green"]}
+    rescored = EmbeddingStore(str(tmp_path), "m", label_scores=LabelScores(colors, encode_texts=PromptEncoder())).load()
+    assert rescored.label_scores.count == 3
+    assert rescored.label_scores.counts() == {"color": {"red": 1, "blue": 1, "green": 1}}
+
+def test_load_label_set(tmp_path):
+    assert load_label_set(None)["style"]
+    path = tmp_path / "labels.json"
+    path.write_text(json.dumps(LABEL_SET))
+    assert load_label_set(str(path)) == LABEL_SET
+    for bad in ({}, {"style": []}, {"style": ["a", "a"]}, {"style": "formal"}):
+        path.write_text(json.dumps(bad))
+        with pytest.raises(ValueError):
+            load_label_set(str(path))
@@ -0,0 +1,90 @@
+# thumbnails.py
+"""
+Resized WebP derivatives of the images in the data folder.
+
+Thumbnails exist at a few fixed widths only; a requested width is rounded
+up to the nearest one so the on-disk cache stays bounded. They are written
+next to the originals in data/thumbs as <filename>.w<width>.webp (the full
+filename, so a.jpg and a.png get different thumbnails), generated at
+ingest time or lazily on first request, and regenerated when the original
+is newer than its thumbnail.
+"""
+import os
+import threading
+from PIL import Image, ImageOps
+
+from metrics import stage
+from log_utils import get_logger
+
+log = get_logger("thumbnails")
+
+THUMBNAIL_WIDTHS = tuple(sorted(
+    int(w) for w in os.environ.get("CODRESS_THUMBNAIL_WIDTHS", "128,256,512").split(",") if w.strip()
+))
+THUMBNAIL_QUALITY = int(os.environ.get("CODRESS_THUMBNAIL_QUALITY", "80"))
+THUMBNAIL_DIR_NAME = "thumbs"
+
+# Keep two threads from rendering the same thumbnail at once
+_locks = [threading.Lock() for _ in range(64)]
+
+def nearest_width(width):
+    """Smallest configured width >= width, or the largest one."""
+    for candidate in THUMBNAIL_WIDTHS:
+        if candidate >= width:
+            return candidate
+    return THUMBNAIL_WIDTHS[-1]
+
+def thumbnail_folder(image_folder):
+    return os.path.join(image_folder, THUMBNAIL_DIR_NAME)
+
+def thumbnail_file(image_folder, filename, width):
+    return os.path.join(thumbnail_folder(image_folder), f"{filename}.w{width}.webp")
+
+def get_thumbnail(image_folder, filename, width):
+    """
+    Returns the path of the width-wide WebP thumbnail of filename, creating
+    it if it is missing or stale. width must be one of THUMBNAIL_WIDTHS.
+    """
+    source = os.path.join(image_folder, filename)
+    target = thumbnail_file(image_folder, filename, width)
+    if _is_fresh(source, target):
+        return target
+    with _locks[hash(target) % len(_locks)]:
+        if not _is_fresh(source, target):
+            _render(source, target, width)
+    return target
+
+def generate_thumbnails(image_folder, filename):
+    """Pre-renders every configured width; failures are logged, not raised."""
+    for width in THUMBNAIL_WIDTHS:
+        try:
+            get_thumbnail(image_folder, filename, width)
+        except Exception as e:
+            log.warning("Could not create %dpx thumbnail for %s: %s", width, filename, e)
+            return
+
+def remove_thumbnails(image_folder, filename):
+    for width in THUMBNAIL_WIDTHS:
+        path = thumbnail_file(image_folder, filename, width)
+        if os.path.exists(path):
+            os.remove(path)
+
+def _is_fresh(source, target):
+    try:
+        return os.stat(target).st_mtime >= os.stat(source).st_mtime
+    except FileNotFoundError:
+        return False
+
+def _render(source, target, width):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with stage("thumbnail"):
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            if image.width > width:
+                # Only shrink images, never enlarge small ones
+                image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            tmp_target = target + ".tmp"
+            image.save(tmp_target, "WEBP", quality=THUMBNAIL_QUALITY, method=4)
+        os.replace(tmp_target, target)
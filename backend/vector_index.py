@@ -0,0 +1,340 @@
+# vector_index.py
+"""
+Pluggable top-k search over the stored CLIP embeddings.
+
+Indexes do not own the vectors: search() gets the current embedding matrix
+from the caller (the EmbeddingStore snapshot), so the only extra state an
+index keeps is its own structure, e.g. the IVF centroids and row assignments.
+Rows tombstoned in the snapshot (its deleted attribute) are never returned,
+and drop() renumbers that structure when the store compacts them away.
+
+  exact  scores every row, takes the top k with argpartition
+  ivf    inverted-file index: rows are clustered with spherical k-means,
+         a query only scores the rows in its nprobe closest clusters
+  sq8/pq compressed codes with exact re-ranking, see quantization.py
+"""
+import os
+import time
+import numpy as np
+
+from metrics import observe_stage
+from log_utils import get_logger
+
+log = get_logger("vector_index")
+
+IVF_FILE = "ivf.npz"
+
+def top_k(scores, k):
+    """Indices of the k highest scores in each row of a (q, n) matrix, best first."""
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < n:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(n), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1)
+
+def score_rows(embeddings, queries):
+    """
+    queries @ embeddings.T in float32. A store view (memory-mapped base plus
+    appended rows, see EmbeddingView) is scored part by part, never copied.
+    """
+    parts = embeddings.blocks() if hasattr(embeddings, "blocks") else [(0, embeddings)]
+    scores = [queries @ np.asarray(part, dtype=np.float32).T for _, part in parts]
+    return scores[0] if len(scores) == 1 else np.concatenate(scores, axis=1)
+
+def deleted_rows(embeddings):
+    """Sorted tombstoned rows of a store snapshot, or None."""
+    deleted = getattr(embeddings, "deleted", None)
+    return deleted if deleted is not None and deleted.size else None
+
+def cluster_sums(x, labels, k):
+    """Per-cluster sums and counts of the rows of x, without np.add.at."""
+    order = np.argsort(labels, kind="stable")
+    counts = np.bincount(labels, minlength=k)
+    sums = np.zeros((k, x.shape[1]), dtype=np.float32)
+    nonempty = np.flatnonzero(counts)
+    if nonempty.size:
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+        sums[nonempty] = np.add.reduceat(x[order], starts, axis=0)
+    return sums, counts
+
+class ExactIndex:
+    name = "exact"
+
+    def build(self, embeddings):
+        pass
+
+    def add(self, embeddings, start_row):
+        pass
+
+    def search(self, embeddings, queries, k):
+        """Returns (scores, ids), both (len(queries), k), best first."""
+        queries = np.atleast_2d(queries).astype(np.float32, copy=False)
+        if embeddings.shape[0] == 0:
+            return np.empty((queries.shape[0], 0), dtype=np.float32), np.empty((queries.shape[0], 0), dtype=np.int64)
+        started = time.perf_counter()
+        scores = score_rows(embeddings, queries)
+        deleted = deleted_rows(embeddings)
+        if deleted is not None:
+            scores[:, deleted] = -np.inf
+        scored = time.perf_counter()
+        ids = top_k(scores, k)
+        observe_stage("similarity", scored - started, items=queries.shape[0])
+        observe_stage("topk", time.perf_counter() - scored)
+        scores = np.take_along_axis(scores, ids, axis=1)
+        if deleted is not None:
+            # Deleted rows only make the list when there are fewer than k live rows
+            ids[np.isneginf(scores)] = -1
+        return scores, ids
+
+    def drop(self, embeddings, keep):
+        pass
+
+    def save(self, index_dir):
+        pass
+
+    def load(self, index_dir, count):
+        return True
+
+class IVFIndex:
+    """
+    Inverted-file index with nlist spherical k-means clusters. nprobe trades
+    recall for speed: more probed clusters means more rows scored exactly.
+    Rows appended after build() are assigned to their nearest centroid, so
+    uploads do not need a retrain. Below min_train_size rows it falls back
+    to exact search.
+    """
+    name = "ivf"
+
+    def __init__(self, nlist=None, nprobe=8, min_train_size=1024, train_iters=10, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.train_iters = train_iters
+        self.seed = seed
+        self.centroids = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self._lists = None
+        self._exact = ExactIndex()
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def build(self, embeddings):
+        n = embeddings.shape[0]
+        if n < self.min_train_size:
+            self.centroids = None
+            self.assignments = np.empty(0, dtype=np.int32)
+            return
+        nlist = min(n, self.nlist or max(1, int(np.sqrt(n))))
+        rng = np.random.default_rng(self.seed)
+        # Train k-means on a sample of at most 64 * nlist rows
+        sample = np.asarray(embeddings[rng.choice(n, size=min(n, 64 * nlist), replace=False)], dtype=np.float32)
+        centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+        for _ in range(self.train_iters):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums, counts = cluster_sums(sample, labels, nlist)
+            empty = counts == 0
+            # Restart empty clusters from random samples
+            sums[empty] = sample[rng.choice(sample.shape[0], size=int(empty.sum()))]
+            centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True).clip(min=1e-12)
+        self.centroids = centroids.astype(np.float32)
+        self.assignments = self._assign(embeddings)
+        log.info("Built IVF index: %d rows in %d lists", n, nlist)
+
+    def add(self, embeddings, start_row):
+        """Assigns rows start_row.. of embeddings to their nearest lists."""
+        if not self.trained:
+            if embeddings.shape[0] >= self.min_train_size:
+                self.build(embeddings)
+            return
+        if start_row != self.assignments.shape[0]:
+            self.build(embeddings)
+            return
+        new = self._assign(embeddings[start_row:])
+        self.assignments = np.concatenate([self.assignments, new])
+
+    def drop(self, embeddings, keep):
+        """Keeps the assignments of rows keep (sorted old rows), now the rows of embeddings."""
+        if not self.trained:
+            return
+        if keep.size and keep[-1] >= self.assignments.shape[0]:
+            self.build(embeddings)
+            return
+        self.assignments = self.assignments[keep]
+
+    def search(self, embeddings, queries, k):
+        queries = np.atleast_2d(queries).astype(np.float32, copy=False)
+        n = embeddings.shape[0]
+        centroids, assignments = self.centroids, self.assignments
+        if centroids is None or n < self.min_train_size:
+            return self._exact.search(embeddings, queries, k)
+
+        # search() never mutates the index: rows appended after the last add()
+        # are scored exactly, rows past the caller's snapshot are skipped
+        lists = self._inverted_lists(assignments, centroids.shape[0])
+        tail = np.arange(min(assignments.shape[0], n), n)
+        deleted = deleted_rows(embeddings)
+        started = time.perf_counter()
+        probes = top_k(queries @ centroids.T, min(self.nprobe, centroids.shape[0]))
+        topk_seconds = 0.0
+        k = min(k, n)
+        all_scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+        all_ids = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        for qi, query in enumerate(queries):
+            candidates = np.concatenate([lists[c] for c in probes[qi]] + [tail])
+            if assignments.shape[0] > n:
+                candidates = candidates[candidates < n]
+            if deleted is not None:
+                candidates = candidates[~np.isin(candidates, deleted)]
+            if candidates.size == 0:
+                continue
+            scores = np.asarray(embeddings[candidates], dtype=np.float32) @ query
+            scored = time.perf_counter()
+            best = top_k(scores[None, :], k)[0]
+            topk_seconds += time.perf_counter() - scored
+            all_scores[qi, :best.size] = scores[best]
+            all_ids[qi, :best.size] = candidates[best]
+        observe_stage("similarity", time.perf_counter() - started - topk_seconds, items=queries.shape[0])
+        observe_stage("topk", topk_seconds)
+        return all_scores, all_ids
+
+    def save(self, index_dir):
+        path = os.path.join(index_dir, IVF_FILE)
+        if not self.trained:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, assignments=self.assignments)
+        os.replace(tmp_path, path)
+
+    def load(self, index_dir, count):
+        """Loads a persisted index; returns False if it is missing or does not fit count rows."""
+        path = os.path.join(index_dir, IVF_FILE)
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as data:
+                centroids, assignments = data["centroids"], data["assignments"]
+        except Exception as e:
+            log.warning("Error reading %s: %s", path, e)
+            return False
+        if assignments.shape[0] > count:
+            return False
+        self.centroids, self.assignments = centroids, assignments.astype(np.int32)
+        return True
+
+    def _assign(self, embeddings, block=65536):
+        out = np.empty(embeddings.shape[0], dtype=np.int32)
+        for start in range(0, embeddings.shape[0], block):
+            rows = np.asarray(embeddings[start:start + block], dtype=np.float32)
+            out[start:start + block] = np.argmax(rows @ self.centroids.T, axis=1)
+        return out
+
+    def _inverted_lists(self, assignments, nlist):
+        cached = self._lists
+        if cached is not None and cached[0] is assignments:
+            return cached[1]
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(nlist + 1))
+        lists = [order[bounds[i]:bounds[i + 1]] for i in range(nlist)]
+        self._lists = (assignments, lists)
+        return lists
+
+def create_index(kind=None):
+    """Builds the index configured by CODRESS_VECTOR_INDEX (exact, ivf, sq8 or pq)."""
+    kind = (kind or os.environ.get("CODRESS_VECTOR_INDEX", "exact")).lower()
+    if kind == "exact":
+        return ExactIndex()
+    if kind == "ivf":
+        nlist = os.environ.get("CODRESS_IVF_NLIST")
+        return IVFIndex(
+            nlist=int(nlist) if nlist else None,
+            nprobe=int(os.environ.get("CODRESS_IVF_NPROBE", "8")),
+            min_train_size=int(os.environ.get("CODRESS_IVF_MIN_TRAIN", "1024")),
+        )
+    if kind in ("sq8", "pq"):
+        from quantization import QuantizedIndex, ScalarQuantizer, ProductQuantizer
+        quantizer = ScalarQuantizer() if kind == "sq8" else ProductQuantizer(m=int(os.environ.get("CODRESS_PQ_M", "64")))
+        return QuantizedIndex(
+            quantizer,
+            rerank_factor=int(os.environ.get("CODRESS_RERANK_FACTOR", "8")),
+            min_train_size=int(os.environ.get("CODRESS_QUANTIZE_MIN_TRAIN", "1024")),
+        )
+    raise ValueError(f"Unknown vector index '{kind}', expected 'exact', 'ivf', 'sq8' or 'pq'")
+
+def recall_report(embeddings, queries, k=10, nprobes=(1, 2, 4, 8, 16, 32), nlist=None, pq_ms=(16, 32, 64)):
+    """
+    Measures recall@k, latency and extra RAM per vector of the IVF and
+    quantized indexes against exact search.
+    """
+    from quantization import QuantizedIndex, ScalarQuantizer, ProductQuantizer
+
+    def measure(label, param, index, extra_bytes):
+        start = time.perf_counter()
+        _, ids = index.search(embeddings, queries, k)
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+        hits = sum(len(set(a) & set(b)) for a, b in zip(ids.tolist(), truth.tolist()))
+        return {"index": label, "param": param, "recall": hits / truth.size, "ms_per_query": ms,
+                "bytes_per_vector": extra_bytes / embeddings.shape[0]}
+
+    exact = ExactIndex()
+    start = time.perf_counter()
+    _, truth = exact.search(embeddings, queries, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    rows = [{"index": "exact", "param": None, "recall": 1.0, "ms_per_query": exact_ms,
+             "bytes_per_vector": float(embeddings.shape[1] * 4)}]
+
+    ivf = IVFIndex(nlist=nlist, min_train_size=0)
+    ivf.build(embeddings)
+    for nprobe in nprobes:
+        ivf.nprobe = nprobe
+        rows.append(measure("ivf", f"nprobe={nprobe}", ivf,
+                            embeddings.nbytes + ivf.assignments.nbytes + ivf.centroids.nbytes))
+
+    # Quantized indexes only keep codes in RAM; full vectors are read for the shortlist
+    quantized = [("sq8", None, QuantizedIndex(ScalarQuantizer(), min_train_size=0))]
+    quantized += [("pq", f"m={m}", QuantizedIndex(ProductQuantizer(m=m), min_train_size=0))
+                  for m in pq_ms if embeddings.shape[1] % m == 0]
+    for label, param, index in quantized:
+        index.build(embeddings)
+        rows.append(measure(label, param, index, index.memory_bytes))
+    return rows
+
+if __name__ == "__main__":
+    import argparse
+    from index_store import load_index
+
+    parser = argparse.ArgumentParser(description="Recall, latency and memory of the IVF and quantized indexes against exact search")
+    parser.add_argument("--index-dir", help="use the embeddings of an existing index instead of synthetic data")
+    parser.add_argument("--n", type=int, default=100000, help="synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.index_dir:
+        _, embeddings, _ = load_index(args.index_dir)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+    else:
+        # Clustered, normalized synthetic data resembling CLIP embeddings
+        centers = rng.standard_normal((max(1, args.n // 500), args.dim)).astype(np.float32)
+        embeddings = centers[rng.integers(0, centers.shape[0], args.n)] + 0.5 * rng.standard_normal((args.n, args.dim)).astype(np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    queries = embeddings[rng.choice(embeddings.shape[0], size=min(args.queries, embeddings.shape[0]), replace=False)]
+    queries = queries + 0.3 * rng.standard_normal(queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    print(f"{embeddings.shape[0]} x {embeddings.shape[1]} embeddings, {len(queries)} queries, k={args.k}")
+    print(f"{'index':<8}{'param':>12}{'recall':>10}{'ms/query':>12}{'RAM B/vec':>12}")
+    for row in recall_report(embeddings, queries, k=args.k, nlist=args.nlist):
+        print(f"{row['index']:<8}{row['param'] or '-':>12}{row['recall']:>10.3f}"
+              f"{row['ms_per_query']:>12.3f}{row['bytes_per_vector']:>12.1f}")
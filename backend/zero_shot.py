@@ -0,0 +1,248 @@
+# zero_shot.py
+"""
+Zero-shot style, category and color scores for every stored image.
+
+A fixed label set (CODRESS_LABEL_SET, a JSON file {"group": ["label", ...]},
+else DEFAULT_LABEL_SET) is encoded once into a text-embedding matrix. Each
+image embedding is scored against it when it enters the store, and the
+per-group softmax is kept as a float16 column array in labels.npz next to
+the embeddings, together with each row's top label per group. Style and
+category filters are then a vectorized mask over that column, computed
+before any similarity scoring.
+
+LabelScores follows the build/add/save/load lifecycle of the neighbour
+graph and is driven by the EmbeddingStore. When the label set (or its
+prompts) changes, the stored scores no longer match its signature and are
+recomputed from the stored embeddings; the image encoder is not run again.
+To do that offline and write the result to disk:
+
+    python zero_shot.py                       # shared index
+    python zero_shot.py --partitions          # and every user partition
+"""
+import os
+import sys
+import json
+import hashlib
+import argparse
+import numpy as np
+
+from log_utils import get_logger
+
+log = get_logger("zero_shot")
+
+LABELS_FILE = "labels.npz"
+LABEL_SET_FILE = os.environ.get("CODRESS_LABEL_SET")
+# A row matches a label when it is the top label of its group with at least this probability
+MIN_LABEL_SCORE = float(os.environ.get("CODRESS_LABEL_MIN_SCORE", "0"))
+# CLIP's logit scale, so the per-group softmax is as peaked as in zero-shot classification
+LOGIT_SCALE = 100.0
+SCORE_BLOCK = 8192
+
+DEFAULT_LABEL_SET = {
+    "style": ["formal", "casual", "sporty", "streetwear", "bohemian", "elegant"],
+    "category": ["dress", "shirt", "t-shirt", "sweater", "jacket", "coat", "jeans", "trousers",
+                 "shorts", "skirt", "suit", "shoes", "bag", "accessory"],
+    "color": ["black", "white", "grey", "beige", "brown", "red", "pink", "orange", "yellow",
+              "green", "blue", "purple", "multicolor"],
+}
+PROMPTS = {
+    "style": "a photo of {} style clothing",
+    "category": "a photo of a {}",
+    "color": "a photo of {} clothing",
+}
+DEFAULT_PROMPT = "a photo of {}"
+
+def load_label_set(path=LABEL_SET_FILE):
+    """The configured label set: {group: [labels]} from path, or DEFAULT_LABEL_SET."""
+    if not path:
+        return DEFAULT_LABEL_SET
+    with open(path, "r", encoding="utf-8") as f:
+        label_set = json.load(f)
+    if not isinstance(label_set, dict) or not label_set:
+        raise ValueError(f"{path} must map label groups to lists of labels")
+    for group, labels in label_set.items():
+        if not isinstance(labels, list) or not labels or not all(isinstance(l, str) for l in labels) \
+                or len(set(labels)) != len(labels):
+            raise ValueError(f"Group '{group}' in {path} needs a list of distinct label strings")
+    return label_set
+
+class LabelScores:
+    def __init__(self, label_set=None, encode_texts=None):
+        self.label_set = {group: list(labels) for group, labels in (label_set or load_label_set()).items()}
+        self.groups = {}
+        start = 0
+        for group, labels in self.label_set.items():
+            self.groups[group] = slice(start, start + len(labels))
+            start += len(labels)
+        self.prompts = [PROMPTS.get(group, DEFAULT_PROMPT).format(label)
+                        for group, labels in self.label_set.items() for label in labels]
+        # Stored scores are recomputed if they belong to another label set
+        self.signature = hashlib.sha1(json.dumps([self.label_set, self.prompts]).encode("utf-8")).hexdigest()
+        self.scores = np.empty((0, len(self.prompts)), dtype=np.float16)
+        self.top = np.empty((0, len(self.groups)), dtype=np.uint8)
+        self._encode_texts = encode_texts
+        self._text = None
+
+    @property
+    def count(self):
+        return self.scores.shape[0]
+
+    def text_matrix(self):
+        """
+        (labels, dim) text embeddings of the prompts, encoded on first use.
+        encode_texts defaults to the CLIP text encoder, imported here so the
+        store and partition modules load without torch.
+        """
+        if self._text is None:
+            if self._encode_texts is None:
+                from embedding_utils import generate_text_embeddings
+                self._encode_texts = generate_text_embeddings
+            self._text = np.asarray(self._encode_texts(self.prompts), dtype=np.float32)
+        return self._text
+
+    def score(self, embeddings):
+        """Per-group label probabilities of embeddings (m, dim) as an (m, labels) float16 array."""
+        m = embeddings.shape[0]
+        scores = np.empty((m, len(self.prompts)), dtype=np.float16)
+        if m == 0:
+            return scores
+        text = self.text_matrix()
+        for start in range(0, m, SCORE_BLOCK):
+            logits = LOGIT_SCALE * (np.asarray(embeddings[start:start + SCORE_BLOCK], dtype=np.float32) @ text.T)
+            for columns in self.groups.values():
+                group = np.exp(logits[:, columns] - logits[:, columns].max(axis=1, keepdims=True))
+                scores[start:start + group.shape[0], columns] = group / group.sum(axis=1, keepdims=True)
+        return scores
+
+    def build(self, embeddings):
+        self.scores = self.score(embeddings)
+        self.top = self._top_labels(self.scores)
+        if self.count:
+            log.info("Scored %d images against %d labels", self.count, len(self.prompts))
+
+    def add(self, embeddings, start_row):
+        """Scores rows start_row.. of embeddings."""
+        if start_row != self.count:
+            self.build(embeddings)
+            return
+        if embeddings.shape[0] == start_row:
+            return
+        scores = self.score(embeddings[start_row:])
+        self.scores = np.concatenate([self.scores, scores])
+        self.top = np.concatenate([self.top, self._top_labels(scores)])
+
+    def drop(self, embeddings, keep):
+        """Keeps the scores of rows keep (sorted old rows), now the rows of embeddings."""
+        if keep.size and keep[-1] >= self.count:
+            self.build(embeddings)
+            return
+        self.scores, self.top = self.scores[keep], self.top[keep]
+
+    def save(self, index_dir):
+        tmp_path = os.path.join(index_dir, LABELS_FILE) + ".tmp.npz"
+        np.savez(tmp_path, scores=self.scores, signature=np.array(self.signature))
+        os.replace(tmp_path, os.path.join(index_dir, LABELS_FILE))
+
+    def load(self, index_dir, count):
+        path = os.path.join(index_dir, LABELS_FILE)
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as data:
+                scores, signature = data["scores"], str(data["signature"])
+        except Exception as e:
+            log.warning("Error reading %s: %s", path, e)
+            return False
+        if signature != self.signature:
+            log.info("Label set changed, rescoring the stored embeddings")
+            return False
+        if scores.shape[0] != count:
+            return False
+        self.scores, self.top = scores, self._top_labels(scores)
+        return True
+
+    def filter_error(self, filters):
+        """Validates {group: label or [labels]}; returns an error message or None."""
+        if not isinstance(filters, dict):
+            return "'labels' must be an object"
+        for group, wanted in filters.items():
+            if group not in self.label_set:
+                return f"Unknown label group '{group}', expected one of {', '.join(self.label_set)}"
+            wanted = [wanted] if isinstance(wanted, str) else wanted
+            if not isinstance(wanted, list) or not wanted:
+                return f"Label filter '{group}' must be a label or a non-empty list of labels"
+            for label in wanted:
+                if label not in self.label_set[group]:
+                    return f"'{label}' is not a {group} label, expected one of {', '.join(self.label_set[group])}"
+        return None
+
+    def mask(self, filters, min_score=MIN_LABEL_SCORE):
+        """
+        Boolean row mask for validated filters: in every filtered group the
+        row's top label is one of the wanted labels (with at least min_score).
+        """
+        mask = np.ones(self.count, dtype=bool)
+        for group, wanted in filters.items():
+            labels = self.label_set[group]
+            wanted = [wanted] if isinstance(wanted, str) else wanted
+            position = list(self.groups).index(group)
+            top = self.top[:, position]
+            mask &= np.isin(top, [labels.index(label) for label in wanted])
+            if min_score > 0:
+                columns = self.groups[group]
+                mask &= self.scores[np.arange(self.count), columns.start + top] >= min_score
+        return mask
+
+    def rows(self, filters):
+        """Row ids matching filters, for search_images(rows=...)."""
+        return np.flatnonzero(self.mask(filters))
+
+    def counts(self, exclude=None):
+        """{group: {label: images whose top label it is}}, leaving out the rows in exclude."""
+        top = np.delete(self.top, exclude, axis=0) if exclude is not None and len(exclude) else self.top
+        return {group: dict(zip(labels, np.bincount(top[:, i], minlength=len(labels)).tolist()))
+                for i, (group, labels) in enumerate(self.label_set.items())}
+
+    def _top_labels(self, scores):
+        top = np.empty((scores.shape[0], len(self.groups)), dtype=np.uint8)
+        for i, columns in enumerate(self.groups.values()):
+            top[:, i] = scores[:, columns].argmax(axis=1)
+        return top
+
+def backfill(index_dir, label_set=None):
+    """
+    Rescores one index against the label set and writes labels.npz. Stop the
+    server first, it owns the index files while it runs. Returns the image count.
+    """
+    from embedding_store import EmbeddingStore
+    from vector_index import ExactIndex
+    from clip_model import MODEL_NAME
+
+    labels = LabelScores(label_set)
+    # load() rescores whatever labels.npz does not cover; compact() writes it with the index
+    store = EmbeddingStore(index_dir, MODEL_NAME, vector_index=ExactIndex(), label_scores=labels).load()
+    if len(store):
+        store.compact()
+    return len(store)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recompute the zero-shot label scores from the stored embeddings.")
+    parser.add_argument("--index-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "index"))
+    parser.add_argument("--partitions", action="store_true", help="also rescore every user partition")
+    parser.add_argument("--label-set", default=LABEL_SET_FILE, help="JSON file {group: [labels]}")
+    args = parser.parse_args(argv)
+
+    label_set = load_label_set(args.label_set)
+    index_dirs = [args.index_dir]
+    if args.partitions:
+        users_folder = os.path.join(os.path.dirname(os.path.abspath(args.index_dir)), "users")
+        if os.path.isdir(users_folder):
+            index_dirs += [os.path.join(users_folder, user, "index") for user in sorted(os.listdir(users_folder))
+                           if os.path.isdir(os.path.join(users_folder, user, "index"))]
+    for index_dir in index_dirs:
+        count = backfill(index_dir, label_set)
+        print(f"[zero_shot.py] {index_dir}: {count} images scored")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
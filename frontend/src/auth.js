@@ -0,0 +1,14 @@
+// Authorization header for the logged-in user; the backend then scopes
+// uploads, listings and searches to that user's wardrobe.
+export function authHeaders() {
+  try {
+    const user = JSON.parse(localStorage.getItem('user') || 'null');
+    return user && user.token ? { Authorization: `Bearer ${user.token}` } : {};
+  } catch {
+    return {};
+  }
+}
+
+export function isLoggedIn() {
+  return Boolean(authHeaders().Authorization);
+}
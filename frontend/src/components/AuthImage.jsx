@@ -0,0 +1,41 @@
+import React, { useEffect, useState } from 'react';
+import { authHeaders } from '../auth';
+
+// Wardrobe images (/data/users/...) are only served to their owner's bearer
+// token, which a plain <img src> cannot send: they are fetched with the
+// Authorization header and shown from an object URL. Shared catalogue
+// images keep a normal src so the browser cache serves them directly.
+export default function AuthImage({ src, ...props }) {
+  const isPrivate = Boolean(src) && src.includes('/data/users/');
+  const [objectUrl, setObjectUrl] = useState(null);
+  const [failed, setFailed] = useState(false);
+
+  useEffect(() => {
+    if (!isPrivate) return undefined;
+    let cancelled = false;
+    let url = null;
+    setObjectUrl(null);
+    setFailed(false);
+    fetch(src, { headers: authHeaders() })
+      .then((response) => {
+        if (!response.ok) throw new Error(`Server error: ${response.status}`);
+        return response.blob();
+      })
+      .then((blob) => {
+        if (cancelled) return;
+        url = URL.createObjectURL(blob);
+        setObjectUrl(url);
+      })
+      .catch(() => {
+        if (!cancelled) setFailed(true);
+      });
+    return () => {
+      cancelled = true;
+      if (url) URL.revokeObjectURL(url);
+    };
+  }, [src, isPrivate]);
+
+  // On failure the plain src fails too, so the caller's onError fallback still runs
+  if (!isPrivate || failed) return <img src={src} {...props} />;
+  return <img src={objectUrl || undefined} {...props} />;
+}
@@ -1,6 +1,8 @@
 import React, { useState } from 'react';
 import '../pages/UserPage.css'; // Assuming common styles for .chic-button etc.
 import '../pages/HomeHero.css'; // For .upload-modal-bg, .upload-modal if we reuse them
+import { waitForUploadJob } from '../uploadJob';
+import { authHeaders } from '../auth';
 
 const BACKEND_URL = 'http://localhost:5000';
 
@@ -39,14 +41,20 @@ export default function UploadModal({ onClose, onUploadComplete }) {
       const response = await fetch(`${BACKEND_URL}/api/upload`, {
         method: 'POST',
         body: formData,
-        // Headers for FormData are set automatically by the browser
+        // Content-Type for FormData is set automatically by the browser
+        headers: authHeaders(),
       });
 
       const data = await response.json();
 
-      if (response.ok && data.success && data.allImages) {
-        console.log('Modal Upload successful:', data);
-        onUploadComplete(data.allImages); // Pass all images back to parent
+      if (response.ok && data.success && data.statusUrl) {
+        console.log('Modal Upload queued:', data);
+        const { job, allImages } = await waitForUploadJob(BACKEND_URL, data.statusUrl);
+        if (job && job.state === 'failed') {
+          setUploadError('Resimler işlenemedi.');
+          return;
+        }
+        onUploadComplete(allImages); // Pass all images back to parent
         // Reset internal state and close
         setPhotosPreview([]);
         setFilesToUpload([]);
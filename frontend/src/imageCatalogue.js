@@ -0,0 +1,26 @@
+import { authHeaders } from './auth';
+
+// Reads every page of /api/images: the logged-in user's wardrobe, or with
+// scope 'catalogue' the shared images. Pages are revalidated with their
+// ETag, so pages that did not change come back as 304 from the browser cache.
+export async function fetchAllImages(backendUrl, { pageSize = 200, scope = null } = {}) {
+  const images = [];
+  let cursor = null;
+  do {
+    const params = new URLSearchParams({ limit: String(pageSize) });
+    if (scope) {
+      params.set('scope', scope);
+    }
+    if (cursor) {
+      params.set('cursor', cursor);
+    }
+    const response = await fetch(`${backendUrl}/api/images?${params}`, { cache: 'no-cache', headers: authHeaders() });
+    if (!response.ok) {
+      throw new Error(`Server error: ${response.status}`);
+    }
+    const page = await response.json();
+    images.push(...page.images);
+    cursor = page.nextCursor;
+  } while (cursor);
+  return images;
+}
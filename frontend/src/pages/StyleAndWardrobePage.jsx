@@ -2,6 +2,9 @@ import React, { useState, useEffect } from 'react';
 import './UserPage.css';
 import { useLocation } from 'react-router-dom';
 import UploadModal from '../components/UploadModal';
+import AuthImage from '../components/AuthImage';
+import { fetchAllImages as fetchImageCatalogue } from '../imageCatalogue';
+import { authHeaders, isLoggedIn } from '../auth';
 
 const styleOptions = [
   { value: 'casual', label: 'Casual' },
@@ -17,6 +20,8 @@ export default function StyleAndWardrobePage() {
   const [style, setStyle] = useState('casual');
   const [query, setQuery] = useState('');
   const [photos, setPhotos] = useState([]);
+  // Logged-in users list their wardrobe; the shared catalogue is shown (and searched) alongside it
+  const [catalogue, setCatalogue] = useState([]);
   const [matchedOutfits, setMatchedOutfits] = useState([]);
   const [isSearching, setIsSearching] = useState(false);
   const [isFetchingPhotos, setIsFetchingPhotos] = useState(true);
@@ -50,28 +55,20 @@ export default function StyleAndWardrobePage() {
     setIsFetchingPhotos(true);
     setFetchError('');
     try {
-      const response = await fetch(`${BACKEND_URL}/api/images`, {
-        headers: {
-          'Cache-Control': 'no-cache, no-store, must-revalidate',
-          'Pragma': 'no-cache',
-          'Expires': '0'
-        },
-        cache: 'no-store'
-      });
-      console.log('[StyleAndWardrobePage] fetchAllImages response status:', response.status);
-      if (response.ok) {
-        const data = await response.json();
-        console.log('[StyleAndWardrobePage] Images fetched successfully from API:', data);
-        setPhotos(data);
+      const images = await fetchImageCatalogue(BACKEND_URL);
+      console.log('[StyleAndWardrobePage] Images fetched successfully from API:', images.length);
+      setPhotos(images);
+      if (isLoggedIn()) {
+        // Without per-user partitions the wardrobe is the catalogue; list each image once
+        const wardrobeUrls = new Set(images.map((img) => img.url));
+        const shared = await fetchImageCatalogue(BACKEND_URL, { scope: 'catalogue' });
+        setCatalogue(shared.filter((img) => !wardrobeUrls.has(img.url)));
       } else {
-        const errorText = await response.text();
-        console.error('[StyleAndWardrobePage] Failed to fetch images from server:', response.status, errorText);
-        setFetchError(`Server error: ${response.status}`);
-        setPhotos([]); // Clear photos on error
+        setCatalogue([]);
       }
     } catch (error) {
       console.error('[StyleAndWardrobePage] Error fetching images:', error);
-      setFetchError(`Connection error: ${error.message}`);
+      setFetchError(error.message.startsWith('Server error') ? error.message : `Connection error: ${error.message}`);
       setPhotos([]); // Clear photos on error
     } finally {
       console.log('[StyleAndWardrobePage] fetchAllImages finally block, setting isFetchingPhotos to false.');
@@ -89,7 +86,7 @@ export default function StyleAndWardrobePage() {
     setSearchError('');
     setMatchedOutfits([]); // Clear previous results immediately
 
-    const payload = { query: query.trim(), style: style };
+    const payload = { query: query.trim(), style: style, includeCatalogue: isLoggedIn() };
     console.log('[StyleAndWardrobePage] Sending to /api/search:', payload);
 
     try {
@@ -97,6 +94,7 @@ export default function StyleAndWardrobePage() {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          ...authHeaders(),
         },
         body: JSON.stringify(payload), 
       });
@@ -124,11 +122,12 @@ export default function StyleAndWardrobePage() {
     }
   };
 
-  const getImageUrl = (path) => {
+  // Images are served with long-lived immutable caching (private for wardrobe images); `width` asks for a WebP thumbnail
+  const getImageUrl = (path, width) => {
     if (!path) return '';
     if (path.startsWith('http')) return path;
-    const timestamp = new Date().getTime();
-    return `${BACKEND_URL}${path.startsWith('/') ? '' : '/'}${path}?t=${timestamp}`;
+    const url = `${BACKEND_URL}${path.startsWith('/') ? '' : '/'}${path}`;
+    return width ? `${url}?w=${width}` : url;
   };
 
   const formatScore = (score) => {
@@ -222,11 +221,11 @@ export default function StyleAndWardrobePage() {
                   console.error('[StyleAndWardrobePage] Rendering photos: Invalid image object or URL at index', i, img);
                   return <div key={`error-${i}`} className="image-card-error">Invalid image data</div>;
                 }
-                const imageUrl = getImageUrl(img.url);
+                const imageUrl = getImageUrl(img.url, 256);
                 console.log(`[StyleAndWardrobePage] Rendering image ${i} with URL:`, imageUrl);
                 return (
                   <div key={img.id || img.filename || i} className="image-card">
-                    <img
+                    <AuthImage
                       src={imageUrl}
                       alt={`Clothing item ${img.filename || i + 1}`}
                       className="style-wardrobe-img"
@@ -247,15 +246,35 @@ export default function StyleAndWardrobePage() {
           )}
         </div>
 
+        {catalogue.length > 0 && (
+          <div className="catalogue-images-section" style={{ marginTop: '2rem' }}>
+            <h2 className="chic-subtitle" style={{ textAlign: 'center', marginBottom: '1rem' }}>
+              Katalog ({catalogue.length})
+            </h2>
+            <div className="style-wardrobe-imgs">
+              {catalogue.map((img, i) => (
+                <div key={img.id || img.filename || i} className="image-card">
+                  <AuthImage
+                    src={getImageUrl(img.url, 256)}
+                    alt={`Catalogue item ${img.filename || i + 1}`}
+                    className="style-wardrobe-img"
+                  />
+                  <div className="image-filename">{img.filename || 'Unnamed file'}</div>
+                </div>
+              ))}
+            </div>
+          </div>
+        )}
+
         <div className="matched-outfits-section" style={{marginTop: '2rem'}}>
           <h2 className="chic-subtitle" style={{textAlign: 'center'}}>Arama Sonuçları</h2>
           {matchedOutfits.length > 0 ? (
             <div className="matched-outfits">
               {matchedOutfits.map((outfit, i) => {
-                const imageUrl = getImageUrl(outfit.url);
+                const imageUrl = getImageUrl(outfit.url, 512);
                 return (
                   <div key={i} className="outfit-card">
-                    <img 
+                    <AuthImage 
                       src={imageUrl} 
                       alt={`Match ${i+1}`} 
                       className="outfit-img" 
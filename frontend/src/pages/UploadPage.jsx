@@ -1,6 +1,8 @@
 import React, { useState } from "react";
 import { useNavigate } from "react-router-dom";
 import "./UserPage.css";
+import { waitForUploadJob } from "../uploadJob";
+import { authHeaders } from "../auth";
 
 export default function UploadPage() {
   const [photos, setPhotos] = useState([]); // Blob önizleme linkleri
@@ -23,6 +25,7 @@ export default function UploadPage() {
       const response = await fetch("http://localhost:5000/api/upload", {
         method: "POST",
         body: formData,
+        headers: authHeaders(),
       });
 
       if (!response.ok) {
@@ -32,12 +35,13 @@ export default function UploadPage() {
       const data = await response.json();
       console.log("Upload successful:", data);
 
-      if (data.success && data.allImages) {
+      if (data.success && data.statusUrl) {
+        const { allImages } = await waitForUploadJob("http://localhost:5000", data.statusUrl);
         // Navigate to the style page with the new images
         navigate("/style-wardrobe", { 
           state: { 
             timestamp: new Date().getTime(),
-            images: data.allImages 
+            images: allImages 
           } 
         });
       } else {
@@ -0,0 +1,23 @@
+import { fetchAllImages } from './imageCatalogue';
+import { authHeaders } from './auth';
+
+// Uploads are processed in the background; poll the job until every file
+// is indexed, then fetch the refreshed image list.
+export async function waitForUploadJob(backendUrl, statusUrl, { intervalMs = 500, timeoutMs = 5 * 60 * 1000 } = {}) {
+  const deadline = Date.now() + timeoutMs;
+  let job = null;
+  while (Date.now() < deadline) {
+    const response = await fetch(`${backendUrl}${statusUrl}`, { headers: authHeaders() });
+    job = await response.json();
+    if (!response.ok) {
+      throw new Error(job.error || 'Upload job status could not be read');
+    }
+    if (job.state === 'done' || job.state === 'failed') {
+      break;
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+  }
+
+  const allImages = await fetchAllImages(backendUrl);
+  return { job, allImages };
+}